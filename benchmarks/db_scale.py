@@ -0,0 +1,369 @@
+"""Бенчмарк Database на больших объемах данных
+
+Заполняет БД синтетическими данными заданного объема (Likes, Favorites,
+Blacklist, search_cache, photo_cache, search_sessions), замеряет время
+каждого публичного метода Database и снимает планы выполнения его
+запросов (EXPLAIN ANALYZE, в откатываемой транзакции). Результат -
+JSON-отчет с отсортированными ключами, который удобно сравнивать между
+версиями (diff report-old.json report-new.json).
+
+Использует БД из .env (лучше отдельную): тестовые записи создаются
+в диапазоне ID, начиная с --base-id, и удаляются после замера (кроме
+случая --keep; с --skip-seed можно повторно замерить уже заполненную БД).
+Очистка кэша поиска (delete_expired_results, evict_oldest_results)
+удаляет любые записи search_cache, а не только тестовые, поэтому
+замеряется только с --evict-cache - на отдельной БД.
+
+Запуск из корня проекта:
+    python -m benchmarks.db_scale --likes 5000000 --favorites 1000000 --output report.json
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Tuple
+
+from database import Database
+
+SEED_MARKER = 'db_scale'
+MAX_VK_ID = 2 ** 31 - 1
+
+
+class Volumes:
+    """Диапазоны ID синтетических данных"""
+
+    def __init__(self, base_id: int, users: int, likes: int, favorites: int, blacklist: int,
+                 search_cache: int, photo_cache: int, sessions: int) -> None:
+        self.base_id = base_id
+        self.users = users
+        self.likes = likes
+        self.favorites = favorites
+        self.blacklist = blacklist
+        self.search_cache = search_cache
+        self.photo_cache = photo_cache
+        self.sessions = sessions
+
+        # Пользователи бота: [base_id, base_id + users); кандидаты - после них,
+        # за ними - ID для новых записей во время замеров
+        self.first_target = base_id + users
+        self.first_fresh = self.first_target + favorites + blacklist + max(likes, photo_cache)
+        self.last_id = self.first_fresh + 1_000_000
+        if self.last_id > MAX_VK_ID:
+            raise ValueError("ID выходят за пределы INTEGER: уменьшите --base-id или объемы")
+
+    def user(self, rng: random.Random) -> int:
+        """Случайный пользователь бота из заполненного диапазона"""
+        return self.base_id + rng.randrange(self.users)
+
+    def as_dict(self) -> Dict[str, int]:
+        """Объемы для отчета"""
+        return {name: getattr(self, name) for name in (
+            'users', 'likes', 'favorites', 'blacklist', 'search_cache', 'photo_cache', 'sessions'
+        )}
+
+
+def seed(db: Database, volumes: Volumes) -> None:
+    """Заполняет таблицы запросами INSERT ... SELECT generate_series на стороне сервера"""
+    v = volumes
+    steps: List[Tuple[str, str, Tuple]] = [
+        ('Users', """
+            INSERT INTO Users (vk_id, first_name, last_name, age, sex, city)
+            SELECT %s + g, 'Имя' || g, 'Фамилия' || g, 18 + g %% 40, (1 + g %% 2)::text, 'Москва'
+            FROM generate_series(0, %s - 1) AS g
+            ON CONFLICT (vk_id) DO NOTHING;
+        """, (v.base_id, v.users)),
+        # Лайки, избранное и ЧС распределены по пользователям равномерно,
+        # даты - за последний год
+        ('Likes', """
+            INSERT INTO Likes (user_id, liked_user_id, photo_id, liked_at)
+            SELECT %s + g %% %s, %s + g / 3, g, now() - random() * interval '365 days'
+            FROM generate_series(0, %s - 1) AS g
+            ON CONFLICT (user_id, photo_id) DO NOTHING;
+        """, (v.base_id, v.users, v.first_target, v.likes)),
+        ('Favorites', """
+            INSERT INTO Favorites (user_id, favorite_vk_id, added_date)
+            SELECT %s + g %% %s, %s + g, now() - random() * interval '365 days'
+            FROM generate_series(0, %s - 1) AS g
+            ON CONFLICT (user_id, favorite_vk_id) DO NOTHING;
+        """, (v.base_id, v.users, v.first_target, v.favorites)),
+        ('Blacklist', """
+            INSERT INTO Blacklist (user_id, blocked_vk_id, blocked_date)
+            SELECT %s + g %% %s, %s + %s + g, now() - random() * interval '365 days'
+            FROM generate_series(0, %s - 1) AS g
+            ON CONFLICT (user_id, blocked_vk_id) DO NOTHING;
+        """, (v.base_id, v.users, v.first_target, v.favorites, v.blacklist)),
+        # Страница поиска из 50 кандидатов; каждая десятая запись уже устарела
+        ('search_cache', """
+            WITH page AS (
+                SELECT jsonb_agg(jsonb_build_object(
+                    'id', i, 'first_name', 'Имя', 'last_name', 'Фамилия', 'sex', 1,
+                    'bdate', '1.1.1995', 'city', jsonb_build_object('id', 1, 'title', 'Москва'),
+                    'interests', 'музыка, книги'
+                )) AS results
+                FROM generate_series(1, 50) AS i
+            )
+            INSERT INTO search_cache (query_hash, search_params, results, expires_at, size_bytes)
+            SELECT %s || ':' || %s || ':' || g, jsonb_build_object(%s, %s, 'offset', g),
+                   page.results,
+                   now() + CASE WHEN g %% 10 = 0 THEN -interval '1 hour' ELSE interval '24 hours' END,
+                   length(page.results::text)
+            FROM generate_series(0, %s - 1) AS g, page
+            ON CONFLICT (query_hash) DO NOTHING;
+        """, (SEED_MARKER, v.base_id, SEED_MARKER, v.base_id, v.search_cache)),
+        ('photo_cache', """
+            INSERT INTO photo_cache (owner_id, photos, expires_at)
+            SELECT %s + g, jsonb_build_array(
+                jsonb_build_object('id', g * 3, 'owner_id', %s + g, 'likes', jsonb_build_object('count', 10)),
+                jsonb_build_object('id', g * 3 + 1, 'owner_id', %s + g, 'likes', jsonb_build_object('count', 5)),
+                jsonb_build_object('id', g * 3 + 2, 'owner_id', %s + g, 'likes', jsonb_build_object('count', 1))
+            ), now() + interval '24 hours'
+            FROM generate_series(0, %s - 1) AS g
+            ON CONFLICT (owner_id) DO NOTHING;
+        """, (v.first_target,) * 4 + (v.photo_cache,)),
+        # Сессия поиска: 200 ID кандидатов (int64) и курсор
+        ('search_sessions', """
+            INSERT INTO search_sessions (user_id, candidates, position, search_params, cursor, updated_at)
+            SELECT %s + g, decode(repeat('00', 1600), 'hex'), g %% 200,
+                   jsonb_build_object('sex', 1, 'age_from', 20, 'age_to', 30),
+                   '[[25, 26, 27, 28, 29, 30], 200]'::jsonb, now()
+            FROM generate_series(0, LEAST(%s, %s) - 1) AS g
+            ON CONFLICT (user_id) DO NOTHING;
+        """, (v.base_id, v.sessions, v.users)),
+    ]
+
+    for table, query, params in steps:
+        started = time.perf_counter()
+        db._execute(query, params)
+        print(f"  {table:<16} {time.perf_counter() - started:>8.1f} с")
+    for table in ('Users', 'Likes', 'Favorites', 'Blacklist', 'search_cache', 'photo_cache', 'search_sessions'):
+        db._execute(f"ANALYZE {table};")
+
+
+def cleanup(db: Database, volumes: Volumes) -> None:
+    """Удаляет синтетические данные и записи, созданные замерами"""
+    v = volumes
+    for table in ('Likes', 'Favorites', 'Blacklist', 'search_sessions'):
+        db._execute(f"DELETE FROM {table} WHERE user_id BETWEEN %s AND %s;", (v.base_id, v.last_id))
+    db._execute("DELETE FROM photo_cache WHERE owner_id BETWEEN %s AND %s;", (v.base_id, v.last_id))
+    db._execute("DELETE FROM search_cache WHERE search_params ->> %s = %s;", (SEED_MARKER, str(v.base_id)))
+    db._execute("DELETE FROM Users WHERE vk_id BETWEEN %s AND %s;", (v.base_id, v.last_id))
+
+
+def table_sizes(db: Database) -> Dict[str, Dict[str, int]]:
+    """Фактическое число строк (по статистике) и размер таблиц с индексами"""
+    rows = db._execute("""
+        SELECT relname, n_live_tup, pg_total_relation_size(relid)
+        FROM pg_stat_user_tables
+        WHERE relname IN ('users', 'likes', 'favorites', 'blacklist',
+                          'search_cache', 'photo_cache', 'search_sessions');
+    """, fetch='all')
+    return {row[0]: {'rows': row[1], 'bytes': row[2]} for row in rows}
+
+
+def benchmark_calls(db: Database, volumes: Volumes, rng: random.Random,
+                    evict: bool = False) -> Dict[str, Callable[[], Any]]:
+    """
+    Вызовы публичных методов Database на заполненных данных. Методы
+    записи каждый раз пишут новые строки; очистка кэша поиска (только
+    при evict) идет последней, так как удаляет заполненные записи
+    """
+    v = volumes
+    fresh = iter(range(v.first_fresh, v.last_id))
+    cached_params = [{SEED_MARKER: v.base_id, 'hot': i} for i in range(100)]
+    photos = {v.first_target + i: [{'id': i, 'owner_id': v.first_target + i, 'likes': {'count': 1}}]
+              for i in range(10)}
+
+    def user() -> int:
+        return v.user(rng)
+
+    def liked_photo() -> Tuple[int, int]:
+        # Заполненный лайк: фото g поставлено пользователем base_id + g % users
+        g = rng.randrange(v.likes or 1)
+        return v.base_id + g % v.users, g
+
+    def blocked() -> Tuple[int, int]:
+        g = rng.randrange(v.blacklist or 1)
+        return v.base_id + g % v.users, v.first_target + v.favorites + g
+
+    def session(user_id: int) -> None:
+        db.save_session(user_id, bytes(1600), 10, {'sex': 1, 'age_from': 20, 'age_to': 30},
+                        ((25, 26, 27, 28, 29, 30), 200))
+
+    calls = {
+        'check_connection': db.check_connection,
+        'user_exists': lambda: db.user_exists(user()),
+        'add_user': lambda: db.add_user(user(), 'Имя', 'Фамилия', 30, '2', 'Москва'),
+        'add_like': lambda: db.add_like(user(), v.first_target, next(fresh)),
+        'has_liked_photo': lambda: db.has_liked_photo(*liked_photo()),
+        'get_user_likes': lambda: db.get_user_likes(user()),
+        'add_favorite': lambda: db.add_favorite(user(), next(fresh)),
+        'get_favorites': lambda: db.get_favorites(user()),
+        'add_to_blacklist': lambda: db.add_to_blacklist(user(), next(fresh)),
+        'check_blacklist': lambda: db.check_blacklist(*blocked()),
+        'get_excluded_ids': lambda: db.get_excluded_ids(user()),
+        'cache_results': lambda: db.cache_results(rng.choice(cached_params), [{'id': 1}] * 50),
+        'get_cached_results': lambda: db.get_cached_results(rng.choice(cached_params)),
+        'cache_results_many': lambda: db.cache_results_many(
+            [(params, [{'id': 1}] * 50) for params in rng.sample(cached_params, 11)]),
+        'get_cached_results_many': lambda: db.get_cached_results_many(rng.sample(cached_params, 11)),
+        'cache_photos': lambda: db.cache_photos(photos),
+        'get_cached_photos': lambda: db.get_cached_photos(
+            [v.first_target + rng.randrange(v.photo_cache or 1) for _ in range(10)]),
+        'save_session': lambda: session(user()),
+        'load_session': lambda: db.load_session(user()),
+        'delete_session': lambda: db.delete_session(user()),
+        'flush_writes': db.flush_writes,
+        'search_cache_stats': db.search_cache_stats,
+    }
+    if evict:
+        # Удаляют записи всего кэша, в том числе не тестовые
+        calls['delete_expired_results'] = lambda: db.delete_expired_results(100)
+        calls['evict_oldest_results'] = lambda: db.evict_oldest_results(100)
+    return calls
+
+
+def measure(db: Database, call: Callable[[], Any], iterations: int) -> Dict[str, Any]:
+    """Время вызовов (мс) и число запросов к БД на вызов"""
+    timings = []
+    with db.count_queries() as counter:
+        for _ in range(iterations):
+            started = time.perf_counter()
+            call()
+            timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+
+    def percentile(q: float) -> float:
+        return round(timings[min(len(timings) - 1, int(len(timings) * q))], 3)
+
+    return {
+        'iterations': iterations,
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'p50_ms': percentile(0.5),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'max_ms': round(timings[-1], 3),
+        'queries_per_call': round(counter.queries / iterations, 2),
+    }
+
+
+def plan_nodes(plan: Dict) -> List[str]:
+    """Узлы плана в виде строк "тип на таблице using индекс" - для короткого diff"""
+    node = plan['Node Type']
+    if 'Relation Name' in plan:
+        node += f" on {plan['Relation Name']}"
+    if 'Index Name' in plan:
+        node += f" using {plan['Index Name']}"
+    return [node] + [child for sub in plan.get('Plans', ()) for child in plan_nodes(sub)]
+
+
+def explain(db: Database, call: Callable[[], Any]) -> List[Dict[str, Any]]:
+    """
+    Планы запросов одного вызова: запросы перехватываются счетчиком
+    Database.count_queries и выполняются повторно под EXPLAIN ANALYZE
+    в транзакции, которая затем откатывается
+    """
+    with db.count_queries() as counter:
+        call()
+
+    plans = []
+    conn = db.pool.getconn()
+    try:
+        for statement, params in zip(counter.statements, counter.params):
+            if not statement.lstrip().upper().startswith(('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')):
+                continue
+            with conn.cursor() as cur:
+                cur.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {statement}", params)
+                result = cur.fetchone()[0][0]
+            conn.rollback()
+            plans.append({
+                'statement': ' '.join(statement.split()),
+                'nodes': plan_nodes(result['Plan']),
+                'planning_ms': result.get('Planning Time'),
+                'execution_ms': result.get('Execution Time'),
+                'plan': result['Plan'],
+            })
+    finally:
+        conn.rollback()
+        db.pool.putconn(conn)
+    return plans
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--likes', type=int, default=1_000_000)
+    parser.add_argument('--favorites', type=int, default=1_000_000)
+    parser.add_argument('--blacklist', type=int, default=1_000_000)
+    parser.add_argument('--search-cache', type=int, default=200_000)
+    parser.add_argument('--photo-cache', type=int, default=100_000)
+    parser.add_argument('--sessions', type=int, default=10_000)
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--base-id', type=int, default=2_100_000_000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='db_scale_report.json')
+    parser.add_argument('--skip-seed', action='store_true', help="данные уже заполнены (--keep)")
+    parser.add_argument('--keep', action='store_true', help="не удалять данные после замера")
+    parser.add_argument('--evict-cache', action='store_true',
+                        help="замерять очистку кэша поиска (удаляет и не тестовые записи - только на отдельной БД)")
+    args = parser.parse_args()
+
+    volumes = Volumes(args.base_id, args.users, args.likes, args.favorites, args.blacklist,
+                      args.search_cache, args.photo_cache, args.sessions)
+    rng = random.Random(args.seed)
+    db = Database()
+
+    try:
+        if not args.skip_seed:
+            print("Заполнение:")
+            seed(db, volumes)
+
+        calls = benchmark_calls(db, volumes, rng, evict=args.evict_cache)
+        if not args.evict_cache:
+            print("Очистка кэша поиска не замеряется (нужен --evict-cache и отдельная БД)")
+
+        # Планы снимаются с обычными запросами: EXECUTE подготовленного запроса
+        # нельзя повторить на другом соединении
+        prepared = db.use_prepared
+        db.use_prepared = False
+        plans = {name: explain(db, call) for name, call in calls.items()}
+        db.use_prepared = prepared
+
+        methods = {}
+        print(f"\n{'метод':<24} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'запросов':>9}")
+        for name, call in calls.items():
+            measure(db, call, min(50, args.iterations))  # прогрев
+            result = measure(db, call, args.iterations)
+            result['plans'] = plans[name]
+            methods[name] = result
+            print(f"{name:<24} {result['p50_ms']:>9.3f} {result['p95_ms']:>9.3f} "
+                  f"{result['p99_ms']:>9.3f} {result['queries_per_call']:>9}")
+
+        server_version = db._execute("SHOW server_version;", fetch='one')[0]
+        report = {
+            'generated_at': datetime.now().isoformat(timespec='seconds'),
+            'server_version': server_version,
+            'schema_version': db.schema_version,
+            'settings': {
+                'iterations': args.iterations,
+                'prepared': db.use_prepared,
+                'write_behind': db.write_buffer is not None,
+                'seed': args.seed,
+                'evict_cache': args.evict_cache,
+            },
+            'volumes': volumes.as_dict(),
+            'tables': table_sizes(db),
+            'methods': methods,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True, default=str)
+        print(f"\nОтчет записан в {args.output}")
+    finally:
+        if not args.keep:
+            cleanup(db, volumes)
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
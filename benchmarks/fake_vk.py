@@ -0,0 +1,393 @@
+"""Локальная заглушка VK API для нагрузочных тестов
+
+Отвечает на методы, которые вызывает бот (users.search, users.get,
+photos.get, photos.getUserPhotos, likes.add, messages.send, execute,
+groups.getById, messages.getLongPollServer, groups.getLongPollServer,
+messages.sendMessageEventAnswer), и сама работает сервером LongPoll
+сообщений и Bots Long Poll: сообщения симулированных пользователей
+кладутся в очередь событий через push_message, нажатия callback-кнопок -
+через push_event, ответы бота копятся во входящих.
+
+Данные детерминированы: выдача поиска зависит только от параметров
+запроса, профиль и фото - только от ID. Задержка ответа и доля ошибок
+(коды 6 и 10) задаются при создании сервера. Ошибки выдаются только
+для методов с данными - сообщения и служебные вызовы не сбоят.
+
+Бот направляется на заглушку переменной VK_API_BASE_URL.
+"""
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+# Методы, для которых имитируются ошибки
+FAILING_METHODS = {'users.search', 'users.get', 'photos.get', 'photos.getUserPhotos', 'likes.add'}
+ERRORS = {
+    6: 'Too many requests per second',
+    10: 'Internal server error',
+}
+
+# Тип события LongPoll "новое сообщение"
+MESSAGE_NEW = 4
+
+# ID сообщества, от имени которого работает бот
+GROUP_ID = 1
+
+_API_CALL = re.compile(r'API\.([\w.]+)\(')
+_ONE_METHOD = re.compile(r'API\.([\w.]+)\(values\[i\]\)')
+
+Reply = Dict[str, Any]
+
+
+class FakeVk:
+    """Заглушка VK API и серверов LongPoll на локальном порту"""
+
+    def __init__(self, port: int = 0, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 error_rate: float = 0.0, search_size: int = 200, candidate_base: int = 2_060_000_000,
+                 seed: int = 0) -> None:
+        """
+        Args:
+            port: Порт (0 - любой свободный)
+            latency_ms: Задержка ответа на вызов метода, мс
+            jitter_ms: Случайная добавка к задержке (0..jitter_ms), мс
+            error_rate: Доля вызовов методов с данными, завершающихся ошибкой
+            search_size: Количество результатов поиска на каждый возраст
+            candidate_base: Начало диапазона ID найденных пользователей
+            seed: Зерно генератора задержек и ошибок
+        """
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.search_size = search_size
+        self.candidate_base = candidate_base
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+        # Очередь событий: ts - индекс следующего события. Событие хранится в формате
+        # LongPoll сообщений (None - только для Bots Long Poll) и Bots Long Poll
+        self._updates: List[Tuple[Optional[list], Dict]] = []
+        self._updates_cond = threading.Condition()
+        self._message_id = 0
+        self._closing = False
+
+        # Ответы бота по ID пользователя
+        self._inbox: Dict[int, List[Reply]] = {}
+        self._inbox_cond = threading.Condition()
+
+        # Статистика вызовов
+        self.calls: Counter = Counter()
+        self.errors: Counter = Counter()
+
+        handler = type('FakeVkHandler', (_Handler,), {'vk': self})
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        """Адрес заглушки для VK_API_BASE_URL"""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self) -> None:
+        """Запускает сервер в фоновом потоке"""
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-vk", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Будит ожидающие запросы LongPoll и останавливает сервер"""
+        with self._updates_cond:
+            self._closing = True
+            self._updates_cond.notify_all()
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    # Симулированные пользователи
+
+    def push_message(self, user_id: int, text: str, payload: Optional[str] = None) -> None:
+        """Кладет в LongPoll входящее сообщение пользователя (payload - строка JSON кнопки)"""
+        with self._updates_cond:
+            self._message_id += 1
+            extra = {'title': ' ... '}
+            message = {
+                'id': self._message_id, 'date': int(time.time()), 'peer_id': user_id,
+                'from_id': user_id, 'text': text
+            }
+            if payload:
+                extra['payload'] = message['payload'] = payload
+            self._updates.append((
+                [MESSAGE_NEW, self._message_id, 1, user_id, int(time.time()), text, extra, {}],
+                {'type': 'message_new', 'object': {'message': message}, 'group_id': GROUP_ID}
+            ))
+            self._updates_cond.notify_all()
+
+    def push_event(self, user_id: int, payload: str) -> None:
+        """Кладет в Bots Long Poll нажатие callback-кнопки (payload - строка JSON кнопки)"""
+        with self._updates_cond:
+            event_id = f"event{len(self._updates)}"
+            self._updates.append((None, {
+                'type': 'message_event',
+                'object': {'user_id': user_id, 'peer_id': user_id, 'event_id': event_id,
+                           'payload': json.loads(payload)},
+                'group_id': GROUP_ID
+            }))
+            self._updates_cond.notify_all()
+
+    def inbox_size(self, user_id: int) -> int:
+        """Сколько сообщений бот отправил пользователю"""
+        with self._inbox_cond:
+            return len(self._inbox.get(user_id, ()))
+
+    def wait_reply(self, user_id: int, after: int, timeout: float,
+                   done: Callable[[Reply], bool] = lambda reply: True) -> Optional[Reply]:
+        """
+        Ждет ответа бота пользователю
+
+        Args:
+            user_id: ID пользователя
+            after: Количество сообщений во входящих до отправки команды
+            timeout: Максимальное время ожидания, секунд
+            done: Условие ответа, завершающего команду
+
+        Returns:
+            Первый подходящий ответ или None по таймауту
+        """
+        deadline = time.monotonic() + timeout
+        with self._inbox_cond:
+            while True:
+                replies = self._inbox.get(user_id, [])
+                for reply in replies[after:]:
+                    if done(reply):
+                        return reply
+                after = len(replies)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._inbox_cond.wait(remaining)
+
+    # Методы API
+
+    def call(self, method: str, params: Dict[str, Any]) -> Tuple[Any, Optional[Dict]]:
+        """Выполняет метод: (результат, ошибка VK API)"""
+        self.calls[method] += 1
+        if method in FAILING_METHODS and self.error_rate:
+            with self._random_lock:
+                failed = self._random.random() < self.error_rate
+                code = self._random.choice(list(ERRORS))
+            if failed:
+                self.errors[method] += 1
+                return None, {'method': method, 'error_code': code, 'error_msg': ERRORS[code]}
+
+        handler = getattr(self, '_' + method.replace('.', '_'), None)
+        if handler is None:
+            return None, {'method': method, 'error_code': 3, 'error_msg': 'Unknown method passed'}
+        return handler(params), None
+
+    def _users_search(self, params: Dict[str, Any]) -> Dict:
+        age_from = int(params.get('age_from', 18))
+        age_to = int(params.get('age_to', age_from))
+        sex = int(params.get('sex', 1))
+        offset = int(params.get('offset', 0))
+        count = int(params.get('count', 20))
+
+        total = self.search_size * (age_to - age_from + 1)
+        items = []
+        for i in range(offset, min(offset + count, total)):
+            age = age_from + i // self.search_size
+            user_id = self.candidate_base + ((sex * 100 + age) * self.search_size + i % self.search_size)
+            items.append({**self._profile(user_id), 'sex': sex, 'bdate': f"1.1.{time.localtime().tm_year - age}"})
+        return {'count': total, 'items': items}
+
+    def _users_get(self, params: Dict[str, Any]) -> List[Dict]:
+        return [self._profile(int(user_id)) for user_id in str(params.get('user_ids', '')).split(',') if user_id]
+
+    def _photos_get(self, params: Dict[str, Any]) -> Dict:
+        owner_id = int(params['owner_id'])
+        items = [
+            {'id': owner_id % 1_000_000 * 10 + i, 'owner_id': owner_id, 'likes': {'count': (owner_id + i * 7) % 50}}
+            for i in range(3)
+        ]
+        return {'count': len(items), 'items': items}
+
+    def _photos_getUserPhotos(self, params: Dict[str, Any]) -> Dict:
+        return {'count': 0, 'items': []}
+
+    def _likes_add(self, params: Dict[str, Any]) -> Dict:
+        return {'likes': 1}
+
+    def _groups_getById(self, params: Dict[str, Any]) -> List[Dict]:
+        return [{'id': GROUP_ID, 'name': 'Fake VK group', 'screen_name': 'fake'}]
+
+    def _groups_getLongPollServer(self, params: Dict[str, Any]) -> Dict:
+        with self._updates_cond:
+            return {'key': 'fake', 'server': 'https://api.vk.com/bots_lp', 'ts': str(len(self._updates))}
+
+    def _messages_sendMessageEventAnswer(self, params: Dict[str, Any]) -> int:
+        return 1
+
+    def _messages_getLongPollServer(self, params: Dict[str, Any]) -> Dict:
+        with self._updates_cond:
+            return {'key': 'fake', 'server': 'api.vk.com/lp', 'ts': len(self._updates), 'pts': len(self._updates)}
+
+    def _messages_send(self, params: Dict[str, Any]) -> int:
+        user_id = int(params['user_id'])
+        reply = {
+            'time': time.perf_counter(),
+            'message': params.get('message', ''),
+            'buttons': self._buttons(params.get('keyboard')),
+            'callback': self._has_callback(params.get('keyboard'))
+        }
+        with self._inbox_cond:
+            self._inbox.setdefault(user_id, []).append(reply)
+            self._inbox_cond.notify_all()
+        return len(self._inbox[user_id])
+
+    def execute(self, code: str) -> Dict:
+        """Выполняет код execute в формате vk_api.VkRequestsPool"""
+        calls = []
+        if code.lstrip().startswith('var values'):
+            # Один метод для списка параметров (vk_api.requests_pool.vk_one_method)
+            start = code.index('=') + 1
+            values, _ = json.JSONDecoder().raw_decode(code[start:].lstrip())
+            method = _ONE_METHOD.search(code).group(1)
+            calls = [(method, value) for value in values]
+        else:
+            # return [API.a({...}),API.b({...})];
+            decoder = json.JSONDecoder()
+            for match in _API_CALL.finditer(code):
+                value, _ = decoder.raw_decode(code, match.end())
+                calls.append((match.group(1), value))
+
+        response, errors = [], []
+        for method, params in calls:
+            result, error = self.call(method, params)
+            if error:
+                response.append(False)
+                errors.append(error)
+            else:
+                response.append(result)
+        body = {'response': response}
+        if errors:
+            body['execute_errors'] = errors
+        return body
+
+    def poll(self, ts: int, wait: float, bots: bool = False) -> Dict:
+        """Ответ сервера LongPoll (bots - Bots Long Poll): события начиная с ts"""
+        deadline = time.monotonic() + wait
+        with self._updates_cond:
+            if ts > len(self._updates):
+                # Позиция из другого запуска заглушки - как устаревшая история у VK
+                return {'failed': 1, 'ts': str(len(self._updates)) if bots else len(self._updates)}
+            while len(self._updates) <= ts and not self._closing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._updates_cond.wait(remaining)
+            updates = self._updates[ts:]
+            if bots:
+                return {'ts': str(len(self._updates)), 'updates': [update for _, update in updates]}
+            return {
+                'ts': len(self._updates), 'pts': len(self._updates),
+                'updates': [update for update, _ in updates if update is not None]
+            }
+
+    def delay(self) -> None:
+        """Имитирует задержку сети и обработки на стороне VK"""
+        if not self.latency and not self.jitter:
+            return
+        with self._random_lock:
+            extra = self._random.uniform(0, self.jitter)
+        time.sleep(self.latency + extra)
+
+    @staticmethod
+    def _profile(user_id: int) -> Dict:
+        """Детерминированный профиль пользователя"""
+        sex = 1 + user_id % 2
+        age = 18 + user_id % 30
+        return {
+            'id': user_id,
+            'first_name': f"Имя{user_id % 1000}",
+            'last_name': f"Фамилия{user_id % 997}",
+            'sex': sex,
+            'bdate': f"1.1.{time.localtime().tm_year - age}",
+            'city': {'id': 1, 'title': 'Москва'},
+            'interests': 'музыка, книги, путешествия'
+        }
+
+    @staticmethod
+    def _has_callback(keyboard: Optional[str]) -> bool:
+        """Есть ли в клавиатуре callback-кнопки"""
+        if not keyboard:
+            return False
+        rows = json.loads(keyboard).get('buttons', [])
+        return any(button.get('action', {}).get('type') == 'callback' for row in rows for button in row)
+
+    @staticmethod
+    def _buttons(keyboard: Optional[str]) -> Dict[str, str]:
+        """Payload кнопок клавиатуры по типу действия"""
+        if not keyboard:
+            return {}
+        buttons = {}
+        for row in json.loads(keyboard).get('buttons', []):
+            for button in row:
+                payload = button.get('action', {}).get('payload')
+                if payload:
+                    buttons[json.loads(payload).get('type')] = payload
+        return buttons
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """HTTP-часть заглушки: POST /method/<имя>, GET /lp и GET /bots_lp"""
+
+    protocol_version = 'HTTP/1.1'
+    vk: FakeVk
+
+    def do_POST(self) -> None:
+        path = urlsplit(self.path).path
+        if not path.startswith('/method/'):
+            self.send_error(404)
+            return
+        method = path[len('/method/'):]
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode('utf-8'), keep_blank_values=True)
+        params = {key: values[-1] for key, values in form.items()}
+
+        self.vk.delay()
+        if method == 'execute':
+            self.vk.calls['execute'] += 1
+            body = self.vk.execute(params.get('code', ''))
+        else:
+            result, error = self.vk.call(method, params)
+            body = {'error': {**error, 'request_params': []}} if error else {'response': result}
+        self._reply(body)
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        if url.path not in ('/lp', '/bots_lp'):
+            self.send_error(404)
+            return
+        query = parse_qs(url.query)
+        self._reply(self.vk.poll(
+            int(query.get('ts', ['0'])[0]),
+            float(query.get('wait', ['25'])[0]),
+            bots=url.path == '/bots_lp'
+        ))
+
+    def _reply(self, body: Dict) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # Тысячи запросов в секунду не выводятся в консоль
+        pass
@@ -0,0 +1,205 @@
+"""Нагрузочный тест бота с локальной заглушкой VK API
+
+Запускает benchmarks.fake_vk, направляет на нее бота (VK_API_BASE_URL)
+и поднимает Bot в этом же процессе. Симулированные пользователи пишут
+"поиск" и нажимают кнопки карточки ("Дальше", лайк, избранное, ЧС);
+время действия - от отправки сообщения до ответа бота, завершающего
+действие (для ЧС - до следующей карточки). С --longpoll bots бот
+читает Bots Long Poll, а кнопки карточки приходят нажатиями
+callback-кнопок. В конце выводятся
+пропускная способность и p50/p95/p99 по каждому действию, а также
+число вызовов методов заглушки.
+
+Нужна БД из .env (лучше отдельная): тестовые пользователи создаются
+в диапазоне ID, начиная с --base-id, и удаляются после замера.
+Ограничения частоты запросов VK_GROUP_RPS/VK_USER_RPS по умолчанию
+снимаются, чтобы измерять сам бот; чтобы учесть лимиты VK, задайте
+их явно.
+
+Запуск из корня проекта:
+    python -m benchmarks.loadtest --users 2000 --concurrency 200 --latency-ms 30 --error-rate 0.01
+"""
+import argparse
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from benchmarks.fake_vk import GROUP_ID, FakeVk, Reply
+
+# Действия после поиска и их доли
+ACTIONS = (('next', 0.55), ('like', 0.2), ('add_fav', 0.15), ('block', 0.1))
+# Текст кнопок карточки (как в VKHandler.create_keyboard)
+BUTTON_TEXT = {'next': '➡️ Дальше', 'like': '👍 Лайк', 'add_fav': '❤️ В избранное', 'block': '🚫 ЧС'}
+
+
+def percentile(timings: List[float], q: float) -> float:
+    """Перцентиль отсортированного списка"""
+    return timings[min(len(timings) - 1, int(len(timings) * q))]
+
+
+def completes(action: str) -> Callable[[Reply], bool]:
+    """Условие ответа, завершающего действие: ЧС завершается следующей карточкой"""
+    if action == 'block':
+        return lambda reply: not reply['message'].startswith('🚫')
+    return lambda reply: True
+
+
+def action_ends_search(reply: Reply) -> bool:
+    """Ответ, после которого листать дальше нечего"""
+    return reply['message'].startswith(('😔', '🔍'))
+
+
+class SimulatedUser:
+    """Пользователь бота: поиск и случайные действия с карточками"""
+
+    def __init__(self, vk: FakeVk, user_id: int, rng: random.Random, timeout: float) -> None:
+        self.vk = vk
+        self.user_id = user_id
+        self.rng = rng
+        self.timeout = timeout
+        self.card: Dict[str, str] = {}
+        self.callback = False
+
+    def run(self, actions: int) -> List[Tuple[str, Optional[float]]]:
+        """Выполняет поиск и actions действий: [(действие, время в мс или None по таймауту)]"""
+        results = [self.send('search', 'поиск')]
+        for _ in range(actions):
+            if 'next' not in self.card:
+                # Кандидаты закончились или карточка не пришла - новый поиск
+                results.append(self.send('search', 'поиск'))
+                continue
+            action = self.rng.choices([a for a, _ in ACTIONS], weights=[w for _, w in ACTIONS])[0]
+            results.append(self.send(action, BUTTON_TEXT[action], self.card[action]))
+        return results
+
+    def send(self, action: str, text: str, payload: Optional[str] = None) -> Tuple[str, Optional[float]]:
+        """Отправляет сообщение и ждет ответа бота"""
+        after = self.vk.inbox_size(self.user_id)
+        started = time.perf_counter()
+        if payload and self.callback:
+            self.vk.push_event(self.user_id, payload)
+        else:
+            self.vk.push_message(self.user_id, text, payload)
+        reply = self.vk.wait_reply(self.user_id, after, self.timeout, completes(action))
+        if reply is None:
+            return action, None
+        self.remember(reply)
+        return action, (reply['time'] - started) * 1000
+
+    def remember(self, reply: Reply) -> None:
+        """Запоминает кнопки последней карточки"""
+        if 'next' in reply['buttons']:
+            self.card = reply['buttons']
+            self.callback = reply['callback']
+        elif action_ends_search(reply):
+            self.card = {}
+
+
+def report(results: List[Tuple[str, Optional[float]]], elapsed: float, vk: FakeVk) -> None:
+    """Выводит задержки по действиям и статистику заглушки"""
+    timings: Dict[str, List[float]] = defaultdict(list)
+    timeouts: Dict[str, int] = defaultdict(int)
+    for action, ms in results:
+        if ms is None:
+            timeouts[action] += 1
+        else:
+            timings[action].append(ms)
+
+    done = sum(len(values) for values in timings.values())
+    print(f"\nДействий: {done} за {elapsed:.1f} с - {done / elapsed:.1f} в секунду, "
+          f"таймаутов: {sum(timeouts.values())}")
+    print(f"{'действие':<10} {'кол-во':>8} {'таймауты':>9} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9}")
+    for action in ['search'] + [a for a, _ in ACTIONS]:
+        values = sorted(timings.get(action, []))
+        if not values:
+            continue
+        print(f"{action:<10} {len(values):>8} {timeouts.get(action, 0):>9} "
+              f"{percentile(values, 0.5):>9.1f} {percentile(values, 0.95):>9.1f} {percentile(values, 0.99):>9.1f}")
+
+    print(f"\n{'метод VK API':<28} {'вызовов':>8} {'ошибок':>7}")
+    for method, count in vk.calls.most_common():
+        print(f"{method:<28} {count:>8} {vk.errors.get(method, 0):>7}")
+
+
+def cleanup(base_id: int, users: int) -> None:
+    """Удаляет записи тестовых пользователей"""
+    from database import Database
+
+    db = Database()
+    try:
+        last_id = base_id + users
+        for table in ('Likes', 'Favorites', 'Blacklist', 'search_sessions'):
+            db._execute(f"DELETE FROM {table} WHERE user_id BETWEEN %s AND %s;", (base_id, last_id))
+        db._execute("DELETE FROM Users WHERE vk_id BETWEEN %s AND %s;", (base_id, last_id))
+        db._execute("DELETE FROM longpoll_state WHERE group_id = %s;", (GROUP_ID,))
+    finally:
+        db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000, help="симулированных пользователей")
+    parser.add_argument('--concurrency', type=int, default=100, help="одновременно активных пользователей")
+    parser.add_argument('--actions', type=int, default=10, help="действий каждого пользователя после поиска")
+    parser.add_argument('--latency-ms', type=float, default=20, help="задержка ответа VK API")
+    parser.add_argument('--jitter-ms', type=float, default=10, help="случайная добавка к задержке")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="доля ошибок методов с данными")
+    parser.add_argument('--search-size', type=int, default=200, help="результатов поиска на возраст")
+    parser.add_argument('--timeout', type=float, default=30, help="ожидание ответа бота, секунд")
+    parser.add_argument('--base-id', type=int, default=2_050_000_000, help="первый ID пользователя")
+    parser.add_argument('--longpoll', choices=('user', 'bots'), default='user',
+                        help="LongPoll сообщений или Bots Long Poll сообщества")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    vk = FakeVk(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+                search_size=args.search_size, seed=args.seed)
+    vk.start()
+
+    # Бот работает только с заглушкой; настоящие токены из .env не используются
+    os.environ.update({
+        'VK_API_BASE_URL': vk.base_url,
+        'VK_TOKEN_GROUP': 'fake-group-token',
+        'VK_TOKEN_USER': 'fake-user-token',
+        'VK_ID': '1',
+        'LONGPOLL_MODE': args.longpoll,
+    })
+    os.environ.setdefault('VK_GROUP_RPS', '100000')
+    os.environ.setdefault('VK_USER_RPS', '100000')
+
+    from bot import Bot
+
+    bot = Bot()
+    bot_thread = threading.Thread(target=bot.run, name="bot", daemon=True)
+    bot_thread.start()
+
+    rng = random.Random(args.seed)
+    users = [
+        SimulatedUser(vk, args.base_id + i, random.Random(rng.random()), args.timeout)
+        for i in range(args.users)
+    ]
+
+    print(f"Пользователей: {args.users}, одновременно: {args.concurrency}, действий: {args.actions}, "
+          f"задержка VK: {args.latency_ms:g}±{args.jitter_ms:g} мс, ошибок: {args.error_rate:.1%}")
+    results: List[Tuple[str, Optional[float]]] = []
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for user_results in pool.map(lambda user: user.run(args.actions), users):
+                results.extend(user_results)
+        elapsed = time.perf_counter() - started
+    finally:
+        bot.stop()
+        vk.stop()
+        bot_thread.join(timeout=60)
+
+    report(results, elapsed, vk)
+    cleanup(args.base_id, args.users)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Бенчмарк подготовленных запросов (PREPARE/EXECUTE) к PostgreSQL
+
+Сравнивает задержку частых запросов Database с подготовкой и без нее.
+Использует БД из .env; тестовые записи создаются в диапазоне ID,
+начиная с --base-id, и удаляются после замера.
+
+Запуск из корня проекта:
+    python -m benchmarks.prepared --iterations 2000
+"""
+import argparse
+import statistics
+import time
+from typing import Callable, Dict, List
+
+from database import Database
+
+
+def measure(call: Callable[[], object], iterations: int) -> List[float]:
+    """Время каждого вызова в миллисекундах"""
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return timings
+
+
+def seed(db: Database, base_id: int, favorites: int) -> None:
+    """Создает тестового пользователя с избранным, ЧС, лайками и кэшем поиска"""
+    db.add_user(base_id, 'Бенчмарк', 'Тестовый', 30, '2', 'Москва')
+    for i in range(1, favorites + 1):
+        db.add_favorite(base_id, base_id + i)
+        db.add_to_blacklist(base_id, base_id + favorites + i)
+        db.add_like(base_id, base_id + i, base_id + i)
+    db.cache_results({'benchmark': base_id}, [{'id': base_id + 1}])
+    db.flush_writes()
+
+
+def cleanup(db: Database, base_id: int, favorites: int) -> None:
+    """Удаляет тестовые записи"""
+    last_id = base_id + 2 * favorites
+    for table, column in (('Likes', 'user_id'), ('Favorites', 'user_id'), ('Blacklist', 'user_id')):
+        db._execute(f"DELETE FROM {table} WHERE {column} = %s;", (base_id,))
+    db._execute("DELETE FROM search_cache WHERE query_hash = %s;", (Database.query_hash({'benchmark': base_id}),))
+    db._execute("DELETE FROM Users WHERE vk_id BETWEEN %s AND %s;", (base_id, last_id))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--favorites', type=int, default=50)
+    parser.add_argument('--base-id', type=int, default=2_000_000_000)
+    args = parser.parse_args()
+
+    db = Database()
+    base_id = args.base_id
+    queries: Dict[str, Callable[[], object]] = {
+        'user_exists': lambda: db.user_exists(base_id),
+        'has_liked_photo': lambda: db.has_liked_photo(base_id, base_id + 1),
+        'check_blacklist': lambda: db.check_blacklist(base_id, base_id + args.favorites + 1),
+        'get_favorites': lambda: db.get_favorites(base_id),
+        'get_excluded_ids': lambda: db.get_excluded_ids(base_id),
+        'get_cached_results': lambda: db.get_cached_results({'benchmark': base_id}),
+    }
+
+    try:
+        seed(db, base_id, args.favorites)
+
+        print(f"{'запрос':<20} {'режим':<10} {'медиана, мс':>12} {'p95, мс':>10}")
+        for name, call in queries.items():
+            for prepared in (False, True):
+                db.use_prepared = prepared
+                measure(call, min(100, args.iterations))  # прогрев (и PREPARE на соединениях)
+                timings = measure(call, args.iterations)
+                p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+                mode = 'prepared' if prepared else 'plain'
+                print(f"{name:<20} {mode:<10} {statistics.median(timings):>12.3f} {p95:>10.3f}")
+    finally:
+        cleanup(db, base_id, args.favorites)
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Бенчмарк ранжирования кандидатов
+
+Запуск из корня проекта:
+    python -m benchmarks.ranking --sizes 100 1000 10000 --repeat 20
+"""
+import argparse
+import random
+import statistics
+import time
+from typing import Dict, List
+
+from ranking import CandidateRanker
+from vk_handler import VKHandler
+
+INTERESTS = [
+    'музыка', 'кино', 'путешествия', 'спорт', 'книги', 'фотография', 'йога',
+    'программирование', 'танцы', 'кулинария', 'рок', 'джаз', 'горы', 'море',
+    'футбол', 'театр', 'искусство', 'история', 'психология', 'бег'
+]
+
+
+def make_candidates(n: int, rng: random.Random) -> List[Dict]:
+    """Синтетические кандидаты в формате ответа users.search"""
+    return [
+        {
+            'id': i + 1,
+            'bdate': f"1.1.{rng.randint(1980, 2005)}" if rng.random() < 0.7 else "1.1",
+            'city': {'id': rng.choice([1, 2, 3, 99]), 'title': ''},
+            'interests': ', '.join(rng.sample(INTERESTS, rng.randint(0, 6)))
+        }
+        for i in range(n)
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    ranker = CandidateRanker(VKHandler.SEARCH_WEIGHTS)
+    searcher = {
+        'age': 30,
+        'city': {'id': 1, 'title': ''},
+        'interests': {'interests': ['музыка', 'горы', 'кино'], 'music': ['рок'], 'books': [], 'groups': []}
+    }
+
+    print(f"{'кандидатов':>12} {'медиана, мс':>12} {'p95, мс':>10} {'мкс/кандидат':>14}")
+    for n in args.sizes:
+        candidates = make_candidates(n, rng)
+        ranker.rank(searcher, candidates)  # прогрев
+
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            ranker.rank(searcher, candidates)
+            timings.append((time.perf_counter() - started) * 1000)
+
+        timings.sort()
+        median = statistics.median(timings)
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        print(f"{n:>12} {median:>12.2f} {p95:>10.2f} {median * 1000 / n:>14.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+"""Воспроизведение записанного трафика бота
+
+Читает запись, сделанную с TRACE_FILE (см. traffic.py), и прогоняет
+записанные события через Bot._handle_event по порядку, без LongPoll
+и без пауз (пачки Bots Long Poll - как в боте: с подтверждением
+нажатий кнопок одним запросом). VK API и Database заменены заглушками, отвечающими
+записанными результатами: вызов ищется по методу и параметрам,
+одинаковые вызовы получают ответы в порядке записи. Сеть и БД
+не нужны, так что две версии бота можно сравнить на одном и том же
+трафике: процессорное время, число вызовов VK API и БД, задержка
+обработки по действиям.
+
+Вызовы, которых нет в записи (поведение версии изменилось), считаются
+расхождениями: VK API отвечает ошибкой 10, Database возвращает None.
+
+Запуск из корня проекта:
+    python -m benchmarks.replay trace.jsonl.gz --output replay.json
+    diff <(jq -S .calls replay-old.json) <(jq -S .calls replay-new.json)
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+from collections import Counter, defaultdict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import requests
+from vk_api.exceptions import ApiError
+from vk_api.longpoll import Event
+
+from bots_longpoll import decode_update
+from rate_limiter import RateLimitedVkApi, TokenBucket
+from traffic import TRACE_VERSION, db_key, loads, open_trace, vk_key
+
+Outcome = Tuple[Any, Any]
+
+
+class Trace:
+    """Записанный трафик: пачки событий по порядку и ответы VK API и БД по ключу вызова"""
+
+    def __init__(self, path: str) -> None:
+        # Событие LongPoll сообщений записывается пачкой из одного события
+        self.batches: List[list] = []
+        self.bots = False
+        self._answers: Dict[str, Dict[str, Deque[Outcome]]] = {'vk': defaultdict(deque), 'db': defaultdict(deque)}
+        self.calls: Dict[str, Counter] = {'vk': Counter(), 'db': Counter()}
+        self.mismatches: Dict[str, Counter] = {'vk': Counter(), 'db': Counter()}
+
+        with open_trace(path, 'r') as f:
+            header = loads(f.readline())
+            if header.get('kind') != 'header' or header.get('version') != TRACE_VERSION:
+                raise ValueError(f"{path}: не запись трафика версии {TRACE_VERSION}")
+            for line in f:
+                record = loads(line)
+                kind = record['kind']
+                if kind == 'event':
+                    self.batches.append([record['raw']])
+                elif kind == 'batch':
+                    self.batches.append(record['raw'])
+                    self.bots = True
+                elif kind == 'vk':
+                    key = vk_key(record['token'], record['method'], record['values'])
+                    self._answers['vk'][key].append((record['result'], record['error']))
+                elif kind == 'db':
+                    key = db_key(record['method'], tuple(record['args']), record['kwargs'])
+                    self._answers['db'][key].append((record['result'], record['error']))
+
+    @property
+    def events(self) -> int:
+        """Количество записанных событий"""
+        return sum(len(batch) for batch in self.batches)
+
+    def answer(self, kind: str, method: str, key: str) -> Optional[Outcome]:
+        """Следующий записанный ответ на вызов или None, если его нет"""
+        self.calls[kind][method] += 1
+        answers = self._answers[kind].get(key)
+        if not answers:
+            self.mismatches[kind][method] += 1
+            return None
+        return answers.popleft()
+
+    def unused(self) -> Dict[str, int]:
+        """Сколько записанных ответов не было запрошено"""
+        return {kind: sum(len(queue) for queue in answers.values()) for kind, answers in self._answers.items()}
+
+
+class ReplayVkApi(RateLimitedVkApi):
+    """Сессия VK API, отвечающая записанными результатами"""
+
+    def __init__(self, trace: Trace, token: str) -> None:
+        super().__init__(token=f'replay-{token}', bucket=TokenBucket(1e9, name=token), base_url='')
+        self.trace = trace
+
+    def method(self, method: str, values: Optional[Dict] = None, captcha_sid: Any = None,
+               captcha_key: Any = None, raw: bool = False) -> Any:
+        outcome = self.trace.answer('vk', method, vk_key(self.bucket.name, method, values))
+        if outcome is None:
+            raise ApiError(self, method, values, raw, {'error_code': 10, 'error_msg': 'Not in trace'})
+
+        result, error = outcome
+        if error is None:
+            return result
+        if error.get('network'):
+            raise requests.ConnectionError(error.get('error_msg'))
+        raise ApiError(self, method, values, raw, error)
+
+
+class ReplayDatabase:
+    """Заглушка Database: публичные методы возвращают записанные результаты"""
+
+    schema_version = None
+    write_buffer = None
+
+    def __init__(self, trace: Trace) -> None:
+        self.trace = trace
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def call(*args: Any, **kwargs: Any) -> Any:
+            outcome = self.trace.answer('db', name, db_key(name, args, kwargs))
+            if outcome is None:
+                return None
+            result, error = outcome
+            if error is not None:
+                raise RuntimeError(error)
+            return result
+
+        return call
+
+    def pool_stats(self) -> Dict[str, Any]:
+        return {}
+
+    def get_longpoll_ts(self, group_id: int) -> None:
+        return None
+
+    def save_longpoll_ts(self, group_id: int, ts: str) -> None:
+        pass
+
+    def write_stats(self) -> Dict[str, Any]:
+        return {}
+
+    def close(self) -> None:
+        pass
+
+
+def event_action(bot: Any, event: Any) -> str:
+    """Тип действия события - та же метка, что в метрике bot_handler_seconds"""
+    payload = getattr(event, 'payload', None)
+    if isinstance(payload, dict):
+        return payload.get('type', 'unknown')
+    if payload:
+        try:
+            data = json.loads(payload)
+            return data.get('type', 'unknown') if isinstance(data, dict) else 'unknown'
+        except json.JSONDecodeError:
+            pass
+    return f"text_{bot.TEXT_ACTIONS.get(event.text.lower(), 'other')}"
+
+
+def replay(path: str) -> Dict[str, Any]:
+    """Воспроизводит запись и возвращает отчет"""
+    # Воспроизведение не пишет трафик, не открывает порты и не требует токенов
+    os.environ.pop('TRACE_FILE', None)
+    os.environ.update({
+        'VK_TOKEN_GROUP': 'replay', 'VK_TOKEN_USER': 'replay', 'VK_ID': os.getenv('VK_ID') or '1',
+        'METRICS_PORT': '0', 'METRICS_FILE': '',
+    })
+    from bot import Bot
+
+    trace = Trace(path)
+    # Режим LongPoll - как при записи: от него зависят клавиатуры и вызовы при запуске
+    os.environ['LONGPOLL_MODE'] = 'bots' if trace.bots else 'user'
+    bot = Bot(
+        vk_session=ReplayVkApi(trace, 'group'),
+        user_vk_session=ReplayVkApi(trace, 'user'),
+        db=ReplayDatabase(trace)
+    )
+
+    timings: Dict[str, List[float]] = defaultdict(list)
+    wall_started = time.perf_counter()
+    cpu_started = time.process_time()
+    try:
+        for batch in trace.batches:
+            if trace.bots:
+                events = [decode_update(raw) for raw in batch]
+                bot.longpoll.acknowledge(events)
+            else:
+                events = [Event(raw) for raw in batch]
+            for event in events:
+                started = time.perf_counter()
+                bot._handle_event(event)
+                timings[event_action(bot, event)].append((time.perf_counter() - started) * 1000)
+        # Как при остановке бота: подгрузки завершаются, сессии сохраняются
+        bot.prefetcher.shutdown(wait=True)
+        bot.sessions.flush()
+        bot.db.flush_writes()
+    finally:
+        bot.prefetcher.shutdown()
+    wall = time.perf_counter() - wall_started
+    cpu = time.process_time() - cpu_started
+
+    actions = {}
+    for action, values in sorted(timings.items()):
+        values.sort()
+        actions[action] = {
+            'count': len(values),
+            'mean_ms': round(statistics.fmean(values), 3),
+            'p50_ms': round(values[int(len(values) * 0.5)], 3),
+            'p95_ms': round(values[min(len(values) - 1, int(len(values) * 0.95))], 3),
+            'p99_ms': round(values[min(len(values) - 1, int(len(values) * 0.99))], 3),
+        }
+
+    return {
+        'trace': os.path.basename(path),
+        'events': trace.events,
+        'wall_s': round(wall, 3),
+        'cpu_s': round(cpu, 3),
+        'events_per_s': round(trace.events / wall, 1) if wall else None,
+        'actions': actions,
+        'calls': {kind: dict(sorted(counter.items())) for kind, counter in trace.calls.items()},
+        'mismatches': {kind: dict(sorted(counter.items())) for kind, counter in trace.mismatches.items()},
+        'unused': trace.unused(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('trace', help="файл записи (TRACE_FILE)")
+    parser.add_argument('--output', help="JSON-отчет для сравнения версий")
+    args = parser.parse_args()
+
+    report = replay(args.trace)
+
+    print(f"\nСобытий: {report['events']}, время: {report['wall_s']} с, процессор: {report['cpu_s']} с, "
+          f"{report['events_per_s']} событий/с")
+    print(f"{'действие':<16} {'кол-во':>8} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9}")
+    for action, result in report['actions'].items():
+        print(f"{action:<16} {result['count']:>8} {result['p50_ms']:>9.3f} "
+              f"{result['p95_ms']:>9.3f} {result['p99_ms']:>9.3f}")
+    for kind in ('vk', 'db'):
+        print(f"\nВызовы {kind}: {sum(report['calls'][kind].values())}, "
+              f"нет в записи: {sum(report['mismatches'][kind].values())}, "
+              f"не запрошено: {report['unused'][kind]}")
+        for method, count in sorted(report['mismatches'][kind].items(), key=lambda item: -item[1]):
+            print(f"  расхождение {method}: {count}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"\nОтчет записан в {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,14 +2,24 @@ import os
 import json
 import time
 import logging
-from typing import Dict, List, Optional
+import threading
+from typing import Dict, Iterator, List, Optional
 from dotenv import load_dotenv
-import vk_api
-from vk_api import VkApi, ApiError
+from vk_api import ApiError
 from vk_api.keyboard import VkKeyboard, VkKeyboardColor
 from vk_api.longpoll import VkLongPoll, VkEventType
 from vk_api.utils import get_random_id
+from bots_longpoll import BotEvent, BotsLongPoll
 from database import Database
+from dispatcher import EventDispatcher
+from janitor import CacheJanitor
+from metrics import REGISTRY, MetricsExporter
+from prefetch import PhotoPrefetcher
+from profiler import EventProfiler
+from ranking import CandidateRanker
+from rate_limiter import RateLimitedVkApi, RateLimiter
+from sessions import SearchSession, SessionStore
+from traffic import RECORDER
 from vk_handler import VKHandler
 
 # Настройка логирования
@@ -21,42 +31,141 @@ logger = logging.getLogger(__name__)
 
 
 class Bot:
-    def __init__(self) -> None:
-        """Инициализация бота с проверкой токенов"""
+    def __init__(self, vk_session: Optional[RateLimitedVkApi] = None,
+                 user_vk_session: Optional[RateLimitedVkApi] = None,
+                 db: Optional[Database] = None) -> None:
+        """
+        Инициализация бота с проверкой токенов
+
+        Args:
+            vk_session: Сессия VK API группового токена
+            user_vk_session: Сессия VK API пользовательского токена
+            db: Экземпляр Database
+            По умолчанию все создаются из настроек .env; готовые объекты
+            передаются при воспроизведении трафика (benchmarks/replay.py)
+        """
         load_dotenv()
         self._check_env_vars()
 
+        # Запись трафика (TRACE_FILE) начинается до первых вызовов VK API и БД
+        RECORDER.configure_from_env()
+
         try:
+            # Общий ограничитель частоты запросов для группового и пользовательского токенов
+            self.rate_limiter = RateLimiter()
+
             # Инициализация подключения к VK API
-            self.vk_session = VkApi(token=os.getenv('VK_TOKEN_GROUP'))
+            self.vk_session = vk_session or RateLimitedVkApi(
+                token=os.getenv('VK_TOKEN_GROUP'),
+                bucket=self.rate_limiter.bucket('group', float(os.getenv('VK_GROUP_RPS', 20)))
+            )
             self.vk = self.vk_session.get_api()
 
             # Проверка подключения к VK API
             self._check_vk_connection()
 
-            # Инициализация LongPoll
-            self.longpoll = VkLongPoll(self.vk_session)
-
-            logger.info("✅ LongPoll инициализирован")
+            # Источник событий: LongPoll сообщений (user) или Bots Long Poll сообщества (bots)
+            self.longpoll_mode = os.getenv('LONGPOLL_MODE', 'user').lower()
+            self._stopping = threading.Event()
+            if self.longpoll_mode != 'bots':
+                self.longpoll = VkLongPoll(self.vk_session)
+                self.vk_session.redirect(self.longpoll.session)
+                logger.info("✅ LongPoll инициализирован")
 
             # Инициализация базы данных
-            self.db = Database()
+            self.db = db or Database()
             logger.info(f"🛢️ Подключено к PostgreSQL: {os.getenv('DB_NAME')}")
 
+            # Bots Long Poll хранит позицию чтения в БД
+            if self.longpoll_mode == 'bots':
+                self.longpoll = BotsLongPoll(
+                    self.vk_session,
+                    self.group_id,
+                    db=self.db,
+                    wait=int(os.getenv('LONGPOLL_WAIT', 25))
+                )
+                logger.info("✅ Bots Long Poll инициализирован")
+
+            # Фоновая очистка кэша поиска (устаревшие записи и ограничение объема)
+            self.janitor = CacheJanitor(
+                self.db,
+                interval=float(os.getenv('SEARCH_CACHE_SWEEP_INTERVAL', 300)),
+                max_bytes=int(float(os.getenv('SEARCH_CACHE_MAX_MB', 512)) * 1024 * 1024),
+                batch_size=int(os.getenv('SEARCH_CACHE_SWEEP_BATCH', 1000))
+            )
+
             # Инициализация обработчика VK
-            self.vk_handler = VKHandler(os.getenv('VK_TOKEN_USER'), db=self.db)
+            self.vk_handler = VKHandler(
+                os.getenv('VK_TOKEN_USER'),
+                db=self.db,
+                rate_limiter=self.rate_limiter,
+                vk_session=user_vk_session
+            )
 
-            # Словарь для хранения состояний пользователей
-            self.user_states = {}
+            # Сессии поиска пользователей (ограничены по времени бездействия и памяти,
+            # сохраняются в БД и лениво восстанавливаются после перезапуска)
+            self.sessions = SessionStore(
+                idle_timeout=float(os.getenv('SESSION_IDLE_TIMEOUT', 1800)),
+                max_bytes=int(float(os.getenv('SESSION_MAX_MB', 64)) * 1024 * 1024),
+                loader=self._restore_session,
+                saver=self._save_session,
+                save_interval=float(os.getenv('SESSION_SAVE_INTERVAL', 30))
+            )
+
+            # Ранжирование кандидатов по весам VKHandler.SEARCH_WEIGHTS
+            self.ranker = CandidateRanker(self.vk_handler.SEARCH_WEIGHTS)
+
+            # Фоновая подгрузка фото следующих кандидатов
+            self.prefetcher = PhotoPrefetcher(
+                self.vk_handler,
+                depth=int(os.getenv('PREFETCH_DEPTH', 5))
+            )
+
+            # Пул обработчиков событий (порядок событий одного пользователя сохраняется)
+            self.dispatcher = EventDispatcher(
+                self._handle_event,
+                workers=int(os.getenv('BOT_WORKERS', 4)),
+                queue_size=int(os.getenv('BOT_QUEUE_SIZE', 100))
+            )
+
+            # Метрики: эндпоинт Prometheus и/или периодическая запись в файл
+            self.metrics = MetricsExporter(
+                port=int(os.getenv('METRICS_PORT', 0)),
+                host=os.getenv('METRICS_HOST', '127.0.0.1'),
+                path=os.getenv('METRICS_FILE') or None,
+                interval=float(os.getenv('METRICS_DUMP_INTERVAL', 60))
+            )
+            # Профилирование обработки событий по требованию (PROFILE_*, SIGUSR1/SIGUSR2)
+            self.profiler = EventProfiler.from_env()
+
+            self._register_metrics()
 
         except Exception as e:
             logger.critical(f"Ошибка инициализации бота: {e}")
             raise
 
+    def _register_metrics(self) -> None:
+        """Показатели компонентов (пул, кэши, ограничитель, сессии) для метрик"""
+        REGISTRY.register_collector('db_pool', self.db.pool_stats)
+        REGISTRY.register_collector('db_write_buffer', self.db.write_stats)
+        REGISTRY.register_collector('search_cache', self.janitor.stats)
+        REGISTRY.register_collector('vk_cache', self.vk_handler.cache_stats)
+        REGISTRY.register_collector('vk_rate_limiter', self.rate_limiter.stats)
+        REGISTRY.register_collector('sessions', self.sessions.stats)
+        REGISTRY.register_collector('profiler', self.profiler.stats)
+        REGISTRY.register_collector('traffic', RECORDER.stats)
+        if isinstance(self.longpoll, BotsLongPoll):
+            REGISTRY.register_collector('bots_longpoll', self.longpoll.stats)
+        REGISTRY.register_collector('dispatcher', lambda: {
+            'queued': self.dispatcher.qsize(),
+            'dropped': self.dispatcher.dropped
+        })
+
     def _check_vk_connection(self):  # <-- Добавьте этот метод
         """Проверяет подключение к VK API"""
         try:
             group_info = self.vk.groups.getById()
+            self.group_id = group_info[0]['id']
             logger.info(f"✅ Успешное подключение к группе: {group_info[0]['name']}")
             return True
         except Exception as e:
@@ -97,17 +206,16 @@ class Bot:
     def run(self) -> None:
         """Основной цикл работы бота"""
         logger.info("Запуск основного цикла бота...")
+        self.dispatcher.start()
+        self.janitor.start()
+        self.metrics.start()
+        self.profiler.install_signal_handlers()
 
+        poll = self._poll_batch if isinstance(self.longpoll, BotsLongPoll) else self._poll_events
         try:
-            while True:
+            while not self._stopping.is_set():
                 try:
-                    for event in self.longpoll.listen():
-                        try:
-                            if event.type == VkEventType.MESSAGE_NEW and event.to_me:
-                                self._handle_event(event)
-                        except Exception as e:
-                            logger.error(f"Ошибка обработки события: {e}")
-                            time.sleep(1)
+                    poll()
 
                 except KeyboardInterrupt:
                     logger.info("Бот остановлен пользователем")
@@ -118,10 +226,51 @@ class Bot:
 
         finally:
             logger.info("Завершение работы бота")
+            self.dispatcher.stop()
+            if isinstance(self.longpoll, BotsLongPoll):
+                self.longpoll.commit()
+            self.prefetcher.shutdown()
+            self.janitor.stop()
+            self.metrics.stop()
+            self.sessions.flush()
             if hasattr(self, 'db'):
+                self.db.flush_writes()
                 self.db.close()
+            RECORDER.stop()
             logger.info("Все соединения закрыты")
 
+    def stop(self) -> None:
+        """Просит основной цикл завершиться после текущего запроса LongPoll"""
+        self._stopping.set()
+
+    def _poll_events(self) -> None:
+        """Один запрос LongPoll сообщений: события передаются обработчикам по одному"""
+        for event in self.longpoll.check():
+            try:
+                if event.type == VkEventType.MESSAGE_NEW and event.to_me:
+                    if RECORDER.active:
+                        RECORDER.record_event(event.raw)
+                    self.dispatcher.submit(event)
+            except Exception as e:
+                logger.error(f"Ошибка обработки события: {e}")
+                time.sleep(1)
+
+    def _poll_batch(self) -> None:
+        """
+        Одна пачка Bots Long Poll: нажатия кнопок подтверждаются одним
+        запросом, события передаются обработчикам, а позиция сохраняется
+        после уже обработанных пачек
+        """
+        events = self.longpoll.check()
+        if events:
+            self.longpoll.acknowledge(events)
+            if RECORDER.active:
+                RECORDER.record_batch([event.raw for event in events])
+            for event in events:
+                if not self.dispatcher.submit(event):
+                    self.longpoll.done(event)
+        self.longpoll.commit()
+
     def _check_connection(self):
         """Проверка соединения перед запуском"""
         try:
@@ -147,28 +296,60 @@ class Bot:
             logger.critical(f"Ошибка подключения: {e}")
             raise
 
+    # Текстовые команды и их имена в метриках
+    TEXT_ACTIONS = {
+        'привет': 'start', 'начать': 'start', 'старт': 'start',
+        'поиск': 'search',
+        'избранное': 'favorites'
+    }
+
+    # Типы действий кнопок; остальные в метриках и профилях - 'unknown'
+    # (тип приходит от клиента, и число меток не должно от него зависеть)
+    PAYLOAD_ACTIONS = frozenset({'add_fav', 'like', 'next', 'block', 'retry'})
+
     def _handle_event(self, event) -> None:
         """Обрабатывает входящее событие"""
         try:
-            if event.type == VkEventType.MESSAGE_NEW and event.to_me:
-                user_id = event.user_id
+            if isinstance(event, BotEvent):
+                # Payload уже разобран при получении пачки
                 try:
-                    # Проверяем наличие payload более безопасным способом
-                    payload = getattr(event, 'payload', None)
-                    if payload:
-                        try:
-                            payload_data = json.loads(payload)
-                            self._handle_payload(user_id, payload_data)
-                        except json.JSONDecodeError:
-                            self._handle_text(user_id, event.text.lower())
-                    else:
-                        self._handle_text(user_id, event.text.lower())
-                except Exception as e:
-                    logger.error(f"Ошибка обработки команды: {e}", exc_info=True)
-                    self._send_message(user_id, "Произошла ошибка при обработке команды. Попробуйте позже.")
+                    self._handle_message(event.user_id, event.text, event.payload)
+                finally:
+                    self.longpoll.done(event)
+            elif event.type == VkEventType.MESSAGE_NEW and event.to_me:
+                # Проверяем наличие payload более безопасным способом
+                payload_data = None
+                payload = getattr(event, 'payload', None)
+                if payload:
+                    try:
+                        payload_data = json.loads(payload)
+                    except json.JSONDecodeError:
+                        payload_data = None
+
+                self._handle_message(event.user_id, event.text, payload_data)
         except Exception as e:
             logger.error(f"Ошибка обработки события: {e}", exc_info=True)
 
+    def _handle_message(self, user_id: int, text: str, payload_data: Optional[Dict]) -> None:
+        """Обрабатывает нажатие кнопки (payload_data) или текстовую команду"""
+        if payload_data is not None:
+            action = payload_data.get('type') if isinstance(payload_data, dict) else None
+            if not isinstance(action, str) or action not in self.PAYLOAD_ACTIONS:
+                action = 'unknown'
+        else:
+            action = f"text_{self.TEXT_ACTIONS.get(text.lower(), 'other')}"
+
+        with REGISTRY.timer('bot_handler_seconds', action=action), self.profiler.profile(action):
+            try:
+                if payload_data is not None:
+                    self._handle_payload(user_id, payload_data)
+                else:
+                    self._handle_text(user_id, text.lower())
+            except Exception as e:
+                REGISTRY.inc('bot_handler_errors_total', action=action)
+                logger.error(f"Ошибка обработки команды: {e}", exc_info=True)
+                self._send_message(user_id, "Произошла ошибка при обработке команды. Попробуйте позже.")
+
     def _handle_payload(self, user_id: int, payload: Dict) -> None:
         """Обрабатывает действия из интерактивной клавиатуры
 
@@ -181,6 +362,7 @@ class Bot:
         - like: лайк фотографии (с проверкой дублирования)
         - next: показать следующего пользователя
         - block: добавление пользователя в черный список
+        - retry: повторный показ текущего пользователя
         """
         try:
             # Проверка валидности payload
@@ -211,6 +393,9 @@ class Bot:
             elif action == "block":
                 self._handle_block(user_id, payload)
 
+            elif action == "retry":
+                self._show_user(user_id)
+
             else:
                 logger.error(f"Неизвестный тип действия: {action}")
                 self._send_message(user_id, "⚠️ Неизвестное действие")
@@ -235,20 +420,14 @@ class Bot:
         fav_id = payload['user_id']
         try:
             # Получаем информацию о пользователе для сообщения
-            fav_info = self.vk_handler.get_user_info(fav_id)
+            fav_info = self.vk_handler.get_user_names([fav_id]).get(fav_id)
             name = f"{fav_info.get('first_name', '')} {fav_info.get('last_name', '')}" if fav_info else "Пользователь"
 
-            # Проверяем, есть ли уже в избранном
-            favorites = self.db.get_favorites(user_id)
-            if fav_id in favorites:
-                self._send_message(user_id, f"ℹ️ {name} уже в вашем избранном")
-                return
-
-            # Пытаемся добавить
+            # Добавление и проверка на повтор - одним запросом
             if self.db.add_favorite(user_id, fav_id):
                 self._send_message(user_id, f"✅ {name} добавлен(а) в избранное!")
             else:
-                self._send_message(user_id, "❌ Ошибка при добавлении в избранное")
+                self._send_message(user_id, f"ℹ️ {name} уже в вашем избранном")
 
         except Exception as e:
             logger.error(f"Ошибка добавления в избранное: {e}")
@@ -275,7 +454,7 @@ class Bot:
             # Ставим лайк через VK API и сохраняем в БД
             if self.vk_handler.like_photo(photo_id, owner_id, user_id):
                 # Получаем информацию о владельце фото для красивого сообщения
-                user_info = self.vk_handler.get_user_info(owner_id)
+                user_info = self.vk_handler.get_user_names([owner_id]).get(owner_id)
                 name = f"{user_info.get('first_name', 'Пользователь')}" if user_info else "Пользователю"
                 self._send_message(user_id, f"❤️ Лайк {name} успешно поставлен!")
             else:
@@ -309,7 +488,7 @@ class Bot:
         try:
             if self.db.add_to_blacklist(user_id, block_id):
                 # Получаем информацию о заблокированном пользователе
-                block_info = self.vk_handler.get_user_info(block_id)
+                block_info = self.vk_handler.get_user_names([block_id]).get(block_id)
                 if block_info:
                     name = f"{block_info.get('first_name', '')} {block_info.get('last_name', '')}"
                     self._send_message(user_id, f"🚫 {name} добавлен(а) в ЧС")
@@ -372,29 +551,29 @@ class Bot:
                 'interests': user_info.get('interests', '')
             }
 
-            # Ищем пользователей
-            users = self.db.get_cached_results(user_id, search_params)
-            if users is None:
-                users = self.vk_handler.search_users(search_params) or []
-                if users:
-                    self.db.cache_results(user_id, search_params, users)
-
-            # Фильтруем результаты
-            users = [
-                u for u in users
-                if not self.db.check_blacklist(user_id, u.get('id'))
-                   and u.get('id') not in self.db.get_favorites(user_id)
-            ]
-
-            if not users:
+            # Сохраняем данные пользователя в БД
+            self.db.add_user(
+                user_id,
+                user_info.get('first_name', ''),
+                user_info.get('last_name', ''),
+                age,
+                str(user_info.get('sex')) if user_info.get('sex') else None,
+                search_params['city']
+            )
+
+            # Кандидаты подгружаются страницами по мере просмотра
+            session = SearchSession(user_id, search_params)
+            session.stream = self._candidate_pages(session, user_info)
+            self._load_candidates(session)
+
+            if not session.remaining:
+                self.sessions.pop(user_id)
+                self.db.delete_session(user_id)
                 self._send_message(user_id, "😔 Нет подходящих пользователей")
                 return
 
             # Сохраняем состояние
-            self.user_states[user_id] = {
-                'users': users,
-                'index': 0
-            }
+            self.sessions.put(session)
 
             self._show_user(user_id)
 
@@ -402,30 +581,145 @@ class Bot:
             logger.error(f"Ошибка поиска: {e}")
             self._send_message(user_id, "❌ Ошибка при поиске")
 
+    def _candidate_pages(self, session: SearchSession,
+                         user_info: Optional[Dict] = None) -> Iterator[List[int]]:
+        """
+        Лениво выдает окна ID кандидатов без ЧС и избранного, начиная
+        с позиции session.cursor. Окно - очередные страницы поиска всех
+        возрастов диапазона, по которым еще есть результаты; кандидаты окна
+        упорядочены по убыванию оценки. Позиция следующего окна (с этими
+        возрастами) записывается в session.cursor
+        """
+        # Профиль ищущего нужен только для ранжирования - после восстановления
+        # сессии он запрашивается при первой подгрузке страницы
+        if user_info is None:
+            user_info = self.vk_handler.get_user_info(session.user_id) or {}
+
+        # ЧС и избранное - одним запросом на подгрузку (генератор не живет
+        # дольше одного вызова _load_candidates)
+        excluded = self.db.get_excluded_ids(session.user_id)
+        pages = self.vk_handler.iter_search_pages(session.search_params, start=session.cursor)
+        for cursor, page in pages:
+            session.cursor = cursor
+            page = [u for u in page if u.get('id') not in excluded]
+            if page:
+                yield [u['id'] for u in self.ranker.rank(user_info, page)]
+        session.cursor = None
+
+    def _save_session(self, session: SearchSession) -> None:
+        """Сохраняет позицию сессии поиска в БД"""
+        self.db.save_session(
+            session.user_id,
+            session.candidates.tobytes(),
+            session.index,
+            session.search_params,
+            session.cursor if session.stream is not None else None
+        )
+
+    def _restore_session(self, user_id: int) -> Optional[SearchSession]:
+        """
+        Восстанавливает сессию поиска из БД. Поиск продолжается с сохраненной
+        позиции только когда сохраненные кандидаты закончатся
+        """
+        saved = self.db.load_session(
+            user_id,
+            max_age_hours=int(os.getenv('SESSION_RESTORE_HOURS', 168))
+        )
+        if saved is None:
+            return None
+
+        session = SearchSession(user_id, saved['search_params'])
+        session.candidates.frombytes(saved['candidates'])
+        session.index = min(saved['position'], len(session.candidates))
+        session.cursor = saved['cursor']
+        if session.cursor is not None:
+            session.stream = self._candidate_pages(session)
+
+        logger.info(f"♻️ Восстановлена сессия поиска {user_id}: осталось {session.remaining} кандидатов")
+        return session
+
+    def _load_candidates(self, session: SearchSession) -> None:
+        """
+        Дочитывает страницы поиска, пока после текущего кандидата не наберется
+        запас для подгрузки фото. Просмотренные кандидаты удаляются из буфера,
+        так что память сессии не растет с глубиной просмотра
+        """
+        session.compact()
+
+        need = self.prefetcher.depth + 1
+        loaded = False
+        while session.stream is not None and session.remaining < need:
+            loaded = True
+            try:
+                page = next(session.stream, None)
+            except Exception as e:
+                # Страница не загрузилась - поиск продолжится с той же позиции (session.cursor)
+                # при следующем обращении; без кандидатов в буфере это ошибка показа
+                session.stream = self._candidate_pages(session)
+                if not session.remaining:
+                    raise
+                logger.warning(f"Страница поиска {session.user_id} не загружена: {e}")
+                break
+            if page is None:
+                session.stream = None
+            else:
+                session.extend(page)
+
+        # Начатый генератор держит ЧС, профиль ищущего и последнее окно поиска -
+        # между подгрузками хранится новый, незапущенный, с позиции session.cursor
+        if loaded and session.stream is not None:
+            session.stream = self._candidate_pages(session) if session.cursor is not None else None
+
     def _show_user(self, user_id: int) -> None:
         """Показывает карточку пользователя"""
         try:
-            if user_id not in self.user_states:
+            session = self.sessions.get(user_id)
+            if session is None:
                 self._send_message(user_id, "🔍 Начните поиск командой 'поиск'")
                 return
 
-            current = self.user_states[user_id]
-            if current['index'] >= len(current['users']):
+            self._load_candidates(session)
+            if not session.remaining:
+                self.sessions.put(session)
                 self._send_message(user_id, "😔 Пользователи закончились")
                 return
 
-            user = current['users'][current['index']]
-            photos = self.vk_handler.get_photos(user['id'])
+            # Фото и профили текущего и следующих кандидатов подгружаются заранее
+            # одним пакетом, кандидаты без фото пропускаются
+            while True:
+                self.prefetcher.schedule(session)
+                candidate_id = session.current
+                photos = self.prefetcher.take(session, candidate_id)
+                if photos is None:
+                    photos = self.vk_handler.get_photos(candidate_id)
+                if photos is None:
+                    # VK не ответил - кандидат остается текущим, показ можно повторить
+                    logger.warning(f"Фото кандидата {candidate_id} для {user_id} не загружены")
+                    self.sessions.put(session)
+                    self._send_message(user_id, "⚠️ Не удалось загрузить фото, попробуйте еще раз",
+                                       self._retry_keyboard())
+                    return
+                if photos:
+                    break
 
-            if not photos:
-                self._show_next_user(user_id)
-                return
+                session.index += 1
+                self._load_candidates(session)
+                if not session.remaining:
+                    self.sessions.put(session)
+                    self._send_message(user_id, "😔 Пользователи закончились")
+                    return
+
+            self.sessions.put(session)
+
+            # Профиль кандидата - из кэша (прогрет вместе с фото)
+            user = self.vk_handler.get_user_info(candidate_id) or {'id': candidate_id}
+            age = user.get('age') if len(user.get('bdate', '').split('.')) == 3 else None
 
             # Формируем сообщение
-            profile_link = f"https://vk.com/id{user['id']}"
+            profile_link = f"https://vk.com/id{candidate_id}"
             message = (
                 f"👤 {user.get('first_name', '')} {user.get('last_name', '')}\n"
-                f"🎂 Возраст: {user.get('age', 'не указан')}\n"
+                f"🎂 Возраст: {age or 'не указан'}\n"
                 f"🏙️ Город: {user.get('city', {}).get('title', 'не указан')}\n"
                 f"🔗 Ссылка: {profile_link}"
             )
@@ -434,7 +728,11 @@ class Bot:
             attachments = [f"photo{photo['owner_id']}_{photo['id']}" for photo in photos[:3]]
 
             # Создаем клавиатуру
-            keyboard = self.vk_handler.create_keyboard(user['id'], photos[0]['id'])
+            keyboard = self.vk_handler.create_keyboard(
+                candidate_id,
+                photos[0]['id'],
+                callback=isinstance(self.longpoll, BotsLongPoll)
+            )
 
             self._send_message(
                 user_id=user_id,
@@ -449,8 +747,9 @@ class Bot:
 
     def _show_next_user(self, user_id: int) -> None:
         """Показывает следующего пользователя"""
-        if user_id in self.user_states:
-            self.user_states[user_id]['index'] += 1
+        session = self.sessions.get(user_id)
+        if session is not None:
+            session.index += 1
             self._show_user(user_id)
         else:
             self._send_message(user_id, "🔍 Начните поиск командой 'поиск'")
@@ -463,8 +762,14 @@ class Bot:
                 self._send_message(user_id, "⭐ Список избранных пуст")
                 return
 
-            message = "⭐ Ваши избранные:\n" + "\n".join(
-                f"{i + 1}. vk.com/id{uid}" for i, uid in enumerate(favorites[:10]))
+            # Имена всех показываемых избранных - одним запросом (или из кэша)
+            names = self.vk_handler.get_user_names(favorites[:10])
+            lines = []
+            for i, uid in enumerate(favorites[:10]):
+                name = names.get(uid)
+                title = f"{name['first_name']} {name['last_name']} - " if name else ""
+                lines.append(f"{i + 1}. {title}vk.com/id{uid}")
+            message = "⭐ Ваши избранные:\n" + "\n".join(lines)
 
             self._send_message(user_id, message, self._main_keyboard())
         except Exception as e:
@@ -499,6 +804,13 @@ class Bot:
         keyboard.add_button('Избранное', color=VkKeyboardColor.POSITIVE)
         return keyboard.get_keyboard()
 
+    def _retry_keyboard(self) -> str:
+        """Создает клавиатуру повторного показа текущего пользователя"""
+        keyboard = VkKeyboard(inline=True)
+        add_button = keyboard.add_callback_button if isinstance(self.longpoll, BotsLongPoll) else keyboard.add_button
+        add_button('🔄 Повторить', color=VkKeyboardColor.PRIMARY, payload={"type": "retry"})
+        return keyboard.get_keyboard()
+
 
 if __name__ == '__main__':
     try:
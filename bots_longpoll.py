@@ -0,0 +1,227 @@
+import json
+import logging
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+import requests
+from vk_api.requests_pool import VkRequestsPool
+
+from rate_limiter import record_packed
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MESSAGE_NEW = 'message_new'
+MESSAGE_EVENT = 'message_event'
+
+# Начало ID бесед: сообщения из бесед бот не обрабатывает
+CHAT_START_ID = 2000000000
+
+
+class BotEvent:
+    """Входящее событие Bots Long Poll, разобранное один раз при получении пачки
+
+    payload - уже декодированный словарь кнопки (None, если его нет
+    или он не разбирается); для message_event есть event_id, на который
+    нужно ответить messages.sendMessageEventAnswer. batch - пачка,
+    из которой пришло событие ([ts после пачки, необработанных событий]).
+    """
+
+    __slots__ = ('type', 'user_id', 'peer_id', 'text', 'payload', 'event_id', 'raw', 'batch')
+
+    def __init__(self, type: str, user_id: int, peer_id: int, text: str,
+                 payload: Optional[Any], event_id: Optional[str], raw: Dict) -> None:
+        self.type = type
+        self.user_id = user_id
+        self.peer_id = peer_id
+        self.text = text
+        self.payload = payload
+        self.event_id = event_id
+        self.raw = raw
+        self.batch: Optional[list] = None
+
+
+def _decode_payload(payload: Any) -> Optional[Any]:
+    """Payload кнопки: в message_new - строка JSON, в message_event - уже объект"""
+    if payload is None or not isinstance(payload, str):
+        return payload
+    try:
+        return json.loads(payload)
+    except json.JSONDecodeError:
+        return None
+
+
+def decode_update(raw: Dict) -> Optional[BotEvent]:
+    """
+    Разбирает событие Bots Long Poll
+
+    Returns:
+        BotEvent для личных сообщений и нажатий callback-кнопок,
+        None для остальных событий
+    """
+    obj = raw.get('object') or {}
+    if raw.get('type') == MESSAGE_NEW:
+        # С версии API 5.103 сообщение вложено в object.message
+        message = obj.get('message', obj)
+        user_id = message.get('from_id', 0)
+        peer_id = message.get('peer_id', 0)
+        if user_id <= 0 or peer_id >= CHAT_START_ID:
+            return None
+        return BotEvent(MESSAGE_NEW, user_id, peer_id, message.get('text', ''),
+                        _decode_payload(message.get('payload')), None, raw)
+
+    if raw.get('type') == MESSAGE_EVENT:
+        return BotEvent(MESSAGE_EVENT, obj['user_id'], obj['peer_id'], '',
+                        _decode_payload(obj.get('payload')) or {}, obj['event_id'], raw)
+
+    return None
+
+
+class BotsLongPoll:
+    """Bots Long Poll сообщества (groups.getLongPollServer)
+
+    check() забирает пачку событий одним запросом и разбирает ее один
+    раз. Нажатия callback-кнопок подтверждаются пачкой через execute
+    (acknowledge). Обработчики отмечают события обработанными (done),
+    и commit сохраняет в БД позицию после последней полностью
+    обработанной пачки - чтение следующих пачек не ждет обработки.
+    После перезапуска чтение продолжается с сохраненной позиции:
+    при штатной остановке события не теряются и не повторяются, при
+    аварийной повторно приходят только необработанные пачки.
+    """
+
+    def __init__(self, vk_session: Any, group_id: int, db: Any = None, wait: int = 25) -> None:
+        """
+        Args:
+            vk_session: Сессия VK API группового токена
+            group_id: ID сообщества
+            db: Экземпляр Database для хранения позиции (None - не сохранять)
+            wait: Время ожидания событий одним запросом, секунд
+        """
+        self.vk_session = vk_session
+        self.group_id = group_id
+        self.db = db
+        self.wait = wait
+
+        self.session = requests.Session()
+        if hasattr(vk_session, 'redirect'):
+            vk_session.redirect(self.session)
+
+        self.key: Optional[str] = None
+        self.server: Optional[str] = None
+        self.ts: Optional[str] = None
+        self._saved_ts: Optional[str] = None
+        self._batches: Deque[list] = deque()
+        self._lock = threading.Lock()
+
+        # Статистика
+        self.batches = 0
+        self.events = 0
+        self.acknowledged = 0
+        self.lost = 0
+
+        self._update_server(update_ts=True)
+
+        saved = db.get_longpoll_ts(group_id) if db is not None else None
+        if saved:
+            self.ts = self._saved_ts = saved
+            logger.info(f"♻️ Bots Long Poll продолжает чтение с позиции {saved}")
+
+    def check(self) -> List[BotEvent]:
+        """Одна пачка событий (пустая, если за wait секунд событий не было)"""
+        response = self.session.get(
+            self.server,
+            params={'act': 'a_check', 'key': self.key, 'ts': self.ts, 'wait': self.wait},
+            timeout=self.wait + 10
+        ).json()
+
+        failed = response.get('failed')
+        if failed is None:
+            self.ts = str(response['ts'])
+            updates = response.get('updates') or []
+            self.batches += 1
+            events = [event for event in map(decode_update, updates) if event is not None]
+            self.events += len(events)
+            if events:
+                batch = [self.ts, len(events)]
+                for event in events:
+                    event.batch = batch
+                with self._lock:
+                    self._batches.append(batch)
+            return events
+
+        if failed == 1:
+            # Сохраненная позиция старше доступной истории событий
+            self.lost += 1
+            logger.warning(f"История событий Bots Long Poll устарела, чтение продолжается с {response['ts']}")
+            self.ts = str(response['ts'])
+        elif failed == 2:
+            self._update_server(update_ts=False)
+        else:
+            self._update_server(update_ts=True)
+        return []
+
+    def acknowledge(self, events: List[BotEvent]) -> None:
+        """Подтверждает нажатия callback-кнопок пачки (до 25 ответов за запрос)"""
+        answers = [event for event in events if event.type == MESSAGE_EVENT]
+        if not answers:
+            return
+
+        pool = VkRequestsPool(self.vk_session)
+        results = [
+            pool.method('messages.sendMessageEventAnswer', {
+                'event_id': event.event_id,
+                'user_id': event.user_id,
+                'peer_id': event.peer_id
+            })
+            for event in answers
+        ]
+        try:
+            pool.execute()
+        except Exception as e:
+            record_packed(self.vk_session, [('messages.sendMessageEventAnswer', getattr(e, 'error', None) or
+                                             {'error_code': 'network'}) for _ in answers])
+            logger.error(f"Ошибка подтверждения нажатий кнопок: {e}")
+            return
+        record_packed(self.vk_session, [('messages.sendMessageEventAnswer', None if r.ok else r.error or {})
+                                        for r in results])
+        self.acknowledged += sum(r.ok for r in results)
+
+    def done(self, event: BotEvent) -> None:
+        """Отмечает событие обработанным (из потока обработчика)"""
+        if event.batch is not None:
+            with self._lock:
+                event.batch[1] -= 1
+
+    def commit(self) -> None:
+        """Сохраняет позицию после последней полностью обработанной пачки, если она изменилась"""
+        with self._lock:
+            ts = None
+            while self._batches and self._batches[0][1] <= 0:
+                ts = self._batches.popleft()[0]
+            if not self._batches:
+                # Все пачки обработаны - позиция совпадает с текущей
+                ts = self.ts
+        if self.db is None or ts is None or ts == self._saved_ts:
+            return
+        self.db.save_longpoll_ts(self.group_id, ts)
+        self._saved_ts = ts
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика чтения событий"""
+        return {
+            'batches': self.batches,
+            'events': self.events,
+            'acknowledged': self.acknowledged,
+            'lost': self.lost,
+            'pending_batches': len(self._batches)
+        }
+
+    def _update_server(self, update_ts: bool) -> None:
+        """Получает адрес и ключ сервера (и при update_ts - текущую позицию)"""
+        response = self.vk_session.method('groups.getLongPollServer', {'group_id': self.group_id})
+        self.key = response['key']
+        self.server = response['server']
+        if update_ts:
+            self.ts = str(response['ts'])
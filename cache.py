@@ -0,0 +1,78 @@
+import threading
+from typing import Any, Dict, Hashable, Iterable, List, Tuple
+
+from cachetools import TTLCache
+
+
+class _CountingTTLCache(TTLCache):
+    """TTLCache, считающий вытеснения и устаревания записей"""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        super().__init__(maxsize, ttl)
+        self.evictions = 0
+        self.expirations = 0
+
+    def popitem(self) -> Tuple[Any, Any]:
+        item = super().popitem()
+        self.evictions += 1
+        return item
+
+    def expire(self, time: Any = None) -> List[Tuple[Any, Any]]:
+        expired = super().expire(time)
+        self.expirations += len(expired)
+        return expired
+
+
+class StatsTTLCache:
+    """Потокобезопасный ограниченный кэш в памяти
+
+    Записи живут ttl секунд, при переполнении вытесняются давно не
+    использованные (LRU). Ведет счетчики попаданий, промахов и вытеснений.
+    """
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        """
+        Args:
+            maxsize: Максимальное количество записей
+            ttl: Время жизни записи в секундах
+        """
+        self._cache = _CountingTTLCache(maxsize, ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys: Iterable[Hashable]) -> Tuple[Dict[Hashable, Any], List[Hashable]]:
+        """
+        Ищет несколько ключей сразу
+
+        Returns:
+            Пара (найденные записи, список ключей, которых нет в кэше)
+        """
+        found, missing = {}, []
+        with self._lock:
+            for key in keys:
+                try:
+                    found[key] = self._cache[key]
+                    self.hits += 1
+                except KeyError:
+                    missing.append(key)
+                    self.misses += 1
+        return found, missing
+
+    def set_many(self, items: Dict[Hashable, Any]) -> None:
+        """Сохраняет несколько записей"""
+        with self._lock:
+            for key, value in items.items():
+                self._cache[key] = value
+
+    def stats(self) -> Dict[str, int]:
+        """Статистика кэша"""
+        with self._lock:
+            return {
+                'size': len(self._cache),
+                'max_size': int(self._cache.maxsize),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self._cache.evictions,
+                'expirations': self._cache.expirations
+            }
@@ -1,11 +1,23 @@
 import psycopg2
 from psycopg2 import sql
-from psycopg2.extras import DictCursor
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, connection as PgConnection
+from psycopg2.extras import DictCursor, execute_values
+from psycopg2.pool import PoolError
 import os
 import json
+import hashlib
+import re
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import Optional, Dict, List, Tuple, Any
+from typing import Optional, Dict, Iterator, List, Set, Tuple, Any, Callable
 from dotenv import load_dotenv
+
+from metrics import REGISTRY, current_db_method, instrument_db
+from migrations import migrate
+from traffic import record_db
+from write_buffer import WriteBehindBuffer
 import logging
 
 load_dotenv()
@@ -13,49 +25,452 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Создание недостающих записей Users внутри того же запроса, что и основная вставка
+_ENSURE_USERS_CTE = """
+    new_users AS (
+        INSERT INTO Users (vk_id)
+        SELECT unnest(%s::integer[])
+        ON CONFLICT (vk_id) DO NOTHING
+    )
+"""
+
+
+_PLACEHOLDER = re.compile(r'%s')
+
+
+class PreparingConnection(PgConnection):
+    """Соединение, которое помнит имена подготовленных (PREPARE) на нем запросов"""
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.prepared: Set[str] = set()
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Обработчик выполнил больше запросов к БД, чем разрешено"""
+
+
+class QueryCounter:
+    """Счетчик запросов к БД в текущем потоке (см. Database.count_queries)"""
+
+    def __init__(self) -> None:
+        self.queries = 0
+        self.commits = 0
+        self.statements: List[str] = []
+        self.params: List[Any] = []  # Параметры запросов в порядке statements
+
+    @property
+    def round_trips(self) -> int:
+        """Обращения к серверу: запросы и фиксации транзакций"""
+        return self.queries + self.commits
+
+
+_counters = threading.local()
+
+
+def _active_counters() -> List[QueryCounter]:
+    """Счетчики, активные в текущем потоке"""
+    return getattr(_counters, 'stack', ())
+
+
+class CountingCursor(DictCursor):
+    """DictCursor, который сообщает о каждом запросе активным счетчикам"""
+
+    def execute(self, query, vars=None):
+        for counter in _active_counters():
+            counter.queries += 1
+            counter.statements.append(query if isinstance(query, str) else query.decode())
+            counter.params.append(vars)
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        for counter in _active_counters():
+            counter.queries += 1
+            counter.statements.append(query if isinstance(query, str) else query.decode())
+            counter.params.append(vars_list)
+        return super().executemany(query, vars_list)
+
+
+class ConnectionPool:
+    """Ограниченный пул соединений с PostgreSQL
+
+    Соединения создаются по требованию, но не больше maxconn. Если все
+    соединения заняты, getconn() ждет освобождения не дольше timeout
+    секунд. Разорванные соединения не возвращаются в пул, вместо них
+    при следующем запросе создаются новые.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, timeout: float = 5.0, **conn_params: Any) -> None:
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Некорректные границы пула соединений")
+
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self._conn_params = conn_params
+        self._idle: List[Any] = []
+        self._size = 0
+        self._cond = threading.Condition()
+        self._closed = False
+
+        # Статистика
+        self.waits = 0
+        self.wait_time = 0.0
+        self.created = 0
+        self.discarded = 0
+
+        for _ in range(minconn):
+            self._idle.append(self._connect())
+            self._size += 1
+
+    def _connect(self) -> Any:
+        """Открывает новое соединение"""
+        conn = psycopg2.connect(**self._conn_params)
+        self.created += 1
+        return conn
 
+    def getconn(self) -> Any:
+        """Берет соединение из пула, при необходимости ожидая освобождения"""
+        started = None
+        with self._cond:
+            while not self._idle and self._size >= self.maxconn:
+                if self._closed:
+                    raise PoolError("Пул соединений закрыт")
+                now = time.monotonic()
+                if started is None:
+                    started = now
+                    self.waits += 1
+                remaining = self.timeout - (now - started)
+                if remaining <= 0:
+                    self.wait_time += now - started
+                    raise PoolError(f"Нет свободных соединений за {self.timeout} с")
+                self._cond.wait(remaining)
+
+            if started is not None:
+                self.wait_time += time.monotonic() - started
+            if self._closed:
+                raise PoolError("Пул соединений закрыт")
+
+            conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                self._size += 1
+
+        if conn is not None and not conn.closed:
+            return conn
+
+        if conn is not None:
+            with self._cond:
+                self.discarded += 1
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, conn: Any, discard: bool = False) -> None:
+        """Возвращает соединение в пул или закрывает его, если оно разорвано"""
+        if not discard and not conn.closed:
+            try:
+                if conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+
+        with self._cond:
+            if discard or conn.closed or self._closed:
+                self._size -= 1
+                self.discarded += 1
+                if not conn.closed:
+                    conn.close()
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    def discard_idle(self) -> None:
+        """Закрывает все простаивающие соединения (например, после рестарта сервера БД)"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self.discarded += len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            if not conn.closed:
+                conn.close()
+
+    def closeall(self) -> None:
+        """Закрывает пул и все простаивающие соединения"""
+        with self._cond:
+            self._closed = True
+        self.discard_idle()
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика пула"""
+        with self._cond:
+            return {
+                'size': self._size,
+                'max_size': self.maxconn,
+                'in_use': self._size - len(self._idle),
+                'idle': len(self._idle),
+                'waits': self.waits,
+                'wait_time': self.wait_time,
+                'created': self.created,
+                'discarded': self.discarded
+            }
+
+
+@instrument_db(exclude=('count_queries', 'query_budget', 'pool_stats', 'write_stats', 'close'))
+@record_db(exclude=('count_queries', 'query_budget', 'pool_stats', 'write_stats', 'close',
+                    'get_longpoll_ts', 'save_longpoll_ts'))
 class Database:
     """Класс для работы с базой данных PostgreSQL"""
 
     def __init__(self) -> None:
-        """Инициализация подключения к БД с проверкой"""
+        """Инициализация пула подключений к БД с проверкой"""
         try:
-            self.conn = psycopg2.connect(
+            self.pool = ConnectionPool(
+                minconn=int(os.getenv('DB_POOL_MIN', 1)),
+                maxconn=int(os.getenv('DB_POOL_MAX', 10)),
+                timeout=float(os.getenv('DB_POOL_TIMEOUT', 5)),
                 dbname=os.getenv('DB_NAME'),
                 user=os.getenv('DB_USER'),
                 password=os.getenv('DB_PASSWORD'),
-                host=os.getenv('DB_HOST')
+                host=os.getenv('DB_HOST'),
+                connection_factory=PreparingConnection
             )
-            self.cur = self.conn.cursor(cursor_factory=DictCursor)
+
+            # Частые запросы готовятся на сервере один раз на соединение
+            self.use_prepared = os.getenv('DB_PREPARED', '1').lower() in ('1', 'true', 'yes')
 
             # Проверка подключения
-            self.cur.execute("SELECT 1")
-            self.conn.commit()
+            def check(cur: DictCursor) -> int:
+                cur.execute("SELECT 1")
+                return cur.connection.server_version
+
+            server_version = self._run(check)
 
-            logger.info("✅ Успешное подключение к PostgreSQL (версия: %s)",
-                        self.conn.server_version)
+            logger.info("✅ Успешное подключение к PostgreSQL (версия: %s)", server_version)
 
-            self._create_tables()
-            self._create_cache_table()
-            self._create_likes_table()  # Добавляем таблицу для лайков
+            # Схема БД: при актуальной версии - только проверка номера версии
+            self.schema_version = migrate(self)
+
+            # Отложенная запись пользователей, лайков, избранного и ЧС (групповая фиксация)
+            self.write_buffer: Optional[WriteBehindBuffer] = None
+            if os.getenv('DB_WRITE_BEHIND', '0').lower() in ('1', 'true', 'yes'):
+                self.write_buffer = WriteBehindBuffer(
+                    self._write_batch,
+                    batch_size=int(os.getenv('DB_WRITE_BATCH', 100)),
+                    interval=float(os.getenv('DB_WRITE_INTERVAL', 1.0)),
+                    max_pending=int(os.getenv('DB_WRITE_MAX_PENDING', 10000)),
+                    # Недоступность БД - повод повторить пачку, а не искать в ней плохие строки
+                    transient_errors=(psycopg2.OperationalError, psycopg2.InterfaceError, PoolError)
+                )
+                self.write_buffer.start()
+                logger.info("✅ Включена отложенная запись в БД")
 
         except Exception as e:
             logger.critical("❌ Ошибка подключения к PostgreSQL: %s", e)
             raise RuntimeError(f"Database connection failed: {e}")
 
-    def _create_likes_table(self) -> None:
-        """Создает таблицу для хранения информации о лайках"""
-        self.cur.execute("""
-            CREATE TABLE IF NOT EXISTS Likes (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER NOT NULL REFERENCES Users(vk_id),
-                liked_user_id INTEGER NOT NULL,
-                photo_id INTEGER NOT NULL,
-                liked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(user_id, photo_id)  -- Один лайк на фото от пользователя
-            );
-        """)
-        self.conn.commit()
+    @contextmanager
+    def _cursor(self) -> Iterator[DictCursor]:
+        """
+        Выдает курсор на соединении из пула. Транзакция фиксируется
+        при успешном выходе и откатывается при ошибке
+        """
+        conn = self.pool.getconn()
+        try:
+            with conn.cursor(cursor_factory=CountingCursor) as cur:
+                yield cur
+            conn.commit()
+            for counter in _active_counters():
+                counter.commits += 1
+        except Exception:
+            if not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    pass
+            REGISTRY.inc('db_errors_total', method=current_db_method())
+            raise
+        finally:
+            self.pool.putconn(conn)
+
+    def _run(self, work: Callable[[DictCursor], Any]) -> Any:
+        """
+        Выполняет work(cur) в одной транзакции. Если соединение оказалось
+        разорванным, переподключается и повторяет попытку один раз
+        """
+        try:
+            with self._cursor() as cur:
+                return work(cur)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            # Ошибки сервера (таймаут запроса и т.п.) имеют pgcode, обрыв соединения - нет
+            if e.pgcode is not None:
+                raise
+            logger.warning("Соединение с PostgreSQL разорвано, переподключение: %s", e)
+            self.pool.discard_idle()
+            with self._cursor() as cur:
+                return work(cur)
+
+    def _execute(self, query: str, params: Optional[Tuple] = None, fetch: Optional[str] = None,
+                 prepare: Optional[str] = None) -> Any:
+        """
+        Выполняет один запрос
+
+        Args:
+            query: Текст запроса
+            params: Параметры запроса
+            fetch: 'one' - вернуть одну строку, 'all' - все строки, None - ничего
+            prepare: Имя, под которым запрос готовится (PREPARE) на соединении
+                и затем выполняется через EXECUTE (если use_prepared включен)
+        """
+        def work(cur: DictCursor) -> Any:
+            if prepare and self.use_prepared:
+                self._execute_prepared(cur, prepare, query, params)
+            else:
+                cur.execute(query, params)
+            if fetch == 'one':
+                return cur.fetchone()
+            if fetch == 'all':
+                return cur.fetchall()
+            return None
+
+        return self._run(work)
+
+    @contextmanager
+    def count_queries(self) -> Iterator[QueryCounter]:
+        """
+        Считает запросы к БД, выполненные в текущем потоке внутри блока
+
+        Пример:
+            with db.count_queries() as counter:
+                bot._handle_add_favorite(user_id, payload)
+            assert counter.queries == 1
+        """
+        counter = QueryCounter()
+        stack = getattr(_counters, 'stack', None)
+        if stack is None:
+            stack = _counters.stack = []
+        stack.append(counter)
+        try:
+            yield counter
+        finally:
+            stack.remove(counter)
+
+    @contextmanager
+    def query_budget(self, max_queries: int, max_round_trips: Optional[int] = None) -> Iterator[QueryCounter]:
+        """
+        То же, что count_queries, но при выходе из блока проверяет бюджет
+
+        Raises:
+            QueryBudgetExceeded: Запросов (или обращений к серверу) больше разрешенного
+        """
+        with self.count_queries() as counter:
+            yield counter
+        if counter.queries > max_queries or (
+                max_round_trips is not None and counter.round_trips > max_round_trips):
+            statements = "\n".join(f"  {' '.join(q.split())[:120]}" for q in counter.statements)
+            raise QueryBudgetExceeded(
+                f"Запросов: {counter.queries} (разрешено {max_queries}), "
+                f"обращений к серверу: {counter.round_trips}\n{statements}"
+            )
+
+    @staticmethod
+    def _execute_prepared(cur: DictCursor, name: str, query: str, params: Optional[Tuple]) -> None:
+        """
+        Выполняет запрос через EXECUTE, при первом использовании на соединении
+        подготавливая его. PREPARE не откатывается вместе с транзакцией,
+        поэтому имя запоминается сразу после успешной подготовки
+        """
+        conn = cur.connection
+        prepared = getattr(conn, 'prepared', None)
+        if prepared is None:
+            cur.execute(query, params)
+            return
+
+        if name not in prepared:
+            numbers = iter(range(1, query.count('%s') + 1))
+            cur.execute(f"PREPARE {name} AS {_PLACEHOLDER.sub(lambda _: f'${next(numbers)}', query)}")
+            prepared.add(name)
+
+        params = tuple(params or ())
+        if params:
+            cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+        else:
+            cur.execute(f"EXECUTE {name}")
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """Статистика пула соединений (занятые, ожидания, время ожидания)"""
+        return self.pool.stats()
+
+    def write_stats(self) -> Dict[str, Any]:
+        """Статистика буфера отложенной записи (пустой словарь, если он выключен)"""
+        return self.write_buffer.stats() if self.write_buffer is not None else {}
+
+    def flush_writes(self) -> int:
+        """Сбрасывает буфер отложенной записи, возвращает количество записанных строк"""
+        if self.write_buffer is None:
+            return 0
+        try:
+            return self.write_buffer.flush()
+        except Exception as e:
+            logger.error(f"Error flushing writes: {e}")
+            return 0
+
+    def _pending(self, table: str, user_id: int) -> List[Tuple]:
+        """Еще не записанные в БД строки пользователя из буфера отложенной записи"""
+        if self.write_buffer is None:
+            return []
+        return self.write_buffer.pending(table, user_id)
+
+    def _write_batch(self, batch: Dict[str, List[Tuple]]) -> None:
+        """Записывает пачку строк из буфера отложенной записи одной транзакцией"""
+        # Последняя версия профиля каждого пользователя (иначе ON CONFLICT DO UPDATE
+        # упадет на повторе ключа внутри одного запроса)
+        users = list({row[0]: row for row in batch.get('users', [])}.values())
+        referenced = {
+            vk_id
+            for table in ('likes', 'favorites', 'blacklist')
+            for row in batch.get(table, [])
+            for vk_id in row[:2]
+        }
+
+        def work(cur: DictCursor) -> None:
+            if users:
+                execute_values(cur, """
+                    INSERT INTO Users (vk_id, first_name, last_name, age, sex, city)
+                    VALUES %s
+                    ON CONFLICT (vk_id)
+                    DO UPDATE SET
+                        first_name = EXCLUDED.first_name,
+                        last_name = EXCLUDED.last_name,
+                        age = COALESCE(EXCLUDED.age, Users.age),
+                        sex = COALESCE(EXCLUDED.sex, Users.sex),
+                        city = COALESCE(EXCLUDED.city, Users.city);
+                """, users, page_size=len(users))
+            if referenced:
+                self._ensure_users(cur, *referenced)
+            if batch.get('likes'):
+                execute_values(cur, """
+                    INSERT INTO Likes (user_id, liked_user_id, photo_id, liked_at)
+                    VALUES %s
+                    ON CONFLICT (user_id, photo_id) DO NOTHING;
+                """, batch['likes'], page_size=len(batch['likes']))
+            if batch.get('favorites'):
+                execute_values(cur, """
+                    INSERT INTO Favorites (user_id, favorite_vk_id, added_date)
+                    VALUES %s
+                    ON CONFLICT (user_id, favorite_vk_id) DO NOTHING;
+                """, batch['favorites'], page_size=len(batch['favorites']))
+            if batch.get('blacklist'):
+                execute_values(cur, """
+                    INSERT INTO Blacklist (user_id, blocked_vk_id, blocked_date)
+                    VALUES %s
+                    ON CONFLICT (user_id, blocked_vk_id) DO NOTHING;
+                """, batch['blacklist'], page_size=len(batch['blacklist']))
+
+        self._run(work)
 
     def add_like(self, user_id: int, liked_user_id: int, photo_id: int) -> bool:
         """
@@ -68,34 +483,28 @@ class Database:
 
         Returns:
             True если лайк успешно добавлен, False если уже существует
-        """
-        try:
-            # Проверяем существование пользователей
-            self.cur.execute("SELECT 1 FROM Users WHERE vk_id = %s", (user_id,))
-            if not self.cur.fetchone():
-                logger.error(f"User {user_id} not found")
-                return False
 
-            self.cur.execute("SELECT 1 FROM Users WHERE vk_id = %s", (liked_user_id,))
-            if not self.cur.fetchone():
-                logger.error(f"Liked user {liked_user_id} not found")
+        Raises:
+            Exception: Ошибка БД - чтобы ее не приняли за повтор
+        """
+        if self.write_buffer is not None:
+            if self.has_liked_photo(user_id, photo_id):
                 return False
+            self.write_buffer.add('likes', user_id, (user_id, liked_user_id, photo_id, datetime.now()))
+            return True
 
-            # Добавляем лайк
-            self.cur.execute("""
+        try:
+            # Пользователи могли ещё не попасть в БД - их записи создаются тем же запросом
+            return bool(self._execute(f"""
+                WITH {_ENSURE_USERS_CTE}
                 INSERT INTO Likes (user_id, liked_user_id, photo_id)
                 VALUES (%s, %s, %s)
                 ON CONFLICT (user_id, photo_id) DO NOTHING
                 RETURNING 1;
-            """, (user_id, liked_user_id, photo_id))
-
-            self.conn.commit()
-            return bool(self.cur.fetchone())
-
+            """, ([user_id, liked_user_id], user_id, liked_user_id, photo_id), fetch='one'))
         except Exception as e:
-            self.conn.rollback()
             logger.error(f"Error adding like: {e}")
-            return False
+            raise
 
     def get_user_likes(self, user_id: int) -> List[Dict]:
         """
@@ -108,21 +517,26 @@ class Database:
             Список словарей с информацией о лайках
         """
         try:
-            self.cur.execute("""
+            rows = self._execute("""
                 SELECT liked_user_id, photo_id, liked_at 
                 FROM Likes 
                 WHERE user_id = %s
                 ORDER BY liked_at DESC;
-            """, (user_id,))
+            """, (user_id,), fetch='all')
 
-            return [
+            likes = [
                 {
                     'liked_user_id': row['liked_user_id'],
                     'photo_id': row['photo_id'],
                     'liked_at': row['liked_at']
                 }
-                for row in self.cur.fetchall()
+                for row in rows
             ]
+            pending = [
+                {'liked_user_id': row[1], 'photo_id': row[2], 'liked_at': row[3]}
+                for row in reversed(self._pending('likes', user_id))
+            ]
+            return pending + likes
         except Exception as e:
             logger.error(f"Error getting user likes: {e}")
             return []
@@ -138,94 +552,45 @@ class Database:
         Returns:
             True если лайк уже был поставлен, иначе False
         """
+        if any(row[2] == photo_id for row in self._pending('likes', user_id)):
+            return True
         try:
-            self.cur.execute("""
-                SELECT 1 FROM Likes 
+            return bool(self._execute("""
+                SELECT 1 FROM Likes
                 WHERE user_id = %s AND photo_id = %s;
-            """, (user_id, photo_id))
-
-            return bool(self.cur.fetchone())
+            """, (user_id, photo_id), fetch='one', prepare='has_liked_photo'))
         except Exception as e:
             logger.error(f"Error checking like: {e}")
             return False
 
     def check_connection(self) -> bool:
-        """Проверяет активность подключения к БД"""
+        """Проверяет активность подключения к БД (с переподключением при обрыве)"""
         try:
-            self.cur.execute("SELECT 1")
+            self._execute("SELECT 1")
             return True
         except Exception as e:
             logger.error("Соединение с PostgreSQL разорвано: %s", e)
             return False
 
-    def _create_tables(self) -> None:
-        """Создает необходимые таблицы в БД если они не существуют"""
-        tables = [
-            """
-            CREATE TABLE IF NOT EXISTS Users (
-                id SERIAL PRIMARY KEY,
-                vk_id INTEGER UNIQUE NOT NULL,
-                first_name VARCHAR(50),
-                last_name VARCHAR(50),
-                age INTEGER,
-                sex VARCHAR(10),
-                city VARCHAR(50)
-            );
-            """,
-            """
-            CREATE TABLE IF NOT EXISTS Favorites (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER REFERENCES Users(vk_id),
-                favorite_vk_id INTEGER NOT NULL,
-                added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(user_id, favorite_vk_id)
-            );
-            """,
-            """
-            CREATE TABLE IF NOT EXISTS Blacklist (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER NOT NULL REFERENCES Users(vk_id),
-            blocked_vk_id INTEGER NOT NULL,
-            blocked_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(user_id, blocked_vk_id)
-        );
-            """
-        ]
+    @staticmethod
+    def query_hash(search_params: Dict) -> str:
+        """Хэш параметров запроса, не зависящий от порядка ключей"""
+        canonical = json.dumps(search_params, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+        return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
 
-        for table in tables:
-            self.cur.execute(table)
-        self.conn.commit()
-
-    def _create_cache_table(self) -> None:
-        """Создает таблицу для кэширования результатов поиска"""
-        self.cur.execute("""
-            CREATE TABLE IF NOT EXISTS search_cache (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER NOT NULL,
-                search_params JSONB NOT NULL,
-                results JSONB NOT NULL,
-                expires_at TIMESTAMP NOT NULL,
-                UNIQUE(user_id, search_params)
-            );
-        """)
-        self.conn.commit()
-
-    def get_cached_results(self, user_id: int, search_params: Dict) -> Optional[List[Dict]]:
-        """
-        Получает закэшированные результаты поиска
+    def get_cached_results(self, search_params: Dict) -> Optional[List[Dict]]:
+        """
+        Получает закэшированные результаты поиска (общие для всех пользователей)
         Args:
-            user_id: ID пользователя VK
-            search_params: Параметры поиска
+            search_params: Параметры запроса users.search
         Returns:
             Список пользователей или None если кэш устарел
         """
         try:
-            self.cur.execute("""
+            result = self._execute("""
                 SELECT results::text FROM search_cache
-                WHERE user_id = %s AND search_params = %s AND expires_at > NOW()
-                LIMIT 1;
-            """, (user_id, json.dumps(search_params)))
-            result = self.cur.fetchone()
+                WHERE query_hash = %s AND expires_at > NOW();
+            """, (self.query_hash(search_params),), fetch='one', prepare='get_cached_results')
             if result:
                 return json.loads(result[0])
             return None
@@ -233,12 +598,11 @@ class Database:
             logger.error(f"Error getting cached results: {e}")
             return None
 
-    def cache_results(self, user_id: int, search_params: Dict, results: List[Dict], ttl_hours: int = 24) -> None:
+    def cache_results(self, search_params: Dict, results: List[Dict], ttl_hours: int = 24) -> None:
         """
         Сохраняет результаты поиска в кэш
         Args:
-            user_id: ID пользователя VK
-            search_params: Параметры поиска
+            search_params: Параметры запроса users.search
             results: Найденные пользователи
             ttl_hours: Время жизни кэша в часах
         """
@@ -246,17 +610,273 @@ class Database:
         try:
             # Сериализуем данные в JSON строку
             serialized_results = json.dumps(results, ensure_ascii=False)
-            self.cur.execute("""
-                INSERT INTO search_cache (user_id, search_params, results, expires_at)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (user_id, search_params) 
-                DO UPDATE SET results = EXCLUDED.results, expires_at = EXCLUDED.expires_at;
-            """, (user_id, json.dumps(search_params), serialized_results, expires_at))
-            self.conn.commit()
+            self._execute("""
+                INSERT INTO search_cache (query_hash, search_params, results, expires_at, size_bytes)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (query_hash)
+                DO UPDATE SET results = EXCLUDED.results, expires_at = EXCLUDED.expires_at,
+                              size_bytes = EXCLUDED.size_bytes;
+            """, (
+                self.query_hash(search_params),
+                json.dumps(search_params),
+                serialized_results,
+                expires_at,
+                len(serialized_results.encode('utf-8'))
+            ))
         except Exception as e:
-            self.conn.rollback()
             logger.error(f"Error caching results: {e}")
 
+    def get_cached_results_many(self, params_list: List[Dict]) -> List[Optional[List[Dict]]]:
+        """
+        Получает закэшированные результаты нескольких запросов одним запросом к БД
+        Args:
+            params_list: Параметры запросов users.search
+        Returns:
+            Результаты в порядке params_list (None - записи нет или она устарела)
+        """
+        if not params_list:
+            return []
+        hashes = [self.query_hash(params) for params in params_list]
+        try:
+            rows = self._execute("""
+                SELECT query_hash, results::text FROM search_cache
+                WHERE query_hash = ANY(%s) AND expires_at > NOW();
+            """, (hashes,), fetch='all', prepare='get_cached_results_many')
+            found = {row[0]: row[1] for row in rows}
+            return [json.loads(found[h]) if h in found else None for h in hashes]
+        except Exception as e:
+            logger.error(f"Error getting cached results: {e}")
+            return [None] * len(params_list)
+
+    def cache_results_many(self, pages: List[Tuple[Dict, List[Dict]]], ttl_hours: int = 24) -> None:
+        """
+        Сохраняет результаты нескольких запросов в кэш одним запросом к БД
+        Args:
+            pages: Пары (параметры запроса users.search, найденные пользователи)
+            ttl_hours: Время жизни кэша в часах
+        """
+        if not pages:
+            return
+        expires_at = datetime.now() + timedelta(hours=ttl_hours)
+        # Последняя версия каждого запроса (иначе ON CONFLICT DO UPDATE упадет на повторе ключа)
+        rows = {}
+        for search_params, results in pages:
+            serialized_results = json.dumps(results, ensure_ascii=False)
+            query_hash = self.query_hash(search_params)
+            rows[query_hash] = (query_hash, json.dumps(search_params), serialized_results, expires_at,
+                                len(serialized_results.encode('utf-8')))
+        try:
+            def work(cur: DictCursor) -> None:
+                execute_values(cur, """
+                    INSERT INTO search_cache (query_hash, search_params, results, expires_at, size_bytes)
+                    VALUES %s
+                    ON CONFLICT (query_hash)
+                    DO UPDATE SET results = EXCLUDED.results, expires_at = EXCLUDED.expires_at,
+                                  size_bytes = EXCLUDED.size_bytes;
+                """, list(rows.values()), page_size=len(rows))
+
+            self._run(work)
+        except Exception as e:
+            logger.error(f"Error caching results: {e}")
+
+    def delete_expired_results(self, batch_size: int = 1000) -> int:
+        """
+        Удаляет одну пачку устаревших записей кэша поиска
+        Args:
+            batch_size: Максимальное количество удаляемых записей
+        Returns:
+            Количество удаленных записей
+        """
+        result = self._execute("""
+            WITH victims AS (
+                SELECT id FROM search_cache
+                WHERE expires_at <= NOW()
+                LIMIT %s
+            ), deleted AS (
+                DELETE FROM search_cache
+                WHERE id IN (SELECT id FROM victims)
+                RETURNING 1
+            )
+            SELECT COUNT(*) FROM deleted;
+        """, (batch_size,), fetch='one')
+        return result[0]
+
+    def evict_oldest_results(self, batch_size: int = 1000) -> Tuple[int, int]:
+        """
+        Удаляет пачку записей кэша поиска, которые устареют раньше остальных
+        Args:
+            batch_size: Максимальное количество удаляемых записей
+        Returns:
+            (количество удаленных записей, освобожденный объем в байтах)
+        """
+        result = self._execute("""
+            WITH victims AS (
+                SELECT id FROM search_cache
+                ORDER BY expires_at
+                LIMIT %s
+            ), deleted AS (
+                DELETE FROM search_cache
+                WHERE id IN (SELECT id FROM victims)
+                RETURNING size_bytes
+            )
+            SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM deleted;
+        """, (batch_size,), fetch='one')
+        return result[0], int(result[1])
+
+    def search_cache_stats(self) -> Dict[str, int]:
+        """Количество записей кэша поиска, их объем и количество устаревших"""
+        result = self._execute("""
+            SELECT COUNT(*),
+                   COALESCE(SUM(size_bytes), 0),
+                   COUNT(*) FILTER (WHERE expires_at <= NOW()),
+                   pg_total_relation_size('search_cache')
+            FROM search_cache;
+        """, fetch='one')
+        return {
+            'rows': result[0],
+            'bytes': int(result[1]),
+            'expired': result[2],
+            'table_bytes': result[3]
+        }
+
+    def get_cached_photos(self, owner_ids: List[int]) -> Dict[int, List[Dict]]:
+        """
+        Получает закэшированные фото нескольких пользователей одним запросом
+        Args:
+            owner_ids: ID владельцев фото
+        Returns:
+            Словарь {ID владельца: список фото} для неустаревших записей
+        """
+        try:
+            rows = self._execute("""
+                SELECT owner_id, photos::text FROM photo_cache
+                WHERE owner_id = ANY(%s) AND expires_at > NOW();
+            """, (list(owner_ids),), fetch='all', prepare='get_cached_photos')
+            return {row[0]: json.loads(row[1]) for row in rows}
+        except Exception as e:
+            logger.error(f"Error getting cached photos: {e}")
+            return {}
+
+    def cache_photos(self, photos: Dict[int, List[Dict]], ttl_seconds: float = 3600) -> None:
+        """
+        Сохраняет фото пользователей в кэш одним запросом
+        Args:
+            photos: Словарь {ID владельца: список фото}
+            ttl_seconds: Время жизни кэша в секундах (как PHOTO_CACHE_TTL кэша в памяти)
+        """
+        if not photos:
+            return
+
+        expires_at = datetime.now() + timedelta(seconds=ttl_seconds)
+        rows = [
+            (owner_id, json.dumps(items, ensure_ascii=False), expires_at)
+            for owner_id, items in photos.items()
+        ]
+
+        def work(cur: DictCursor) -> None:
+            execute_values(cur, """
+                INSERT INTO photo_cache (owner_id, photos, expires_at)
+                VALUES %s
+                ON CONFLICT (owner_id)
+                DO UPDATE SET photos = EXCLUDED.photos, expires_at = EXCLUDED.expires_at;
+            """, rows, page_size=len(rows))
+
+        try:
+            self._run(work)
+        except Exception as e:
+            logger.error(f"Error caching photos: {e}")
+
+    def save_session(self, user_id: int, candidates: bytes, position: int,
+                     search_params: Dict, cursor: Optional[Tuple[Tuple[int, ...], int]]) -> bool:
+        """
+        Сохраняет позицию сессии поиска
+        Args:
+            user_id: ID пользователя VK
+            candidates: ID кандидатов в буфере (array('q').tobytes())
+            position: Индекс текущего кандидата
+            search_params: Параметры поиска
+            cursor: Позиция следующего раунда поиска (годы, offset) или None, если поиск завершен
+        Returns:
+            True если успешно сохранено
+        """
+        try:
+            self._execute("""
+                INSERT INTO search_sessions (user_id, candidates, position, search_params, cursor, updated_at)
+                VALUES (%s, %s, %s, %s, %s, NOW())
+                ON CONFLICT (user_id)
+                DO UPDATE SET candidates = EXCLUDED.candidates, position = EXCLUDED.position,
+                              search_params = EXCLUDED.search_params, cursor = EXCLUDED.cursor,
+                              updated_at = EXCLUDED.updated_at;
+            """, (
+                user_id,
+                psycopg2.Binary(candidates),
+                position,
+                json.dumps(search_params, ensure_ascii=False),
+                json.dumps(cursor) if cursor is not None else None
+            ))
+            return True
+        except Exception as e:
+            logger.error(f"Error saving session: {e}")
+            return False
+
+    def load_session(self, user_id: int, max_age_hours: int = 168) -> Optional[Dict]:
+        """
+        Загружает сохраненную сессию поиска
+        Args:
+            user_id: ID пользователя VK
+            max_age_hours: Сессии старше этого срока не восстанавливаются
+        Returns:
+            Словарь candidates/position/search_params/cursor или None
+        """
+        try:
+            row = self._execute("""
+                SELECT candidates, position, search_params::text, cursor::text
+                FROM search_sessions
+                WHERE user_id = %s AND updated_at > NOW() - make_interval(hours => %s);
+            """, (user_id, max_age_hours), fetch='one')
+            if not row:
+                return None
+            cursor = json.loads(row[3]) if row[3] else None
+            if cursor is not None and isinstance(cursor[0], list):
+                cursor = (tuple(cursor[0]), cursor[1])
+            return {
+                'candidates': bytes(row[0]),
+                'position': row[1],
+                'search_params': json.loads(row[2]),
+                'cursor': tuple(cursor) if cursor is not None else None
+            }
+        except Exception as e:
+            logger.error(f"Error loading session: {e}")
+            return None
+
+    def delete_session(self, user_id: int) -> None:
+        """Удаляет сохраненную сессию поиска"""
+        try:
+            self._execute("DELETE FROM search_sessions WHERE user_id = %s;", (user_id,))
+        except Exception as e:
+            logger.error(f"Error deleting session: {e}")
+
+    def get_longpoll_ts(self, group_id: int) -> Optional[str]:
+        """Сохраненная позиция чтения Bots Long Poll сообщества или None"""
+        try:
+            row = self._execute("SELECT ts FROM longpoll_state WHERE group_id = %s;", (group_id,), fetch='one')
+            return row[0] if row else None
+        except Exception as e:
+            logger.error(f"Error loading longpoll ts: {e}")
+            return None
+
+    def save_longpoll_ts(self, group_id: int, ts: str) -> None:
+        """Сохраняет позицию чтения Bots Long Poll сообщества"""
+        try:
+            self._execute("""
+                INSERT INTO longpoll_state (group_id, ts, updated_at)
+                VALUES (%s, %s, NOW())
+                ON CONFLICT (group_id)
+                DO UPDATE SET ts = EXCLUDED.ts, updated_at = EXCLUDED.updated_at;
+            """, (group_id, ts))
+        except Exception as e:
+            logger.error(f"Error saving longpoll ts: {e}")
+
     def add_user(self, vk_id: int, first_name: str, last_name: str,
                  age: Optional[int] = None, sex: Optional[str] = None,
                  city: Optional[str] = None) -> bool:
@@ -266,8 +886,12 @@ class Database:
         Returns:
             True если пользователь добавлен/обновлен, False при ошибке
         """
+        if self.write_buffer is not None:
+            self.write_buffer.add('users', vk_id, (vk_id, first_name, last_name, age, sex, city))
+            return True
+
         try:
-            self.cur.execute("""
+            return bool(self._execute("""
                 INSERT INTO Users (vk_id, first_name, last_name, age, sex, city)
                 VALUES (%s, %s, %s, %s, %s, %s)
                 ON CONFLICT (vk_id) 
@@ -278,21 +902,19 @@ class Database:
                     sex = COALESCE(EXCLUDED.sex, Users.sex),
                     city = COALESCE(EXCLUDED.city, Users.city)
                 RETURNING 1;
-            """, (vk_id, first_name, last_name, age, sex, city))
-            self.conn.commit()
-            return bool(self.cur.fetchone())
+            """, (vk_id, first_name, last_name, age, sex, city), fetch='one'))
         except Exception as e:
-            self.conn.rollback()
             logger.error(f"Error adding user {vk_id}: {e}")
             return False
 
     def user_exists(self, vk_id: int) -> bool:
         """Проверяет существует ли пользователь в БД"""
+        if self._pending('users', vk_id):
+            return True
         try:
-            self.cur.execute("""
+            return bool(self._execute("""
                 SELECT 1 FROM Users WHERE vk_id = %s
-            """, (vk_id,))
-            return bool(self.cur.fetchone())
+            """, (vk_id,), fetch='one', prepare='user_exists'))
         except Exception as e:
             logger.error(f"Error checking user {vk_id}: {e}")
             return False
@@ -307,43 +929,31 @@ class Database:
 
         Returns:
             True если добавление успешно, False если пользователь уже в избранном
-            или произошла ошибка
-        """
-        try:
-            # Проверяем существование пользователей
-            self.cur.execute("SELECT 1 FROM Users WHERE vk_id = %s", (user_id,))
-            if not self.cur.fetchone():
-                logger.error(f"User {user_id} not found in database")
-                return False
-
-            self.cur.execute("SELECT 1 FROM Users WHERE vk_id = %s", (favorite_vk_id,))
-            if not self.cur.fetchone():
-                logger.error(f"Favorite user {favorite_vk_id} not found in database")
-                return False
-
-            # Проверяем, есть ли уже в избранном
-            self.cur.execute("""
-                SELECT 1 FROM Favorites 
-                WHERE user_id = %s AND favorite_vk_id = %s
-            """, (user_id, favorite_vk_id))
 
-            if self.cur.fetchone():
-                logger.info(f"User {favorite_vk_id} already in favorites for user {user_id}")
+        Raises:
+            Exception: Ошибка БД - чтобы ее не приняли за повтор
+        """
+        if self.write_buffer is not None:
+            if favorite_vk_id in self.get_favorites(user_id):
                 return False
+            self.write_buffer.add('favorites', user_id, (user_id, favorite_vk_id, datetime.now()))
+            return True
 
-            # Добавляем в избранное
-            self.cur.execute("""
+        try:
+            # Пользователи могли ещё не попасть в БД - их записи создаются тем же запросом
+            added = bool(self._execute(f"""
+                WITH {_ENSURE_USERS_CTE}
                 INSERT INTO Favorites (user_id, favorite_vk_id)
                 VALUES (%s, %s)
-            """, (user_id, favorite_vk_id))
-
-            self.conn.commit()
-            return True
-
+                ON CONFLICT (user_id, favorite_vk_id) DO NOTHING
+                RETURNING 1;
+            """, ([user_id, favorite_vk_id], user_id, favorite_vk_id), fetch='one'))
+            if not added:
+                logger.info(f"User {favorite_vk_id} already in favorites for user {user_id}")
+            return added
         except Exception as e:
-            self.conn.rollback()
             logger.error(f"Error adding favorite: {e}")
-            return False
+            raise
 
     def add_to_blacklist(self, user_id: int, blocked_vk_id: int) -> bool:
         """
@@ -355,35 +965,28 @@ class Database:
 
         Returns:
             True если добавление успешно, False если пользователь уже в черном списке
-        """
-        try:
-            # Проверяем существование пользователей
-            self.cur.execute("SELECT 1 FROM Users WHERE vk_id = %s", (user_id,))
-            if not self.cur.fetchone():
-                logger.error(f"User {user_id} not found")
-                return False
-
-            self.cur.execute("SELECT 1 FROM Users WHERE vk_id = %s", (blocked_vk_id,))
-            if not self.cur.fetchone():
-                logger.error(f"Blocked user {blocked_vk_id} not found")
-                return False
 
-            # Проверяем, не добавлен ли уже пользователь в ЧС
+        Raises:
+            Exception: Ошибка БД - чтобы ее не приняли за повтор
+        """
+        if self.write_buffer is not None:
             if self.check_blacklist(user_id, blocked_vk_id):
                 return False
-
-            # Добавляем в черный список
-            self.cur.execute("""
-                    INSERT INTO Blacklist (user_id, blocked_vk_id)
-                    VALUES (%s, %s)
-                """, (user_id, blocked_vk_id))
-            self.conn.commit()
+            self.write_buffer.add('blacklist', user_id, (user_id, blocked_vk_id, datetime.now()))
             return True
 
+        try:
+            # Пользователи могли ещё не попасть в БД - их записи создаются тем же запросом
+            return bool(self._execute(f"""
+                WITH {_ENSURE_USERS_CTE}
+                INSERT INTO Blacklist (user_id, blocked_vk_id)
+                VALUES (%s, %s)
+                ON CONFLICT (user_id, blocked_vk_id) DO NOTHING
+                RETURNING 1;
+            """, ([user_id, blocked_vk_id], user_id, blocked_vk_id), fetch='one'))
         except Exception as e:
-            self.conn.rollback()
             logger.error(f"Error adding to blacklist: {e}")
-            return False
+            raise
 
     def get_favorites(self, user_id: int) -> List[int]:
         """
@@ -396,36 +999,69 @@ class Database:
             Список ID избранных пользователей
         """
         try:
-            self.cur.execute("""
+            rows = self._execute("""
                     SELECT favorite_vk_id FROM Favorites
                     WHERE user_id = %s
                     ORDER BY added_date DESC
-                """, (user_id,))
-            return [row['favorite_vk_id'] for row in self.cur.fetchall()]
+                """, (user_id,), fetch='all', prepare='get_favorites')
+            favorites = [row['favorite_vk_id'] for row in rows]
+            pending = [row[1] for row in reversed(self._pending('favorites', user_id)) if row[1] not in favorites]
+            return pending + favorites
         except Exception as e:
             print(f"Error getting favorites: {e}")
             return []
 
     def check_blacklist(self, user_id: int, target_vk_id: int) -> bool:
         """Проверяет наличие пользователя в ЧС"""
+        if any(row[1] == target_vk_id for row in self._pending('blacklist', user_id)):
+            return True
         try:
-            # Автоматически создаем записи если пользователей нет
-            if not self.user_exists(user_id):
-                self.add_user(user_id, "", "", None, None, None)
-
-            if not self.user_exists(target_vk_id):
-                self.add_user(target_vk_id, "", "", None, None, None)
-
-            self.cur.execute("""
+            return bool(self._execute("""
                 SELECT 1 FROM Blacklist
                 WHERE user_id = %s AND blocked_vk_id = %s
-            """, (user_id, target_vk_id))
-            return bool(self.cur.fetchone())
+            """, (user_id, target_vk_id), fetch='one', prepare='check_blacklist'))
         except Exception as e:
             logger.error(f"Error checking blacklist: {e}")
             return False
 
+    def get_excluded_ids(self, user_id: int) -> Set[int]:
+        """
+        Получает ID пользователей, которых не нужно показывать в поиске,
+        одним запросом: черный список и избранное
+
+        Args:
+            user_id: ID пользователя VK
+
+        Returns:
+            Множество ID заблокированных и избранных пользователей
+        """
+        try:
+            rows = self._execute("""
+                SELECT blocked_vk_id FROM Blacklist WHERE user_id = %s
+                UNION
+                SELECT favorite_vk_id FROM Favorites WHERE user_id = %s
+            """, (user_id, user_id), fetch='all', prepare='get_excluded_ids')
+            excluded = {row[0] for row in rows}
+            for table in ('blacklist', 'favorites'):
+                excluded.update(row[1] for row in self._pending(table, user_id))
+            return excluded
+        except Exception as e:
+            logger.error(f"Error getting excluded users: {e}")
+            return set()
+
+    def _ensure_users(self, cur: DictCursor, *vk_ids: int) -> None:
+        """Создает пустые записи пользователей, которых еще нет в БД"""
+        cur.execute("""
+            INSERT INTO Users (vk_id)
+            SELECT unnest(%s::integer[])
+            ON CONFLICT (vk_id) DO NOTHING
+        """, (list(vk_ids),))
+
     def close(self) -> None:
-        """Закрывает соединение с БД"""
-        self.cur.close()
-        self.conn.close()
+        """Сбрасывает отложенные записи и закрывает все соединения с БД"""
+        if self.write_buffer is not None:
+            try:
+                self.write_buffer.stop()
+            except Exception as e:
+                logger.error(f"Не удалось сбросить отложенные записи: {e}")
+        self.pool.closeall()
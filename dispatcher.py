@@ -0,0 +1,112 @@
+import logging
+import queue
+import threading
+from typing import Any, Callable, List, Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class EventDispatcher:
+    """Распределяет события LongPoll по пулу воркеров
+
+    События шардируются по user_id: события одного пользователя всегда
+    попадают в один и тот же воркер и обрабатываются строго по порядку,
+    а события разных пользователей обрабатываются параллельно.
+    Очередь каждого воркера ограничена - при её заполнении submit()
+    блокирует поток LongPoll (backpressure).
+    """
+
+    _STOP = object()
+
+    def __init__(self, handler: Callable[[Any], None], workers: int = 4,
+                 queue_size: int = 100, put_timeout: Optional[float] = None) -> None:
+        """
+        Args:
+            handler: Функция обработки одного события
+            workers: Количество потоков-обработчиков
+            queue_size: Максимальная длина очереди одного воркера
+            put_timeout: Сколько секунд ждать места в очереди
+                (None - ждать бесконечно, событие не теряется)
+        """
+        if workers < 1:
+            raise ValueError("Количество воркеров должно быть не меньше 1")
+        if queue_size < 1:
+            raise ValueError("Размер очереди должен быть не меньше 1")
+
+        self.handler = handler
+        self.put_timeout = put_timeout
+        self._queues: List[queue.Queue] = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._threads: List[threading.Thread] = []
+        self.dropped = 0
+
+    @property
+    def workers(self) -> int:
+        """Количество воркеров"""
+        return len(self._queues)
+
+    def start(self) -> None:
+        """Запускает потоки-обработчики"""
+        if self._threads:
+            return
+
+        for i, q in enumerate(self._queues):
+            thread = threading.Thread(
+                target=self._worker, args=(q,), name=f"event-worker-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+        logger.info(f"✅ Запущено {self.workers} обработчиков событий")
+
+    def submit(self, event: Any) -> bool:
+        """
+        Ставит событие в очередь воркера, отвечающего за пользователя
+
+        Returns:
+            True если событие принято, False если очередь переполнена
+            дольше put_timeout
+        """
+        q = self._queues[self._shard(getattr(event, 'user_id', 0))]
+        try:
+            q.put(event, timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(f"Очередь обработчика переполнена, событие отброшено "
+                           f"(всего отброшено: {self.dropped})")
+            return False
+
+    def qsize(self) -> int:
+        """Суммарное количество событий в очередях"""
+        return sum(q.qsize() for q in self._queues)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Дожидается обработки уже принятых событий и останавливает воркеры"""
+        if not self._threads:
+            return
+        for i, q in enumerate(self._queues):
+            try:
+                q.put(self._STOP, timeout=timeout)
+            except queue.Full:
+                logger.warning(f"Очередь обработчика {i} переполнена, воркер не остановлен")
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _shard(self, user_id: int) -> int:
+        """Номер воркера для пользователя"""
+        return hash(user_id) % len(self._queues)
+
+    def _worker(self, q: queue.Queue) -> None:
+        """Цикл воркера: обрабатывает события своей очереди по порядку"""
+        while True:
+            event = q.get()
+            try:
+                if event is self._STOP:
+                    return
+                self.handler(event)
+            except Exception as e:
+                logger.error(f"Ошибка обработки события: {e}", exc_info=True)
+            finally:
+                q.task_done()
@@ -0,0 +1,200 @@
+import re
+import sys
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Set, Tuple, Union
+
+import numpy as np
+
+_SPACES = re.compile(r'\s+')
+
+# Простое число Мерсенна 2^31 - 1: a * x + b не переполняет uint64 при x < 2^32
+_MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+
+
+def normalize_tokens(values: Union[str, Iterable[str], None]) -> List[str]:
+    """
+    Приводит интересы к списку уникальных токенов
+
+    Строка разбивается по запятым; токены приводятся к нижнему регистру,
+    очищаются от лишних пробелов и интернируются, пустые и повторяющиеся
+    отбрасываются (порядок сохраняется).
+    """
+    if not values:
+        return []
+    if isinstance(values, str):
+        values = values.split(',')
+
+    tokens: Dict[str, None] = {}
+    for value in values:
+        token = _SPACES.sub(' ', value).strip().lower()
+        if token:
+            tokens.setdefault(sys.intern(token))
+    return list(tokens)
+
+
+class InterestIndex:
+    """Индекс интересов пользователей
+
+    Хранит для каждого пользователя набор интернированных токенов,
+    обратный индекс токен -> пользователи и MinHash-сигнатуру. Сходство
+    интересов ищущего с тысячами кандидатов считается по обратному
+    индексу (точный коэффициент Жаккара) или по сигнатурам (оценка),
+    без попарного сравнения строк. Размер индекса ограничен max_users,
+    при переполнении удаляются давно добавленные пользователи.
+    """
+
+    def __init__(self, num_perm: int = 64, max_users: int = 100000, seed: int = 1) -> None:
+        """
+        Args:
+            num_perm: Длина MinHash-сигнатуры
+            max_users: Максимальное количество пользователей в индексе
+            seed: Зерно для хэш-функций сигнатур
+        """
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, int(_MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, int(_MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+        self.num_perm = num_perm
+        self.max_users = max_users
+
+        self._tokens: 'OrderedDict[int, FrozenSet[str]]' = OrderedDict()
+        self._signatures: Dict[int, np.ndarray] = {}
+        self._postings: Dict[str, Set[int]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._tokens
+
+    def add(self, user_id: int, values: Union[str, Iterable[str], None]) -> None:
+        """Добавляет (или обновляет) интересы пользователя"""
+        self.add_many([(user_id, values)])
+
+    def add_many(self, items: Iterable[Tuple[int, Union[str, Iterable[str], None]]]) -> None:
+        """
+        Добавляет (или обновляет) интересы пачки пользователей. Сигнатуры
+        новых и изменившихся пользователей вычисляются одной операцией
+        """
+        changed = {}
+        with self._lock:
+            for user_id, values in items:
+                tokens = frozenset(normalize_tokens(values))
+                if self._tokens.get(user_id) == tokens:
+                    self._tokens.move_to_end(user_id)
+                else:
+                    changed[user_id] = tokens
+
+        if not changed:
+            return
+
+        signatures = self.signatures(list(changed.values()))
+        with self._lock:
+            for (user_id, tokens), signature in zip(changed.items(), signatures):
+                self._remove(user_id)
+                self._tokens[user_id] = tokens
+                self._signatures[user_id] = signature
+                for token in tokens:
+                    self._postings.setdefault(token, set()).add(user_id)
+            while len(self._tokens) > self.max_users:
+                self._remove(next(iter(self._tokens)))
+
+    def remove(self, user_id: int) -> None:
+        """Удаляет пользователя из индекса"""
+        with self._lock:
+            self._remove(user_id)
+
+    def users_with(self, token: str) -> Set[int]:
+        """Пользователи, у которых есть указанный интерес"""
+        tokens = normalize_tokens(token)
+        with self._lock:
+            return set(self._postings.get(tokens[0], ())) if tokens else set()
+
+    def jaccard(self, values: Union[str, Iterable[str], None], user_ids: Sequence[int]) -> np.ndarray:
+        """
+        Точный коэффициент Жаккара между интересами и каждым пользователем
+
+        Пересечения считаются по обратному индексу: для каждого токена
+        ищущего берется пересечение его списка пользователей с пачкой.
+        Пользователи, которых нет в индексе, получают 0.
+        """
+        mine = set(normalize_tokens(values))
+        scores = np.zeros(len(user_ids))
+        if not mine or not len(user_ids):
+            return scores
+
+        positions = {user_id: i for i, user_id in enumerate(user_ids)}
+        batch = set(positions)
+        overlap = np.zeros(len(user_ids))
+        sizes = np.zeros(len(user_ids))
+        with self._lock:
+            for token in mine:
+                for user_id in self._postings.get(token, set()) & batch:
+                    overlap[positions[user_id]] += 1
+            for user_id, i in positions.items():
+                sizes[i] = len(self._tokens.get(user_id, ()))
+
+        union = len(mine) + sizes - overlap
+        np.divide(overlap, union, out=scores, where=union > 0)
+        return scores
+
+    def estimate_jaccard(self, values: Union[str, Iterable[str], None], user_ids: Sequence[int]) -> np.ndarray:
+        """Оценка коэффициента Жаккара по MinHash-сигнатурам (одна векторная операция)"""
+        tokens = normalize_tokens(values)
+        scores = np.zeros(len(user_ids))
+        if not tokens or not len(user_ids):
+            return scores
+
+        mine = self.signature(tokens)
+        empty = self.signature(())
+        with self._lock:
+            matrix = np.stack([self._signatures.get(user_id, empty) for user_id in user_ids])
+        known = matrix[:, 0] != empty[0]
+        scores[known] = (matrix[known] == mine).mean(axis=1)
+        return scores
+
+    def signature(self, tokens: Iterable[str]) -> np.ndarray:
+        """MinHash-сигнатура набора токенов"""
+        return self.signatures([list(tokens)])[0]
+
+    def signatures(self, token_sets: Sequence[Iterable[str]]) -> np.ndarray:
+        """
+        MinHash-сигнатуры нескольких наборов токенов сразу
+
+        Returns:
+            Матрица (len(token_sets), num_perm); у пустых наборов все
+            элементы равны максимальному uint64
+        """
+        result = np.full((len(token_sets), self.num_perm), np.iinfo(np.uint64).max, dtype=np.uint64)
+        token_sets = [list(tokens) for tokens in token_sets]
+        lengths = np.fromiter((len(tokens) for tokens in token_sets), dtype=np.int64, count=len(token_sets))
+        nonempty = np.flatnonzero(lengths)
+        if not nonempty.size:
+            return result
+
+        hashes = np.fromiter(
+            (zlib.crc32(token.encode('utf-8')) for i in nonempty for token in token_sets[i]),
+            dtype=np.uint64
+        )
+        permuted = (self._a[:, None] * hashes[None, :] + self._b[:, None]) % _MERSENNE_PRIME
+        starts = np.concatenate(([0], np.cumsum(lengths[nonempty])[:-1]))
+        result[nonempty] = np.minimum.reduceat(permuted, starts, axis=1).T
+        return result
+
+    def tokens(self, user_id: int) -> Optional[FrozenSet[str]]:
+        """Интересы пользователя из индекса"""
+        with self._lock:
+            return self._tokens.get(user_id)
+
+    def _remove(self, user_id: int) -> None:
+        """Удаляет пользователя (вызывается под блокировкой)"""
+        tokens = self._tokens.pop(user_id, None)
+        self._signatures.pop(user_id, None)
+        for token in tokens or ():
+            users = self._postings.get(token)
+            if users is not None:
+                users.discard(user_id)
+                if not users:
+                    del self._postings[token]
@@ -0,0 +1,129 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class CacheJanitor:
+    """Фоновая очистка кэша поиска (search_cache)
+
+    Раз в interval секунд в отдельном потоке удаляет устаревшие записи,
+    а если суммарный объем результатов превышает max_bytes - записи,
+    которые устареют раньше остальных. Удаление идет пачками по
+    batch_size записей, каждая пачка - отдельная короткая транзакция,
+    так что очистка не держит блокировки и соединения надолго.
+    """
+
+    def __init__(self, db, interval: float = 300, max_bytes: int = 512 * 1024 * 1024,
+                 batch_size: int = 1000, pause: float = 0.05) -> None:
+        """
+        Args:
+            db: Экземпляр Database
+            interval: Период очистки, секунд
+            max_bytes: Максимальный объем результатов в кэше (0 - без ограничения)
+            batch_size: Сколько записей удалять за одну транзакцию
+            pause: Пауза между пачками, секунд
+        """
+        self.db = db
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.pause = pause
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # Статистика
+        self.runs = 0
+        self.expired_deleted = 0
+        self.evicted = 0
+        self.evicted_bytes = 0
+        self.last_run_time = 0.0
+        self.last_table_stats: Dict[str, int] = {}
+
+    def start(self) -> None:
+        """Запускает поток очистки"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="cache-janitor", daemon=True)
+        self._thread.start()
+        logger.info(f"🧹 Очистка кэша поиска запущена (каждые {self.interval:.0f} с)")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Останавливает поток очистки (текущая пачка дорабатывает)"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def run_once(self) -> Dict[str, int]:
+        """
+        Выполняет один проход очистки
+
+        Returns:
+            Количество удаленных устаревших и вытесненных записей
+        """
+        started = time.perf_counter()
+        expired = self._delete_expired()
+        evicted = self._enforce_size()
+
+        self.runs += 1
+        self.last_run_time = time.perf_counter() - started
+        if expired or evicted:
+            logger.info(f"🧹 Кэш поиска: удалено устаревших {expired}, вытеснено {evicted} "
+                        f"за {self.last_run_time:.2f} с")
+        return {'expired': expired, 'evicted': evicted}
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика очистки и размер кэша на момент последнего прохода"""
+        return {
+            'runs': self.runs,
+            'expired_deleted': self.expired_deleted,
+            'evicted': self.evicted,
+            'evicted_bytes': self.evicted_bytes,
+            'last_run_time': self.last_run_time,
+            **self.last_table_stats
+        }
+
+    def _loop(self) -> None:
+        """Цикл потока очистки"""
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Ошибка очистки кэша поиска: {e}")
+
+    def _delete_expired(self) -> int:
+        """Удаляет устаревшие записи пачками"""
+        total = 0
+        while not self._stop.is_set():
+            deleted = self.db.delete_expired_results(self.batch_size)
+            total += deleted
+            self.expired_deleted += deleted
+            if deleted < self.batch_size:
+                break
+            time.sleep(self.pause)
+        return total
+
+    def _enforce_size(self) -> int:
+        """Вытесняет самые старые записи, пока объем кэша больше max_bytes"""
+        table = self.db.search_cache_stats()
+        total = 0
+        if self.max_bytes:
+            size = table['bytes']
+            while size > self.max_bytes and not self._stop.is_set():
+                deleted, freed = self.db.evict_oldest_results(self.batch_size)
+                if not deleted:
+                    break
+                size -= freed
+                total += deleted
+                self.evicted += deleted
+                self.evicted_bytes += freed
+                time.sleep(self.pause)
+            if total:
+                table = self.db.search_cache_stats()
+        self.last_table_stats = table
+        return total
@@ -0,0 +1,305 @@
+import functools
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержки, секунд
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    """Метки в виде хэшируемого кортежа, упорядоченного по имени"""
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    """Метки в формате Prometheus: {name="value",...}"""
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = (
+        (key, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in pairs
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+class Histogram:
+    """Гистограмма значений с фиксированными границами корзин"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """Учитывает одно значение (вызывается под блокировкой реестра)"""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    """Реестр метрик: счетчики, гистограммы задержки и показатели компонентов
+
+    Счетчики и гистограммы обновляются из любых потоков. Показатели
+    (gauge) не хранятся, а собираются при выводе из stats() компонентов,
+    зарегистрированных через register_collector.
+    """
+
+    def __init__(self) -> None:
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._help: Dict[str, str] = {}
+        self._collectors: Dict[str, Callable[[], Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, help_text: str) -> None:
+        """Задает описание метрики (строка HELP)"""
+        self._help[name] = help_text
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        """Увеличивает счетчик"""
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        """Добавляет значение в гистограмму"""
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, errors: Optional[str] = None, **labels: Any) -> Iterator[None]:
+        """
+        Измеряет время выполнения блока
+
+        Args:
+            name: Гистограмма, в которую пишется время
+            errors: Счетчик, увеличиваемый при исключении в блоке
+            labels: Метки
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            if errors:
+                self.inc(errors, **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def register_collector(self, prefix: str, collect: Callable[[], Dict[str, Any]]) -> None:
+        """
+        Регистрирует источник показателей
+
+        Числовые значения из collect() выводятся как gauge с именем
+        prefix_ключ, вложенные словари разворачиваются через "_"
+        """
+        self._collectors[prefix] = collect
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        lines: List[str] = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                self._header(lines, name, 'counter')
+                for key, value in series.items():
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+
+            for name, series in sorted(self._histograms.items()):
+                self._header(lines, name, 'histogram')
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(key, ('le', repr(bound)))} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(key, ('le', '+Inf'))} {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {histogram.sum}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+
+        for prefix, collect in sorted(self._collectors.items()):
+            try:
+                values = collect()
+            except Exception as e:
+                logger.warning(f"Не удалось собрать метрики {prefix}: {e}")
+                continue
+            for name, value in sorted(self._flatten(prefix, values)):
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+
+        return '\n'.join(lines) + '\n'
+
+    def _header(self, lines: List[str], name: str, kind: str) -> None:
+        """Строки HELP и TYPE метрики"""
+        if name in self._help:
+            lines.append(f"# HELP {name} {self._help[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    @classmethod
+    def _flatten(cls, prefix: str, values: Dict[str, Any]) -> Iterator[Tuple[str, float]]:
+        """Числовые значения словаря (с вложенными словарями) с именами prefix_ключ"""
+        for key, value in values.items():
+            name = f"{prefix}_{key}"
+            if isinstance(value, dict):
+                yield from cls._flatten(name, value)
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                yield name, value
+
+
+# Общий реестр метрик бота
+REGISTRY = MetricsRegistry()
+REGISTRY.describe('bot_handler_seconds', 'Время обработки события по типу действия')
+REGISTRY.describe('bot_handler_errors_total', 'Необработанные ошибки обработчиков событий')
+REGISTRY.describe('vk_api_seconds', 'Время вызова метода VK API')
+REGISTRY.describe('vk_api_errors_total', 'Ошибки вызовов VK API')
+REGISTRY.describe('vk_api_packed_calls_total', 'Вызовы VK API, выполненные внутри execute')
+REGISTRY.describe('db_seconds', 'Время вызова метода Database')
+REGISTRY.describe('db_errors_total', 'Ошибки запросов к БД')
+
+_current_db_method = threading.local()
+
+
+def current_db_method() -> str:
+    """Публичный метод Database, выполняющийся в текущем потоке"""
+    return getattr(_current_db_method, 'name', 'unknown')
+
+
+def instrument_db(exclude: Tuple[str, ...] = ()) -> Callable[[type], type]:
+    """
+    Декоратор класса Database: время каждого публичного метода (кроме
+    exclude) пишется в гистограмму db_seconds с меткой method. Ошибки
+    запросов методы обычно перехватывают сами, поэтому их учитывает
+    Database._cursor через current_db_method()
+    """
+    def decorate(cls: type) -> type:
+        for name, method in list(vars(cls).items()):
+            if name.startswith('_') or name in exclude or not callable(method) \
+                    or isinstance(method, (staticmethod, classmethod)):
+                continue
+            setattr(cls, name, _timed_db_method(name, method))
+        return cls
+    return decorate
+
+
+def _timed_db_method(name: str, method: Callable) -> Callable:
+    """Обертка метода Database с замером времени"""
+    @functools.wraps(method)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        outer = getattr(_current_db_method, 'name', None)
+        _current_db_method.name = name
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            REGISTRY.observe('db_seconds', time.perf_counter() - started, method=name)
+            _current_db_method.name = outer
+    return wrapper
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Отдает метрики по GET /metrics"""
+
+    registry: MetricsRegistry = REGISTRY
+
+    def do_GET(self) -> None:
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # Запросы сборщика метрик не засоряют лог бота
+        pass
+
+
+class MetricsExporter:
+    """Вывод метрик: HTTP-эндпоинт /metrics и/или периодическая запись в файл"""
+
+    def __init__(self, registry: MetricsRegistry = REGISTRY, port: int = 0, host: str = '127.0.0.1',
+                 path: Optional[str] = None, interval: float = 60) -> None:
+        """
+        Args:
+            registry: Реестр метрик
+            port: Порт HTTP-эндпоинта (0 - не запускать)
+            host: Адрес HTTP-эндпоинта
+            path: Файл для периодической записи метрик (None - не писать)
+            interval: Период записи в файл, секунд
+        """
+        self.registry = registry
+        self.port = port
+        self.host = host
+        self.path = path
+        self.interval = interval
+
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        """Запускает эндпоинт и запись в файл (если они настроены)"""
+        if self.port:
+            handler = type('MetricsHandler', (_MetricsHandler,), {'registry': self.registry})
+            self._server = ThreadingHTTPServer((self.host, self.port), handler)
+            self._server.daemon_threads = True
+            self._spawn(self._server.serve_forever, 'metrics-http')
+            logger.info(f"📈 Метрики доступны на http://{self.host}:{self.port}/metrics")
+        if self.path:
+            self._spawn(self._dump_loop, 'metrics-dump')
+            logger.info(f"📈 Метрики записываются в {self.path} каждые {self.interval:g} с")
+
+    def stop(self) -> None:
+        """Останавливает эндпоинт и записывает метрики в файл последний раз"""
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+        if self.path:
+            self.dump()
+
+    def dump(self) -> None:
+        """Записывает метрики в файл (атомарно, через временный файл)"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.registry.render())
+        os.replace(tmp_path, self.path)
+
+    def _dump_loop(self) -> None:
+        """Периодическая запись в файл"""
+        while not self._stop.wait(self.interval):
+            try:
+                self.dump()
+            except Exception as e:
+                logger.error(f"Не удалось записать метрики в {self.path}: {e}")
+
+    def _spawn(self, target: Callable[[], None], name: str) -> None:
+        """Запускает фоновый поток"""
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
@@ -0,0 +1,183 @@
+import logging
+from typing import List, Tuple
+
+from psycopg2.errors import UndefinedTable
+from psycopg2.extras import DictCursor
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Ключ advisory-блокировки: миграции двух одновременно запущенных ботов не пересекаются
+_LOCK_ID = 0x76_6b_62_6f_74  # 'vkbot'
+
+# (версия, описание, запросы). Миграции только добавляются в конец списка,
+# уже примененные не меняются
+MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (1, "Базовая схема", [
+        """
+        CREATE TABLE IF NOT EXISTS Users (
+            id SERIAL PRIMARY KEY,
+            vk_id INTEGER UNIQUE NOT NULL,
+            first_name VARCHAR(50),
+            last_name VARCHAR(50),
+            age INTEGER,
+            sex VARCHAR(10),
+            city VARCHAR(50)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS Favorites (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER REFERENCES Users(vk_id),
+            favorite_vk_id INTEGER NOT NULL,
+            added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(user_id, favorite_vk_id)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS Blacklist (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES Users(vk_id),
+            blocked_vk_id INTEGER NOT NULL,
+            blocked_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(user_id, blocked_vk_id)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS Likes (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES Users(vk_id),
+            liked_user_id INTEGER NOT NULL,
+            photo_id INTEGER NOT NULL,
+            liked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(user_id, photo_id)  -- Один лайк на фото от пользователя
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS search_cache (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER,
+            search_params JSONB NOT NULL,
+            results JSONB NOT NULL,
+            expires_at TIMESTAMP NOT NULL,
+            query_hash TEXT,
+            size_bytes INTEGER NOT NULL DEFAULT 0,
+            UNIQUE(user_id, search_params)
+        );
+        """,
+        # Базы, созданные до появления миграций
+        "ALTER TABLE search_cache ALTER COLUMN user_id DROP NOT NULL;",
+        "ALTER TABLE search_cache ADD COLUMN IF NOT EXISTS query_hash TEXT;",
+        "ALTER TABLE search_cache ADD COLUMN IF NOT EXISTS size_bytes INTEGER NOT NULL DEFAULT 0;",
+        "CREATE UNIQUE INDEX IF NOT EXISTS search_cache_query_hash_idx ON search_cache (query_hash);",
+        "CREATE INDEX IF NOT EXISTS search_cache_expires_at_idx ON search_cache (expires_at);",
+        """
+        CREATE TABLE IF NOT EXISTS photo_cache (
+            owner_id INTEGER PRIMARY KEY,
+            photos JSONB NOT NULL,
+            expires_at TIMESTAMP NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS search_sessions (
+            user_id INTEGER PRIMARY KEY,
+            candidates BYTEA NOT NULL,
+            position INTEGER NOT NULL DEFAULT 0,
+            search_params JSONB NOT NULL,
+            cursor JSONB,
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+    ]),
+    (2, "Кэш поиска: ключ - только хэш параметров запроса", [
+        # Записи старого формата (по пользователю) никогда не совпадут с запросом
+        "DELETE FROM search_cache WHERE query_hash IS NULL;",
+        # Вместе со столбцом удаляется уникальный индекс по JSONB (user_id, search_params),
+        # который обновлялся при каждой записи в кэш
+        "ALTER TABLE search_cache DROP COLUMN IF EXISTS user_id;",
+        "ALTER TABLE search_cache ALTER COLUMN query_hash SET NOT NULL;",
+    ]),
+    (3, "Покрывающие индексы для избранного и лайков", [
+        # get_favorites: WHERE user_id ORDER BY added_date DESC - без сортировки и чтения таблицы
+        """
+        CREATE INDEX IF NOT EXISTS favorites_user_added_idx
+        ON Favorites (user_id, added_date DESC) INCLUDE (favorite_vk_id);
+        """,
+        # get_user_likes: WHERE user_id ORDER BY liked_at DESC
+        """
+        CREATE INDEX IF NOT EXISTS likes_user_liked_at_idx
+        ON Likes (user_id, liked_at DESC) INCLUDE (liked_user_id, photo_id);
+        """,
+        "ANALYZE Favorites;",
+        "ANALYZE Likes;",
+    ]),
+    (4, "Позиция чтения Bots Long Poll", [
+        """
+        CREATE TABLE IF NOT EXISTS longpoll_state (
+            group_id INTEGER PRIMARY KEY,
+            ts TEXT NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(db) -> int:
+    """Версия схемы БД (0, если миграции еще не применялись) - один запрос"""
+    try:
+        row = db._execute("SELECT COALESCE(MAX(version), 0) FROM schema_version;", fetch='one')
+        return row[0]
+    except UndefinedTable:
+        return 0
+
+
+def migrate(db) -> int:
+    """
+    Применяет недостающие миграции
+
+    При актуальной схеме выполняется только проверка версии. Каждая
+    миграция применяется в отдельной транзакции под advisory-блокировкой,
+    так что одновременно запущенные боты не применят ее дважды.
+
+    Args:
+        db: Экземпляр Database
+
+    Returns:
+        Версия схемы после миграций
+    """
+    version = current_version(db)
+    if version >= LATEST_VERSION:
+        return version
+
+    for number, description, statements in MIGRATIONS:
+        if number <= version:
+            continue
+
+        def work(cur: DictCursor) -> bool:
+            cur.execute("SELECT pg_advisory_xact_lock(%s);", (_LOCK_ID,))
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                );
+            """)
+            cur.execute("SELECT 1 FROM schema_version WHERE version = %s;", (number,))
+            if cur.fetchone():
+                return False
+            for statement in statements:
+                cur.execute(statement)
+            cur.execute(
+                "INSERT INTO schema_version (version, description) VALUES (%s, %s);",
+                (number, description)
+            )
+            return True
+
+        if db._run(work):
+            logger.info(f"🗂️ Применена миграция {number}: {description}")
+        version = number
+
+    return version
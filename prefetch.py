@@ -0,0 +1,82 @@
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from sessions import SearchSession
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class PhotoPrefetcher:
+    """Фоновая подгрузка фотографий и профилей следующих кандидатов
+
+    Профили и фото следующих depth кандидатов запрашиваются пакетно
+    (VKHandler.get_users_info и get_photos_many) в отдельном потоке.
+    В сессии (SearchSession.photos) хранится {ID кандидата: Future},
+    так что к нажатию "Дальше" карточка обычно уже готова.
+    """
+
+    def __init__(self, vk_handler, depth: int = 5, workers: int = 4, timeout: float = 10.0) -> None:
+        """
+        Args:
+            vk_handler: Экземпляр VKHandler
+            depth: На сколько кандидатов вперед подгружать фото
+            workers: Количество потоков подгрузки
+            timeout: Сколько секунд ждать подгрузки перед прямым запросом
+        """
+        self.vk_handler = vk_handler
+        self.depth = depth
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='photo-prefetch')
+
+    def schedule(self, session: SearchSession) -> None:
+        """Запускает подгрузку текущего и следующих за ним кандидатов"""
+        if self.depth <= 0:
+            return
+
+        photos = session.photos
+        ids = [candidate_id for candidate_id in session.upcoming(self.depth) if candidate_id not in photos]
+        if not ids:
+            return
+
+        try:
+            future = self._executor.submit(self._fetch, ids)
+        except RuntimeError:
+            # Пул уже остановлен - бот завершает работу
+            return
+        for candidate_id in ids:
+            photos[candidate_id] = future
+
+    def take(self, session: SearchSession, candidate_id: int) -> Optional[List[Dict]]:
+        """
+        Забирает подгруженные фото кандидата
+
+        Returns:
+            Список фото (возможно пустой) или None, если фото не подгружались
+            или VK не дал окончательного ответа
+        """
+        future: Optional[Future] = session.photos.pop(candidate_id, None)
+        if future is None:
+            return None
+
+        try:
+            return future.result(timeout=self.timeout).get(candidate_id)
+        except Exception as e:
+            logger.warning(f"Не удалось подгрузить фото {candidate_id}: {e}")
+            return None
+
+    def _fetch(self, ids: List[int]) -> Dict[int, List[Dict]]:
+        """Прогревает кэш профилей и возвращает фото кандидатов"""
+        self.vk_handler.get_users_info(ids)
+        return self.vk_handler.get_photos_many(ids)
+
+    def shutdown(self, wait: bool = False) -> None:
+        """
+        Останавливает потоки подгрузки
+
+        Args:
+            wait: Дождаться всех запланированных подгрузок (по умолчанию
+                незавершенные запросы не ждут, а запланированные отменяются)
+        """
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
@@ -0,0 +1,267 @@
+import cProfile
+import itertools
+import logging
+import os
+import random
+import re
+import signal
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from dotenv import dotenv_values
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_UNSAFE_NAME = re.compile(r'[^\w.-]+')
+
+
+class _StackSampler:
+    """Фоновый поток, снимающий стеки профилируемых потоков
+
+    Раз в interval секунд берет текущий кадр каждого зарегистрированного
+    потока (sys._current_frames) и считает стеки в свернутом виде
+    ("модуль:функция;модуль:функция ..."), пригодном для flamegraph.pl
+    и speedscope.
+    """
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self._stacks: Dict[int, Counter] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._thread: Optional[threading.Thread] = None
+
+    def register(self, thread_id: int) -> None:
+        """Начинает снимать стеки потока"""
+        with self._lock:
+            self._stacks[thread_id] = Counter()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="profiler-sampler", daemon=True)
+                self._thread.start()
+            self._wake.notify()
+
+    def unregister(self, thread_id: int) -> Counter:
+        """Прекращает снимать стеки потока и возвращает собранные"""
+        with self._lock:
+            return self._stacks.pop(thread_id, Counter())
+
+    def _loop(self) -> None:
+        """Снимает стеки, пока есть зарегистрированные потоки"""
+        while True:
+            with self._lock:
+                while not self._stacks:
+                    if not self._wake.wait(timeout=60):
+                        self._thread = None
+                        return
+                thread_ids = list(self._stacks)
+
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id in thread_ids:
+                    frame = frames.get(thread_id)
+                    if frame is not None and thread_id in self._stacks:
+                        self._stacks[thread_id][self._collapse(frame)] += 1
+            time.sleep(self.interval)
+
+    @staticmethod
+    def _collapse(frame: Any) -> str:
+        """Стек кадра от корня к вершине в свернутом виде"""
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            names.append(f"{module}:{code.co_name}")
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+
+class EventProfiler:
+    """Профилирование обработки событий по требованию
+
+    Выключенный профилировщик стоит одной проверки флага на событие.
+    Во включенном состоянии профилируются:
+    - доля событий sample_rate (случайная выборка);
+    - все события дольше slow_ms миллисекунд (для этого под
+      профилировщиком выполняется каждое событие, а сохраняются
+      только медленные).
+    Для каждого сохраненного события в каталоге out_dir/<действие>/
+    пишутся дамп cProfile (.prof, для pstats/snakeviz) и свернутые
+    стеки (.collapsed, для flame graph).
+
+    В каталоге хранится не больше max_files файлов профилей - самые
+    старые удаляются.
+
+    Включается через PROFILE_ENABLED или на лету: SIGUSR2 переключает
+    профилирование, SIGUSR1 перечитывает настройки профилировщика из .env.
+    """
+
+    # Настройки, которые SIGUSR1 перечитывает из .env
+    ENV_KEYS = ('PROFILE_ENABLED', 'PROFILE_SAMPLE_RATE', 'PROFILE_SLOW_MS', 'PROFILE_DIR', 'PROFILE_MAX_FILES')
+
+    def __init__(self, enabled: bool = False, sample_rate: float = 0.0, slow_ms: float = 0.0,
+                 out_dir: str = 'profiles', sample_interval: float = 0.005, max_files: int = 1000) -> None:
+        """
+        Args:
+            enabled: Включено ли профилирование
+            sample_rate: Доля профилируемых событий (0..1)
+            slow_ms: Сохранять профиль событий дольше этого времени (0 - не сохранять)
+            out_dir: Каталог для профилей
+            sample_interval: Период снятия стеков, секунд
+            max_files: Максимальное количество файлов в out_dir (0 - без ограничения)
+        """
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.out_dir = out_dir
+        self.max_files = max_files
+        self._sampler = _StackSampler(sample_interval)
+
+        # Файлы профилей в out_dir от старых к новым (читаются при первом сохранении)
+        self._files: Optional[Deque[str]] = None
+        self._files_lock = threading.Lock()
+        self._sequence = itertools.count(1)
+
+        # Статистика
+        self.profiled = 0
+        self.saved = 0
+        self.removed = 0
+
+    @classmethod
+    def from_env(cls) -> 'EventProfiler':
+        """Создает профилировщик с настройками из переменных окружения"""
+        profiler = cls()
+        profiler.configure_from_env()
+        return profiler
+
+    def configure_from_env(self) -> None:
+        """Читает настройки PROFILE_* из переменных окружения"""
+        self.enabled = os.getenv('PROFILE_ENABLED', '0').lower() in ('1', 'true', 'yes')
+        self.sample_rate = float(os.getenv('PROFILE_SAMPLE_RATE', 0.01))
+        self.slow_ms = float(os.getenv('PROFILE_SLOW_MS', 0))
+        self.max_files = int(os.getenv('PROFILE_MAX_FILES', 1000))
+        out_dir = os.getenv('PROFILE_DIR', 'profiles')
+        with self._files_lock:
+            if out_dir != self.out_dir:
+                self._files = None
+            self.out_dir = out_dir
+
+    def install_signal_handlers(self) -> None:
+        """SIGUSR2 - включить/выключить, SIGUSR1 - перечитать настройки из .env"""
+        if not hasattr(signal, 'SIGUSR1'):
+            return
+        try:
+            signal.signal(signal.SIGUSR1, self._reload)
+            signal.signal(signal.SIGUSR2, self._toggle)
+        except ValueError:
+            # Обработчики сигналов можно ставить только из главного потока
+            logger.warning("Сигналы профилировщика не установлены: не главный поток")
+
+    @contextmanager
+    def profile(self, action: str) -> Iterator[None]:
+        """Профилирует блок обработки события, если это требуется настройками"""
+        if not self.enabled:
+            yield
+            return
+
+        sampled = random.random() < self.sample_rate
+        if not sampled and self.slow_ms <= 0:
+            yield
+            return
+
+        thread_id = threading.get_ident()
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+: в процессе может работать только один cProfile -
+            # остаются только свернутые стеки
+            profile = None
+        self._sampler.register(thread_id)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if profile is not None:
+                profile.disable()
+            stacks = self._sampler.unregister(thread_id)
+            self.profiled += 1
+            if sampled or elapsed_ms >= self.slow_ms:
+                self._save(action, elapsed_ms, profile, stacks)
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика профилировщика"""
+        return {
+            'enabled': int(self.enabled),
+            'profiled': self.profiled,
+            'saved': self.saved,
+            'removed': self.removed
+        }
+
+    def _save(self, action: str, elapsed_ms: float, profile: Optional[cProfile.Profile],
+              stacks: Counter) -> None:
+        """Записывает дамп cProfile и свернутые стеки события"""
+        try:
+            directory = os.path.join(self.out_dir, _UNSAFE_NAME.sub('_', action) or 'unknown')
+            os.makedirs(directory, exist_ok=True)
+            # Номер по порядку - профили одной секунды не перезаписывают друг друга
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{next(self._sequence)}-{threading.get_ident()}-{elapsed_ms:.0f}ms"
+            base = os.path.join(directory, name)
+
+            files = []
+            if profile is not None:
+                profile.dump_stats(f"{base}.prof")
+                files.append(f"{base}.prof")
+            if stacks:
+                with open(f"{base}.collapsed", 'w', encoding='utf-8') as f:
+                    for stack, count in stacks.most_common():
+                        f.write(f"{stack} {count}\n")
+                files.append(f"{base}.collapsed")
+            self.saved += 1
+            self._retain(files)
+        except Exception as e:
+            logger.error(f"Не удалось сохранить профиль {action}: {e}")
+
+    def _retain(self, new_files: List[str]) -> None:
+        """Учитывает новые файлы и удаляет самые старые сверх max_files"""
+        with self._files_lock:
+            if self._files is None:
+                # Профили прошлых запусков - по времени изменения
+                found = [
+                    os.path.join(root, name)
+                    for root, _, names in os.walk(self.out_dir)
+                    for name in names
+                    if name.endswith(('.prof', '.collapsed'))
+                ]
+                found.sort(key=lambda path: os.stat(path).st_mtime)
+                self._files = deque(path for path in found if path not in new_files)
+            self._files.extend(new_files)
+
+            while self.max_files > 0 and len(self._files) > self.max_files:
+                path = self._files.popleft()
+                try:
+                    os.remove(path)
+                    self.removed += 1
+                except FileNotFoundError:
+                    pass
+
+    def _toggle(self, signum: int, frame: Any) -> None:
+        """Обработчик SIGUSR2"""
+        self.enabled = not self.enabled
+        logger.info(f"🔬 Профилирование {'включено' if self.enabled else 'выключено'} "
+                    f"(выборка {self.sample_rate:g}, медленные от {self.slow_ms:g} мс, каталог {self.out_dir})")
+
+    def _reload(self, signum: int, frame: Any) -> None:
+        """Обработчик SIGUSR1"""
+        # Из .env берутся только настройки профилировщика - остальное окружение не меняется
+        for key, value in dotenv_values().items():
+            if key in self.ENV_KEYS and value is not None:
+                os.environ[key] = value
+        self.configure_from_env()
+        logger.info(f"🔬 Настройки профилирования перечитаны: {'включено' if self.enabled else 'выключено'}, "
+                    f"выборка {self.sample_rate:g}, медленные от {self.slow_ms:g} мс, каталог {self.out_dir}")
@@ -0,0 +1,110 @@
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from interests import InterestIndex, normalize_tokens
+
+
+class CandidateRanker:
+    """Ранжирование пачки кандидатов по весам критериев
+
+    Все кандидаты пачки оцениваются сразу над массивами NumPy. Каждый
+    критерий дает оценку от 0 до 1:
+    - age: близость возраста к возрасту ищущего
+    - city: совпадение города
+    - interests: коэффициент Жаккара по интересам (через InterestIndex)
+    Итоговая оценка - сумма оценок с весами (VKHandler.SEARCH_WEIGHTS).
+    """
+
+    def __init__(self, weights: Dict[str, float], max_age_gap: int = 10,
+                 index: Optional[InterestIndex] = None, estimate: bool = False) -> None:
+        """
+        Args:
+            weights: Веса критериев age/city/interests
+            max_age_gap: Разница в возрасте, при которой оценка age равна 0
+            index: Индекс интересов (по умолчанию создается новый)
+            estimate: Оценивать сходство интересов по MinHash вместо точного подсчета
+        """
+        self.weights = weights
+        self.max_age_gap = max_age_gap
+        self.index = index or InterestIndex()
+        self.estimate = estimate
+
+    def score(self, searcher: Dict, candidates: List[Dict]) -> np.ndarray:
+        """
+        Вычисляет оценки кандидатов
+
+        Args:
+            searcher: Профиль ищущего (VKHandler.get_user_info)
+            candidates: Пользователи из users.search
+
+        Returns:
+            Массив оценок той же длины, что и candidates
+        """
+        n = len(candidates)
+        if not n:
+            return np.zeros(0)
+
+        current_year = datetime.now().year
+        ages = np.fromiter((self._birth_year(c.get('bdate')) for c in candidates), dtype=np.int32, count=n)
+        cities = np.fromiter(((c.get('city') or {}).get('id', 0) for c in candidates), dtype=np.int64, count=n)
+
+        # Возраст: без года рождения - нейтральная оценка
+        age_score = np.full(n, 0.5)
+        known = ages > 0
+        gap = np.abs(current_year - ages[known] - searcher.get('age', 25))
+        age_score[known] = np.clip(1.0 - gap / self.max_age_gap, 0.0, 1.0)
+
+        # Город
+        searcher_city = (searcher.get('city') or {}).get('id', 0)
+        city_score = (cities == searcher_city).astype(np.float64) if searcher_city else np.zeros(n)
+
+        interests_score = self.interest_scores(searcher, candidates)
+
+        return (
+            self.weights.get('age', 0) * age_score
+            + self.weights.get('city', 0) * city_score
+            + self.weights.get('interests', 0) * interests_score
+        )
+
+    def rank(self, searcher: Dict, candidates: List[Dict]) -> List[Dict]:
+        """Возвращает кандидатов в порядке убывания оценки"""
+        if len(candidates) < 2:
+            return list(candidates)
+        order = np.argsort(-self.score(searcher, candidates), kind='stable')
+        return [candidates[i] for i in order]
+
+    def interest_scores(self, searcher: Dict, candidates: List[Dict]) -> np.ndarray:
+        """Сходство интересов ищущего с каждым кандидатом по индексу интересов"""
+        mine = self.searcher_tokens(searcher)
+        if not mine:
+            return np.zeros(len(candidates))
+
+        ids = [c['id'] for c in candidates]
+        self.index.add_many((c['id'], c.get('interests')) for c in candidates)
+
+        if self.estimate:
+            return self.index.estimate_jaccard(mine, ids)
+        return self.index.jaccard(mine, ids)
+
+    @staticmethod
+    def searcher_tokens(searcher: Dict) -> List[str]:
+        """Все интересы ищущего (музыка, книги, интересы, группы) одним списком"""
+        interests = searcher.get('interests') or {}
+        if isinstance(interests, str):
+            return normalize_tokens(interests)
+        return normalize_tokens(t for values in interests.values() for t in values)
+
+    @staticmethod
+    def _birth_year(bdate: Optional[str]) -> int:
+        """Год рождения из даты вида Д.М.ГГГГ или 0, если год скрыт"""
+        if not bdate:
+            return 0
+        parts = bdate.split('.')
+        if len(parts) < 3:
+            return 0
+        try:
+            return int(parts[2])
+        except ValueError:
+            return 0
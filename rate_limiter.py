@@ -0,0 +1,226 @@
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import nullcontext
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from vk_api import VkApi
+from vk_api.exceptions import ApiError, TOO_MANY_RPS_CODE
+
+from metrics import REGISTRY
+from traffic import RECORDER
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Корзина токенов: не больше rate запросов в секунду
+
+    Вызовы, которым не хватило токена, не получают ошибку, а встают
+    в очередь: каждый резервирует следующий токен и спит до момента
+    его появления, так что порядок вызовов сохраняется.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None, name: str = '') -> None:
+        """
+        Args:
+            rate: Запросов в секунду
+            capacity: Максимальный всплеск (по умолчанию равен rate)
+            name: Имя корзины (токена) для логов и метрик
+        """
+        if rate <= 0:
+            raise ValueError("Частота запросов должна быть положительной")
+
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+        # Статистика
+        self.acquired = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.queued = 0
+
+    def acquire(self) -> float:
+        """
+        Забирает токен, при необходимости ожидая его появления
+
+        Returns:
+            Время ожидания в секундах
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            self.acquired += 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            if wait:
+                self.waits += 1
+                self.queued += 1
+                self.wait_time += wait
+                self.max_wait = max(self.max_wait, wait)
+
+        if wait:
+            time.sleep(wait)
+            with self._lock:
+                self.queued -= 1
+        return wait
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика корзины"""
+        with self._lock:
+            return {
+                'rate': self.rate,
+                'acquired': self.acquired,
+                'waits': self.waits,
+                'wait_time': self.wait_time,
+                'max_wait': self.max_wait,
+                'queued': self.queued
+            }
+
+
+class RateLimiter:
+    """Общий ограничитель частоты запросов к VK API
+
+    Хранит отдельную корзину для каждого токена (группового и
+    пользовательского), чтобы все сессии, работающие с одним токеном,
+    делили его лимит.
+    """
+
+    def __init__(self) -> None:
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, name: str, rate: float) -> TokenBucket:
+        """Возвращает корзину с указанным именем, создавая ее при первом обращении"""
+        with self._lock:
+            if name not in self._buckets:
+                self._buckets[name] = TokenBucket(rate, name=name)
+            return self._buckets[name]
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Статистика всех корзин"""
+        with self._lock:
+            buckets = dict(self._buckets)
+        return {name: bucket.stats() for name, bucket in buckets.items()}
+
+
+VK_API_ORIGIN = 'https://api.vk.com/'
+
+
+class _RewriteAdapter(HTTPAdapter):
+    """Перенаправляет запросы к api.vk.com на другой адрес (например, тестовый сервер)"""
+
+    def __init__(self, base_url: str) -> None:
+        super().__init__()
+        self.base_url = base_url.rstrip('/') + '/'
+
+    def send(self, request: requests.PreparedRequest, **kwargs: Any) -> requests.Response:
+        request.url = self.base_url + request.url[len(VK_API_ORIGIN):]
+        return super().send(request, **kwargs)
+
+
+class RateLimitedVkApi(VkApi):
+    """VkApi, ограничивающий частоту запросов через общую корзину токенов
+
+    Встроенная в VkApi задержка и блокировка, сериализующая все запросы
+    сессии, отключены - частоту ограничивает корзина, а запросы из разных
+    потоков выполняются параллельно. На ошибку 6 ("Слишком много
+    запросов") запрос повторяется с ограниченной экспоненциальной паузой.
+
+    Если задан base_url (или переменная VK_API_BASE_URL), запросы
+    к https://api.vk.com/ уходят на этот адрес - так бот работает
+    с локальной заглушкой VK API в нагрузочных тестах.
+    """
+
+    RPS_DELAY = 0
+
+    def __init__(self, *args: Any, bucket: TokenBucket, max_retries: int = 5,
+                 backoff_base: float = 0.5, backoff_max: float = 8.0,
+                 base_url: Optional[str] = None, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.base_url = base_url if base_url is not None else os.getenv('VK_API_BASE_URL')
+        if self.base_url:
+            self.redirect(self.http)
+        self.bucket = bucket
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retries = 0
+
+        self.lock = nullcontext()
+        # Повторы на ошибку 6 выполняет method(), а не бесконечный встроенный обработчик
+        self.error_handlers.pop(TOO_MANY_RPS_CODE, None)
+
+    def redirect(self, session: requests.Session) -> None:
+        """Направляет запросы сессии к api.vk.com на base_url (например, сессию LongPoll)"""
+        if self.base_url:
+            session.mount(VK_API_ORIGIN, _RewriteAdapter(self.base_url))
+
+    def method(self, method: str, values: Optional[Dict] = None, captcha_sid: Any = None,
+               captcha_key: Any = None, raw: bool = False) -> Any:
+        """Вызов метода API с ожиданием токена и повторами при превышении лимита"""
+        started = time.perf_counter()
+        result = error = None
+        try:
+            result = self._call(method, values, captcha_sid, captcha_key, raw)
+            return result
+        except ApiError as e:
+            REGISTRY.inc('vk_api_errors_total', method=method, token=self.bucket.name, code=e.code)
+            error = e.error
+            raise
+        except Exception as e:
+            REGISTRY.inc('vk_api_errors_total', method=method, token=self.bucket.name, code='network')
+            error = {'network': True, 'error_msg': str(e)}
+            raise
+        finally:
+            REGISTRY.observe('vk_api_seconds', time.perf_counter() - started,
+                             method=method, token=self.bucket.name)
+            if RECORDER.active:
+                RECORDER.record_vk(self.bucket.name, method, values, raw, result, error)
+
+    def _call(self, method: str, values: Optional[Dict], captcha_sid: Any,
+              captcha_key: Any, raw: bool) -> Any:
+        """Вызов метода с повторами на ошибку 6"""
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                return super().method(method, values, captcha_sid, captcha_key, raw)
+            except ApiError as e:
+                if e.code != TOO_MANY_RPS_CODE or attempt == self.max_retries:
+                    raise
+
+            self.retries += 1
+            delay = min(self.backoff_base * 2 ** attempt, self.backoff_max)
+            delay *= random.uniform(0.5, 1.0)
+            logger.warning(f"Слишком много запросов к {method}, повтор через {delay:.2f} с")
+            time.sleep(delay)
+
+
+def record_packed(vk_session: Any, calls: List[Tuple[str, Optional[Dict]]]) -> None:
+    """
+    Метрики вызовов, упакованных в один execute: сам execute учтен
+    в RateLimitedVkApi.method, здесь каждый вызов учитывается под своим
+    методом, а его ошибка из execute_errors - в vk_api_errors_total
+
+    Args:
+        vk_session: Сессия, выполнившая execute (имя токена - из ее корзины)
+        calls: Пары (метод, ошибка VK API или None)
+    """
+    bucket = getattr(vk_session, 'bucket', None)
+    token = bucket.name if bucket is not None else ''
+    for method, error in calls:
+        REGISTRY.inc('vk_api_packed_calls_total', method=method, token=token)
+        if error is not None:
+            code = error.get('error_code', 'unknown') if isinstance(error, dict) else 'unknown'
+            REGISTRY.inc('vk_api_errors_total', method=method, token=token, code=code)
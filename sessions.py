@@ -0,0 +1,273 @@
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+class SearchSession:
+    """Сессия поиска одного пользователя
+
+    Кандидаты хранятся компактно - массивом ID (array('q'), 8 байт на
+    кандидата); профили и фото берутся из кэшей VKHandler по требованию.
+    cursor - позиция следующего раунда поиска: годы, по которым еще есть
+    результаты, и offset (None, если поиск завершен). По ней поиск
+    продолжается после подгрузки и после восстановления сессии из БД.
+    """
+
+    __slots__ = ('user_id', 'candidates', 'index', 'stream', 'photos', 'search_params', 'last_seen',
+                 'cursor', 'saved_at', 'dirty')
+
+    def __init__(self, user_id: int, search_params: Optional[Dict] = None,
+                 stream: Optional[Iterator[List[int]]] = None) -> None:
+        self.user_id = user_id
+        self.candidates = array('q')
+        self.index = 0
+        self.stream = stream
+        self.photos: Dict[int, Any] = {}
+        self.search_params = search_params or {}
+        self.last_seen = time.monotonic()
+        self.cursor: Optional[Tuple[Tuple[int, ...], int]] = None
+        self.saved_at: Optional[float] = None
+        self.dirty = True
+
+    @property
+    def current(self) -> Optional[int]:
+        """ID текущего кандидата"""
+        return self.candidates[self.index] if self.index < len(self.candidates) else None
+
+    @property
+    def remaining(self) -> int:
+        """Количество кандидатов в буфере, начиная с текущего"""
+        return len(self.candidates) - self.index
+
+    def upcoming(self, count: int) -> List[int]:
+        """ID текущего и следующих кандидатов (не больше count)"""
+        return self.candidates[self.index:self.index + count].tolist()
+
+    def extend(self, candidate_ids: Iterable[int]) -> None:
+        """Добавляет кандидатов в конец буфера"""
+        self.candidates.extend(candidate_ids)
+
+    def compact(self) -> None:
+        """Удаляет из буфера уже просмотренных кандидатов"""
+        if self.index:
+            del self.candidates[:self.index]
+            self.index = 0
+
+    def size(self) -> int:
+        """
+        Примерный объем памяти сессии в байтах: буфер кандидатов и уже
+        подгруженные фото. Подгрузки, которые еще не завершились, учитываются
+        при следующем сохранении сессии в хранилище. stream между подгрузками
+        страниц - незапущенный генератор (см. Bot._load_candidates) и
+        собственных данных не держит
+        """
+        size = sys.getsizeof(self) + sys.getsizeof(self.candidates) + sys.getsizeof(self.photos)
+        seen = set()
+        for future in self.photos.values():
+            if id(future) in seen or not future.done() or future.cancelled() or future.exception() is not None:
+                continue
+            # Одна подгрузка - общий результат для нескольких кандидатов
+            seen.add(id(future))
+            size += deep_size(future.result())
+        return size
+
+
+def deep_size(obj: Any) -> int:
+    """Объем памяти вложенных словарей, списков и скаляров в байтах"""
+    size = 0
+    stack = [obj]
+    seen = set()
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+    return size
+
+
+class SessionStore:
+    """Ограниченное хранилище сессий поиска
+
+    Сессии, к которым не обращались дольше idle_timeout секунд,
+    удаляются. Если суммарный объем сессий превышает max_bytes,
+    удаляются давно не использованные (LRU).
+
+    Если заданы loader и saver, сессии переживают перезапуск бота:
+    измененная сессия сохраняется не чаще раза в save_interval секунд
+    (и обязательно - перед удалением из памяти и в flush()), а сессия,
+    которой нет в памяти, загружается при первом обращении к ней.
+    """
+
+    def __init__(self, idle_timeout: float = 1800, max_bytes: int = 64 * 1024 * 1024,
+                 sweep_interval: float = 60,
+                 loader: Optional[Callable[[int], Optional[SearchSession]]] = None,
+                 saver: Optional[Callable[[SearchSession], None]] = None,
+                 save_interval: float = 30) -> None:
+        """
+        Args:
+            idle_timeout: Время бездействия до удаления сессии, секунд
+            max_bytes: Максимальный суммарный объем сессий
+            sweep_interval: Как часто проверять бездействующие сессии, секунд
+            loader: Загружает сохраненную сессию пользователя (или None)
+            saver: Сохраняет сессию
+            save_interval: Минимальный интервал между сохранениями сессии, секунд
+        """
+        self.idle_timeout = idle_timeout
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.loader = loader
+        self.saver = saver
+        self.save_interval = save_interval
+
+        self._sessions: 'OrderedDict[int, SearchSession]' = OrderedDict()
+        self._sizes: Dict[int, int] = {}
+        self._bytes = 0
+        self._last_sweep = time.monotonic()
+        self._lock = threading.Lock()
+
+        # Статистика
+        self.evicted_idle = 0
+        self.evicted_memory = 0
+        self.restored = 0
+        self.saved = 0
+
+    def __contains__(self, user_id: int) -> bool:
+        with self._lock:
+            return user_id in self._sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, user_id: int) -> Optional[SearchSession]:
+        """
+        Возвращает сессию пользователя и отмечает обращение к ней. Если
+        сессии нет в памяти, она загружается через loader
+        """
+        with self._lock:
+            evicted = self._sweep()
+            session = self._sessions.get(user_id)
+            if session is not None:
+                session.last_seen = time.monotonic()
+                self._sessions.move_to_end(user_id)
+        self._save_all(evicted)
+
+        if session is None and self.loader is not None:
+            session = self.loader(user_id)
+            if session is not None:
+                session.saved_at = time.monotonic()
+                session.dirty = False
+                with self._lock:
+                    # Сессию мог создать параллельный поиск - она новее
+                    if user_id in self._sessions:
+                        return self._sessions[user_id]
+                    self.restored += 1
+                self._store(session)
+        return session
+
+    def put(self, session: SearchSession) -> None:
+        """
+        Сохраняет сессию (или обновляет учтенный объем после ее изменения);
+        измененная сессия сохраняется через saver не чаще save_interval
+        """
+        session.dirty = True
+        self._store(session)
+        if session.saved_at is None or time.monotonic() - session.saved_at >= self.save_interval:
+            self._save(session)
+
+    def pop(self, user_id: int) -> Optional[SearchSession]:
+        """Удаляет сессию пользователя из памяти"""
+        with self._lock:
+            return self._remove(user_id)
+
+    def evict_idle(self) -> int:
+        """Удаляет бездействующие сессии, возвращает их количество"""
+        with self._lock:
+            evicted = self._evict_idle()
+        self._save_all(evicted)
+        return len(evicted)
+
+    def flush(self) -> int:
+        """Сохраняет все измененные сессии, возвращает их количество"""
+        with self._lock:
+            sessions = [session for session in self._sessions.values() if session.dirty]
+        return self._save_all(sessions)
+
+    def stats(self) -> Dict[str, int]:
+        """Статистика хранилища"""
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'evicted_idle': self.evicted_idle,
+                'evicted_memory': self.evicted_memory,
+                'restored': self.restored,
+                'saved': self.saved
+            }
+
+    def _store(self, session: SearchSession) -> None:
+        """Кладет сессию в память и вытесняет лишние по объему"""
+        size = session.size()
+        evicted = []
+        with self._lock:
+            session.last_seen = time.monotonic()
+            self._bytes += size - self._sizes.get(session.user_id, 0)
+            self._sessions[session.user_id] = session
+            self._sessions.move_to_end(session.user_id)
+            self._sizes[session.user_id] = size
+
+            while self._bytes > self.max_bytes and len(self._sessions) > 1:
+                evicted.append(self._remove(next(iter(self._sessions))))
+                self.evicted_memory += 1
+            evicted.extend(self._sweep())
+        self._save_all(evicted)
+
+    def _save(self, session: SearchSession) -> bool:
+        """Сохраняет сессию через saver"""
+        if self.saver is None or not session.dirty:
+            return False
+        session.dirty = False
+        session.saved_at = time.monotonic()
+        self.saver(session)
+        self.saved += 1
+        return True
+
+    def _save_all(self, sessions: Iterable[SearchSession]) -> int:
+        """Сохраняет измененные сессии из списка"""
+        return sum(self._save(session) for session in sessions)
+
+    def _sweep(self) -> List[SearchSession]:
+        """Периодически удаляет бездействующие сессии (под блокировкой)"""
+        now = time.monotonic()
+        if now - self._last_sweep >= self.sweep_interval:
+            self._last_sweep = now
+            return self._evict_idle()
+        return []
+
+    def _evict_idle(self) -> List[SearchSession]:
+        """Удаляет бездействующие сессии (под блокировкой) и возвращает их"""
+        deadline = time.monotonic() - self.idle_timeout
+        evicted = []
+        # Сессии упорядочены по времени последнего обращения
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if session.last_seen > deadline:
+                break
+            evicted.append(self._remove(user_id))
+        self.evicted_idle += len(evicted)
+        return evicted
+
+    def _remove(self, user_id: int) -> Optional[SearchSession]:
+        """Удаляет сессию и ее учтенный объем (под блокировкой)"""
+        session = self._sessions.pop(user_id, None)
+        self._bytes -= self._sizes.pop(user_id, 0)
+        return session
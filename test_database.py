@@ -0,0 +1,179 @@
+import itertools
+import random
+from typing import Any, Dict, Optional
+
+import pytest
+from vk_api.vk_api import VkApiMethod
+
+from bot import Bot
+from database import Database
+from vk_handler import VKHandler
+
+# Синтетические ID - выше ID реальных пользователей VK
+BASE_ID = 1_900_000_000 + random.randrange(1_000_000) * 10
+
+
+@pytest.fixture(params=['direct', 'write_behind'])
+def db(request, monkeypatch):
+    """Database с одним соединением (PREPARE выполняется один раз); без PostgreSQL тесты пропускаются"""
+    monkeypatch.setenv('DB_POOL_MIN', '1')
+    monkeypatch.setenv('DB_POOL_MAX', '1')
+    monkeypatch.setenv('DB_WRITE_BEHIND', '1' if request.param == 'write_behind' else '0')
+    try:
+        database = Database()
+    except RuntimeError as e:
+        pytest.skip(f"PostgreSQL недоступен: {e}")
+
+    yield database
+
+    database.flush_writes()
+    ids = list(range(BASE_ID, BASE_ID + 10000))
+    database._execute("DELETE FROM Likes WHERE user_id = ANY(%s)", (ids,))
+    database._execute("DELETE FROM Favorites WHERE user_id = ANY(%s)", (ids,))
+    database._execute("DELETE FROM Blacklist WHERE user_id = ANY(%s)", (ids,))
+    database._execute("DELETE FROM Users WHERE vk_id = ANY(%s)", (ids,))
+    database.close()
+
+
+@pytest.fixture
+def ids():
+    """Новые синтетические ID для каждого вызова"""
+    return itertools.count(BASE_ID + 1)
+
+
+# Запросов и обращений к серверу (с фиксацией транзакции) на один вызов
+BUDGETS = {
+    'add_like': (1, 2),
+    'add_favorite': (1, 2),
+    'add_to_blacklist': (1, 2),
+    'get_excluded_ids': (1, 2),
+}
+
+
+def _call(db, name, user_id, ids):
+    """Вызов метода с новыми целевыми ID"""
+    if name == 'add_like':
+        return db.add_like(user_id, next(ids), next(ids))
+    if name == 'get_excluded_ids':
+        return db.get_excluded_ids(user_id)
+    return getattr(db, name)(user_id, next(ids))
+
+
+@pytest.mark.parametrize('name', sorted(BUDGETS))
+def test_query_budget(db, ids, name):
+    user_id = BASE_ID
+    # Прогрев: подготовка запросов (PREPARE) на соединении
+    _call(db, name, user_id, ids)
+
+    max_queries, max_round_trips = BUDGETS[name]
+    for _ in range(3):
+        with db.query_budget(max_queries, max_round_trips):
+            _call(db, name, user_id, ids)
+
+
+def test_get_excluded_ids_sees_new_rows(db, ids):
+    user_id = BASE_ID
+    favorite, blocked = next(ids), next(ids)
+    assert db.add_favorite(user_id, favorite)
+    assert db.add_to_blacklist(user_id, blocked)
+    assert db.get_excluded_ids(user_id) == {favorite, blocked}
+
+
+def test_repeated_add_returns_false(db, ids):
+    user_id = BASE_ID
+    target = next(ids)
+    assert db.add_favorite(user_id, target)
+    assert not db.add_favorite(user_id, target)
+    assert db.add_to_blacklist(user_id, target)
+    assert not db.add_to_blacklist(user_id, target)
+
+
+def test_add_error_is_not_a_repeat(db):
+    if db.write_buffer is not None:
+        pytest.skip("с отложенной записью строка пишется при сбросе буфера")
+    # ID вне диапазона integer - ошибка БД, а не "уже добавлен"
+    with pytest.raises(Exception):
+        db.add_like(BASE_ID, 2 ** 40, 1)
+    with pytest.raises(Exception):
+        db.add_favorite(BASE_ID, 2 ** 40)
+    with pytest.raises(Exception):
+        db.add_to_blacklist(BASE_ID, 2 ** 40)
+
+
+def test_cached_results_many_is_one_query(db):
+    queries = [{'db_test': BASE_ID, 'age': age} for age in range(18, 29)]
+    db.cache_results_many([(params, [{'id': i}]) for i, params in enumerate(queries[:5])])
+    try:
+        db.get_cached_results_many(queries)  # прогрев: PREPARE
+        with db.query_budget(1, 2):
+            pages = db.get_cached_results_many(queries)
+        assert pages[:5] == [[{'id': i}] for i in range(5)]
+        assert pages[5:] == [None] * 6
+    finally:
+        db._execute("DELETE FROM search_cache WHERE search_params ->> 'db_test' = %s", (str(BASE_ID),))
+
+
+class StubVkSession:
+    """Сессия VK API пользовательского токена: лайки и имена без обращения к VK"""
+
+    def get_api(self) -> VkApiMethod:
+        return VkApiMethod(self)
+
+    def method(self, method: str, values: Optional[Dict] = None, **kwargs: Any) -> Any:
+        if method == 'likes.add':
+            return {'likes': 1}
+        if method == 'users.get':
+            return [{'id': int(user_id), 'first_name': 'Имя', 'last_name': 'Фамилия'}
+                    for user_id in str(values['user_ids']).split(',')]
+        raise AssertionError(f"Неожиданный вызов {method}")
+
+
+@pytest.fixture
+def bot(db):
+    """Bot без VK и LongPoll: обработчики работают с настоящей БД, сообщения копятся в bot.sent"""
+    bot = Bot.__new__(Bot)
+    bot.db = db
+    bot.vk_handler = VKHandler('token', db=db, vk_session=StubVkSession())
+    bot.sent = []
+    bot._send_message = lambda user_id, message, *args, **kwargs: bot.sent.append(message)
+    # Показ следующего кандидата - отдельный путь со своими запросами
+    bot._show_next_user = lambda user_id: None
+    return bot
+
+
+# Запросов и обращений к серверу на одно действие пользователя
+HANDLER_BUDGETS = {
+    # has_liked_photo + add_like
+    'like': (2, 4),
+    'add_fav': (1, 2),
+    'block': (1, 2),
+}
+
+
+def _handle(bot, action, user_id, ids):
+    """Действие пользователя с новым целевым ID"""
+    if action == 'like':
+        return bot._handle_like(user_id, {'photo_id': next(ids), 'owner_id': next(ids)})
+    if action == 'add_fav':
+        return bot._handle_add_favorite(user_id, {'user_id': next(ids)})
+    return bot._handle_block(user_id, {'user_id': next(ids)})
+
+
+@pytest.mark.parametrize('action', sorted(HANDLER_BUDGETS))
+def test_handler_query_budget(bot, ids, action):
+    user_id = BASE_ID
+    _handle(bot, action, user_id, ids)  # прогрев: PREPARE
+
+    max_queries, max_round_trips = HANDLER_BUDGETS[action]
+    for _ in range(3):
+        with bot.db.query_budget(max_queries, max_round_trips):
+            _handle(bot, action, user_id, ids)
+    assert not any(message.startswith('❌') for message in bot.sent)
+
+
+def test_handler_reports_db_error(bot):
+    if bot.db.write_buffer is not None:
+        pytest.skip("с отложенной записью строка пишется при сбросе буфера")
+    bot._handle_add_favorite(BASE_ID, {'user_id': 2 ** 40})
+    bot._handle_block(BASE_ID, {'user_id': 2 ** 40})
+    assert bot.sent == ["❌ Ошибка при добавлении в избранное", "❌ Ошибка при добавлении в ЧС"]
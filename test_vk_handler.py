@@ -0,0 +1,87 @@
+from collections import Counter
+from typing import Any, Callable, Dict, Optional
+
+from vk_api.vk_api import VkApiMethod
+
+from vk_handler import VKHandler
+
+
+class StubVkSession:
+    """Сессия VK API с ответами из словаря {метод: функция(параметры)} и счетчиком вызовов"""
+
+    def __init__(self, handlers: Dict[str, Callable[[Dict], Any]]) -> None:
+        self.handlers = handlers
+        self.calls: Counter = Counter()
+
+    def get_api(self) -> VkApiMethod:
+        return VkApiMethod(self)
+
+    def method(self, method: str, values: Optional[Dict] = None, **kwargs: Any) -> Any:
+        self.calls[method] += 1
+        return self.handlers[method](values or {})
+
+
+def _users_get(values: Dict) -> list:
+    # Каждый пользователь состоит в трех группах, соседние - в общих
+    return [
+        {'id': user_id, 'first_name': 'Имя', 'last_name': 'Фамилия',
+         'groups': [user_id % 700 + j for j in range(3)]}
+        for user_id in map(int, values['user_ids'].split(','))
+    ]
+
+
+def _groups_get_by_id(values: Dict) -> list:
+    return [{'id': int(group_id), 'name': f'Группа {group_id}'} for group_id in values['group_ids'].split(',')]
+
+
+def test_group_names_are_resolved_per_chunk():
+    session = StubVkSession({'users.get': _users_get, 'groups.getById': _groups_get_by_id})
+    handler = VKHandler('token', vk_session=session)
+
+    profiles = handler.get_users_info(range(1, 1201))
+
+    assert len(profiles) == 1200
+    assert profiles[5]['interests']['groups'] == ['группа 5', 'группа 6', 'группа 7']
+    # Две пачки users.get (1000 + 200 ID); 702 группы первой пачки - два запроса
+    # groups.getById по 500 ID, группы второй пачки уже в кэше
+    assert session.calls['users.get'] == 2
+    assert session.calls['groups.getById'] == 2
+
+    # Новые профили с известными группами - без groups.getById
+    handler.get_users_info(range(1201, 1211))
+    assert session.calls['users.get'] == 3
+    assert session.calls['groups.getById'] == 2
+
+
+def test_search_resumes_without_exhausted_ages():
+    handler = VKHandler('token', vk_session=StubVkSession({}))
+    handler.search_page_size = 10
+    searched = []
+
+    def execute_batch(calls):
+        # У 20-летних всего 3 результата, у остальных - полные страницы
+        results = []
+        for _, params in calls:
+            searched.append((params['age_from'], params['offset']))
+            count = 3 if params['age_from'] == 20 else params['count']
+            items = [{'id': params['age_from'] * 10000 + params['offset'] + i} for i in range(count)]
+            results.append(({'items': items}, None))
+        return results
+
+    handler.execute_batch = execute_batch
+    params = {'age_from': 20, 'age_to': 23}
+
+    cursor, window = next(handler.iter_search_pages(params))
+    assert len(window) == 33
+    assert cursor == ((21, 22, 23), 10)
+
+    # Следующая подгрузка - новым генератором с сохраненной позиции
+    searched.clear()
+    cursor, _ = next(handler.iter_search_pages(params, start=cursor))
+    assert searched == [(21, 10), (22, 10), (23, 10)]
+    assert cursor == ((21, 22, 23), 20)
+
+    # Позиция прежнего формата (младший возраст, offset)
+    searched.clear()
+    next(handler.iter_search_pages(params, start=(22, 20)))
+    assert searched == [(22, 20), (23, 20)]
@@ -0,0 +1,249 @@
+import base64
+import functools
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime
+from typing import Any, Callable, Dict, IO, List, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TRACE_VERSION = 1
+
+# Параметры вызова VK API, которые не нужны для воспроизведения и не должны попадать в файл
+_SKIPPED_VALUES = ('access_token', 'v', 'random_id')
+
+
+def _tag(obj: Any) -> Any:
+    """
+    Приводит значение к JSON: типы, которых в JSON нет (множества, байты,
+    даты, словари с нестроковыми ключами), записываются как {"__тип__": значение}
+    """
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    if isinstance(obj, dict):
+        if all(isinstance(key, str) for key in obj):
+            return {key: _tag(value) for key, value in obj.items()}
+        items = sorted(obj.items(), key=lambda item: repr(item[0]))
+        return {'__items__': [[_tag(key), _tag(value)] for key, value in items]}
+    if isinstance(obj, (set, frozenset)):
+        return {'__set__': [_tag(item) for item in sorted(obj, key=repr)]}
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return {'__bytes__': base64.b64encode(bytes(obj)).decode('ascii')}
+    if isinstance(obj, datetime):
+        return {'__datetime__': obj.isoformat()}
+    if isinstance(obj, date):
+        return {'__date__': obj.isoformat()}
+    if isinstance(obj, (list, tuple)) or hasattr(obj, '__iter__'):
+        return [_tag(item) for item in obj]
+    raise TypeError(f"Тип {type(obj).__name__} не поддерживается в записи трафика")
+
+
+def _untag(obj: Dict[str, Any]) -> Any:
+    """Обратное преобразование для _tag (object_hook для json.loads)"""
+    if len(obj) == 1:
+        (key, value), = obj.items()
+        if key == '__items__':
+            return {item_key: item_value for item_key, item_value in value}
+        if key == '__set__':
+            return set(value)
+        if key == '__bytes__':
+            return base64.b64decode(value)
+        if key == '__datetime__':
+            return datetime.fromisoformat(value)
+        if key == '__date__':
+            return date.fromisoformat(value)
+    return obj
+
+
+def dumps(obj: Any, sort_keys: bool = False) -> str:
+    """Запись трафика в компактном JSON"""
+    return json.dumps(_tag(obj), ensure_ascii=False, separators=(',', ':'), sort_keys=sort_keys)
+
+
+def loads(line: str) -> Any:
+    """Чтение строки записи трафика"""
+    return json.loads(line, object_hook=_untag)
+
+
+def vk_values(values: Optional[Dict]) -> Dict:
+    """Параметры вызова VK API без токена, версии и random_id"""
+    return {key: value for key, value in (values or {}).items() if key not in _SKIPPED_VALUES}
+
+
+def vk_key(token: str, method: str, values: Optional[Dict]) -> str:
+    """Ключ вызова VK API: одинаковые вызовы дают одинаковый ключ"""
+    return dumps([token, method, vk_values(values)], sort_keys=True)
+
+
+def db_key(method: str, args: Tuple, kwargs: Dict) -> str:
+    """Ключ вызова метода Database"""
+    return dumps([method, list(args), kwargs], sort_keys=True)
+
+
+def open_trace(path: str, mode: str) -> IO[str]:
+    """Открывает файл записи (*.gz - со сжатием)"""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class TrafficRecorder:
+    """Запись трафика бота для воспроизведения (benchmarks/replay.py)
+
+    В файл JSONL пишутся входящие события LongPoll (или пачки событий
+    Bots Long Poll), вызовы VK API с ответами или ошибками и вызовы
+    публичных методов Database с результатами - по строке на запись. Пока запись не включена,
+    точки записи стоят одной проверки флага active.
+
+    Включается переменной TRACE_FILE (*.gz - со сжатием); TRACE_DURATION
+    ограничивает окно записи в секундах.
+    """
+
+    def __init__(self) -> None:
+        self.active = False
+        self.path: Optional[str] = None
+        self._file: Optional[IO[str]] = None
+        self._lock = threading.Lock()
+        self._started = 0.0
+        self._deadline: Optional[float] = None
+        self.records: Counter = Counter()
+
+    def configure_from_env(self) -> None:
+        """Начинает запись, если задана переменная TRACE_FILE"""
+        path = os.getenv('TRACE_FILE')
+        if path and not self.active:
+            self.start(path, float(os.getenv('TRACE_DURATION', 0)))
+
+    def start(self, path: str, duration: float = 0) -> None:
+        """
+        Начинает запись
+
+        Args:
+            path: Файл записи
+            duration: Длительность записи, секунд (0 - до вызова stop)
+        """
+        with self._lock:
+            if self.active:
+                return
+            self._file = open_trace(path, 'w')
+            self._started = time.monotonic()
+            self._deadline = self._started + duration if duration > 0 else None
+            self._file.write(dumps({
+                'kind': 'header',
+                'version': TRACE_VERSION,
+                'started_at': datetime.now().isoformat(timespec='seconds')
+            }) + '\n')
+            self.path = path
+            self.records = Counter()
+            self.active = True
+        logger.info(f"⏺️ Запись трафика в {path}" + (f" на {duration:g} с" if duration > 0 else ""))
+
+    def stop(self) -> None:
+        """Завершает запись"""
+        with self._lock:
+            self._close()
+
+    def record_event(self, raw: list) -> None:
+        """Входящее событие LongPoll (сырой список полей)"""
+        self._write({'kind': 'event', 'raw': raw})
+
+    def record_batch(self, raw: List[Dict]) -> None:
+        """Пачка событий Bots Long Poll (сырые словари), обработанная вместе"""
+        self._write({'kind': 'batch', 'raw': raw})
+
+    def record_vk(self, token: str, method: str, values: Optional[Dict], raw: bool,
+                  result: Any = None, error: Optional[Dict] = None) -> None:
+        """Вызов VK API: результат или ошибка (словарь VK API; network - сетевая ошибка)"""
+        self._write({
+            'kind': 'vk', 'token': token, 'method': method, 'values': vk_values(values),
+            'raw': raw, 'result': result, 'error': error
+        })
+
+    def record_db(self, method: str, args: Tuple, kwargs: Dict, result: Any = None,
+                  error: Optional[str] = None) -> None:
+        """Вызов метода Database: результат или текст исключения"""
+        self._write({
+            'kind': 'db', 'method': method, 'args': list(args), 'kwargs': kwargs,
+            'result': result, 'error': error
+        })
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика записи"""
+        return {'active': int(self.active), 'records': dict(self.records)}
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        """Дописывает запись в файл (из любого потока)"""
+        # Сериализация - вне блокировки: записи разных потоков не ждут друг друга
+        record['t'] = round(time.monotonic() - self._started, 6)
+        try:
+            line = dumps(record) + '\n'
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Запись трафика пропущена ({record['kind']}): {e}")
+            return
+
+        with self._lock:
+            if not self.active:
+                return
+            if self._deadline is not None and time.monotonic() >= self._deadline:
+                self._close()
+                return
+            self._file.write(line)
+            self.records[record['kind']] += 1
+
+    def _close(self) -> None:
+        """Закрывает файл (вызывается под блокировкой)"""
+        if not self.active:
+            return
+        self.active = False
+        self._file.close()
+        self._file = None
+        logger.info(f"⏹️ Запись трафика завершена: {self.path} ({dict(self.records)})")
+
+
+# Общий регистратор трафика бота
+RECORDER = TrafficRecorder()
+
+_recording = threading.local()
+
+
+def record_db(exclude: Tuple[str, ...] = ()) -> Callable[[type], type]:
+    """
+    Декоратор класса Database: при включенной записи трафика каждый
+    вызов публичного метода (кроме exclude) пишется вместе с результатом.
+    Вызовы из других методов Database не пишутся - при воспроизведении
+    их результат уже входит в результат внешнего вызова
+    """
+    def decorate(cls: type) -> type:
+        for name, method in list(vars(cls).items()):
+            if name.startswith('_') or name in exclude or not callable(method) \
+                    or isinstance(method, (staticmethod, classmethod)):
+                continue
+            setattr(cls, name, _recorded_db_method(name, method))
+        return cls
+    return decorate
+
+
+def _recorded_db_method(name: str, method: Callable) -> Callable:
+    """Обертка метода Database с записью вызова"""
+    @functools.wraps(method)
+    def wrapper(self: Any, *args: Any, **kwargs: Any) -> Any:
+        if not RECORDER.active or getattr(_recording, 'nested', False):
+            return method(self, *args, **kwargs)
+
+        _recording.nested = True
+        try:
+            result = method(self, *args, **kwargs)
+        except Exception as e:
+            RECORDER.record_db(name, args, kwargs, error=str(e))
+            raise
+        finally:
+            _recording.nested = False
+        RECORDER.record_db(name, args, kwargs, result=result)
+        return result
+    return wrapper
@@ -1,11 +1,14 @@
-import vk_api
 from vk_api.exceptions import ApiError
 from vk_api.keyboard import VkKeyboard, VkKeyboardColor
+from vk_api.requests_pool import VkRequestsPool
+from cache import StatsTTLCache
+from interests import normalize_tokens
+from rate_limiter import RateLimitedVkApi, RateLimiter, record_packed
 from vk_api.utils import get_random_id
-from typing import Dict, List, Optional, Tuple, Any
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Any
 from datetime import date, datetime
 import logging
-import time
+import os
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -17,18 +20,76 @@ class VKHandler:
     SEARCH_WEIGHTS = {
         'age': 0.4,
         'city': 0.3,
-        'interests': 0.2,
-        'friends': 0.1
+        'interests': 0.3
     }
 
-    def __init__(self, token: str, db=None):
-        """Инициализация VK API обработчика"""
+    # Поля профиля, запрашиваемые через users.get
+    PROFILE_FIELDS = 'sex,city,bdate,interests,music,books,groups'
+
+    # Максимум результатов users.search на один набор параметров
+    SEARCH_RESULTS_LIMIT = 1000
+
+    # Максимум ID в одном запросе users.get
+    USERS_GET_LIMIT = 1000
+
+    # Максимум ID в одном запросе groups.getById
+    GROUPS_GET_LIMIT = 500
+
+    # Коды ошибок, при которых результат вызова не кэшируется
+    TRANSIENT_ERROR_CODES = {1, 6, 9, 10}
+
+    # Сколько раз запрашивать страницы раунда поиска с временной ошибкой
+    SEARCH_ROUND_ATTEMPTS = 3
+
+    def __init__(self, token: str, db=None, rate_limiter: Optional[RateLimiter] = None,
+                 vk_session: Optional[RateLimitedVkApi] = None):
+        """Инициализация VK API обработчика
+
+        Args:
+            token: Пользовательский токен
+            db: Экземпляр Database (необязательно)
+            rate_limiter: Общий ограничитель частоты запросов
+            vk_session: Готовая сессия VK API (например, заглушка при воспроизведении
+                трафика); по умолчанию создается по токену
+        """
         self.token = token
         self.db = db
 
+        # Кэш топ-3 фото по ID владельца; при PHOTO_CACHE_PERSIST=1 дополнительно в БД
+        # (с тем же временем жизни)
+        self.photo_ttl = float(os.getenv('PHOTO_CACHE_TTL', 3600))
+        self.photo_cache = StatsTTLCache(
+            maxsize=int(os.getenv('PHOTO_CACHE_SIZE', 10000)),
+            ttl=self.photo_ttl
+        )
+        self.persist_photos = bool(db) and os.getenv('PHOTO_CACHE_PERSIST', '0') == '1'
+
+        # Размер страницы поиска
+        self.search_page_size = int(os.getenv('SEARCH_PAGE_SIZE', 50))
+
+        # Кэш профилей пользователей по ID
+        self.profile_cache = StatsTTLCache(
+            maxsize=int(os.getenv('PROFILE_CACHE_SIZE', 50000)),
+            ttl=float(os.getenv('PROFILE_CACHE_TTL', 3600))
+        )
+        # Кэш имен пользователей, которых нет в кэше профилей
+        self.name_cache = StatsTTLCache(
+            maxsize=int(os.getenv('PROFILE_CACHE_SIZE', 50000)),
+            ttl=float(os.getenv('PROFILE_CACHE_TTL', 3600))
+        )
+        # Кэш названий групп по ID (для интересов в профилях)
+        self.group_cache = StatsTTLCache(
+            maxsize=int(os.getenv('PROFILE_CACHE_SIZE', 50000)),
+            ttl=float(os.getenv('PROFILE_CACHE_TTL', 3600))
+        )
+
         try:
             # Инициализация сессии VK API
-            self.vk_session = vk_api.VkApi(token=token)
+            self.rate_limiter = rate_limiter or RateLimiter()
+            self.vk_session = vk_session or RateLimitedVkApi(
+                token=token,
+                bucket=self.rate_limiter.bucket('user', float(os.getenv('VK_USER_RPS', 3)))
+            )
             self.vk = self.vk_session.get_api()  # Основной API клиент
             logger.info("VK API успешно инициализирован")
         except Exception as e:
@@ -37,107 +98,368 @@ class VKHandler:
 
     def get_user_info(self, user_id: int) -> Optional[Dict]:
         """Получает расширенную информацию о пользователе"""
-        try:
-            response = self.vk.users.get(
-                user_ids=user_id,
-                fields='sex,city,bdate,interests,music,books,groups'
-            )
+        return self.get_users_info([user_id]).get(user_id)
 
-            if not response or not isinstance(response, list):
-                return None
+    def get_users_info(self, user_ids: Iterable[int]) -> Dict[int, Dict]:
+        """
+        Получает расширенную информацию о нескольких пользователях.
+        Профили берутся из кэша, недостающие запрашиваются через users.get
+        пачками до 1000 ID за запрос; названия групп всех профилей пачки -
+        одним groups.getById (до 500 ID за запрос)
+
+        Returns:
+            Словарь {ID пользователя: профиль}; пользователи, которых не удалось
+            получить, в словарь не попадают
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        profiles, missing = self.profile_cache.get_many(user_ids)
 
-            user_data = response[0]
+        for i in range(0, len(missing), self.USERS_GET_LIMIT):
+            chunk = missing[i:i + self.USERS_GET_LIMIT]
+            try:
+                response = self.vk.users.get(
+                    user_ids=','.join(map(str, chunk)),
+                    fields=self.PROFILE_FIELDS
+                )
+            except ApiError as e:
+                logger.error(f"API error getting user info: {e}")
+                continue
+            except Exception as e:
+                logger.error(f"Error getting user info: {e}")
+                continue
 
-            return {
-                'id': user_id,
-                'first_name': user_data.get('first_name', ''),
-                'last_name': user_data.get('last_name', ''),
-                'sex': user_data.get('sex', 0),
-                'city': self._parse_city(user_data.get('city')),
-                'age': self._calculate_age(user_data.get('bdate')),
-                'interests': self._get_interests(user_data),
-                'bdate': user_data.get('bdate', '')
+            if not response or not isinstance(response, list):
+                continue
+
+            group_names = self._get_group_names(
+                group_id for user_data in response for group_id in user_data.get('groups') or ()
+            )
+            fetched = {
+                user_data['id']: self._parse_profile(user_data, group_names) for user_data in response
             }
+            self.profile_cache.set_many(fetched)
+            profiles.update(fetched)
 
-        except ApiError as e:
-            logger.error(f"API error getting user info: {e}")
-            return None
-        except Exception as e:
-            logger.error(f"Error getting user info: {e}")
-            return None
+        return {user_id: profiles[user_id] for user_id in user_ids if user_id in profiles}
 
-    def search_users(self, search_params: Dict) -> List[Dict]:
-        """Поиск пользователей по заданным параметрам"""
-        try:
-            params = {
-                'count': 1000,
-                'has_photo': 1,
-                'fields': 'city,photo_max_orig,sex,bdate,interests',
-                'age_from': search_params.get('age_from', 18),
-                'age_to': search_params.get('age_to', 35),
+    def iter_search_users(self, search_params: Dict, page_size: Optional[int] = None) -> Iterator[List[Dict]]:
+        """
+        Лениво выдает результаты поиска окнами
+
+        users.search отдает не больше 1000 результатов на запрос, поэтому
+        диапазон возрастов разбивается на отдельные годы, и внутри каждого
+        года результаты листаются через offset. Окно - очередные страницы
+        всех годов диапазона (раунд), так что его можно ранжировать целиком,
+        а не по одному возрасту. Следующий раунд запрашивается только когда
+        предыдущий израсходован.
+
+        Args:
+            search_params: Параметры поиска
+            page_size: Размер страницы одного года (по умолчанию SEARCH_PAGE_SIZE)
+
+        Yields:
+            Непустые списки найденных пользователей
+        """
+        for _, window in self.iter_search_pages(search_params, page_size):
+            yield window
+
+    def iter_search_pages(self, search_params: Dict, page_size: Optional[int] = None,
+                          start: Optional[Tuple[Any, int]] = None
+                          ) -> Iterator[Tuple[Optional[Tuple[Tuple[int, ...], int]], List[Dict]]]:
+        """
+        То же, что iter_search_users, но вместе с окном выдает позицию
+        следующего раунда, с которой поиск можно продолжить позже
+
+        Позиция - пара (годы, по которым еще есть результаты; offset
+        раунда). Годы, результаты которых закончились, в позицию не
+        попадают и при продолжении поиска больше не запрашиваются.
+
+        Args:
+            search_params: Параметры поиска
+            page_size: Размер страницы одного года (по умолчанию SEARCH_PAGE_SIZE)
+            start: Позиция (годы, offset), с которой начать поиск; позиция
+                прежнего формата (младший возраст, offset) тоже принимается
+
+        Yields:
+            Пары (позиция следующего раунда или None, если поиск
+            завершен; непустой список найденных пользователей)
+
+        Raises:
+            Ошибку users.search: поиск прерывается, и продолжить его можно
+            с последней выданной позиции - раунд, который не загрузился,
+            не пропускается
+        """
+        page_size = page_size or self.search_page_size
+        age_from = search_params.get('age_from', 18)
+        age_to = search_params.get('age_to', 35)
+        start_ages, offset = start or (None, 0)
+        if start_ages is None:
+            ages = list(range(age_from, age_to + 1))
+        elif isinstance(start_ages, int):
+            ages = list(range(max(age_from, start_ages), age_to + 1))
+        else:
+            ages = [age for age in start_ages if age_from <= age <= age_to]
+
+        while ages and offset < self.SEARCH_RESULTS_LIMIT:
+            count = min(page_size, self.SEARCH_RESULTS_LIMIT - offset)
+            pages = self._search_round(search_params, ages, offset, count)
+            offset += count
+
+            # Короткая страница - результаты этого года закончились
+            ages = [age for age, page in zip(ages, pages) if len(page) == count]
+            if offset >= self.SEARCH_RESULTS_LIMIT:
+                ages = []
+
+            window = [user for page in pages for user in page]
+            if window:
+                yield ((tuple(ages), offset) if ages else None), window
+
+    def _search_round(self, search_params: Dict, ages: List[int], offset: int, count: int) -> List[List[Dict]]:
+        """
+        Страницы поиска нескольких годов с одним offset: из кэша в БД
+        (одним запросом), недостающие - одним execute. Кэш общий для всех пользователей -
+        ключ зависит только от параметров запроса, а ЧС и избранное
+        отфильтровываются уже после него. Ошибка users.search
+        пробрасывается - пустая страница означает конец выдачи
+        """
+        queries = [
+            self._search_params({
                 'sex': search_params.get('sex', 1),
                 'city': search_params.get('city_id', 0),
-                'status': 6  # Не состоит в браке
-            }
-
-            # Удаляем None значения
-            params = {k: v for k, v in params.items() if v is not None}
+                'age_from': age,
+                'age_to': age,
+                'offset': offset,
+                'count': count
+            })
+            for age in ages
+        ]
+
+        pages: List[Optional[List[Dict]]] = [None] * len(queries)
+        if self.db:
+            pages = self.db.get_cached_results_many(queries) or pages
+
+        # Страницы с временной ошибкой перезапрашиваются, полученные - сохраняются
+        missing = [i for i, page in enumerate(pages) if page is None]
+        for attempt in range(self.SEARCH_ROUND_ATTEMPTS):
+            if not missing:
+                break
+            try:
+                results = self.execute_batch([('users.search', queries[i]) for i in missing])
+            except Exception as e:
+                logger.error(f"Search error: {e}")
+                raise
+
+            failed = []
+            fetched = []
+            fatal = None
+            for i, (response, error) in zip(missing, results):
+                if error:
+                    logger.error(f"API search error: {error.get('error_msg')}")
+                    if error.get('error_code') not in self.TRANSIENT_ERROR_CODES \
+                            or attempt == self.SEARCH_ROUND_ATTEMPTS - 1:
+                        fatal = fatal or ApiError(self.vk_session, 'users.search', queries[i], False, error)
+                    failed.append(i)
+                    continue
+                items = (response or {}).get('items', [])
+                fetched.append((queries[i], items))
+                pages[i] = items
+
+            # Полученные страницы сохраняются одним запросом, даже если раунд не загрузился
+            if self.db and fetched:
+                self.db.cache_results_many(fetched)
+            if fatal is not None:
+                raise fatal
+            missing = failed
+
+        return pages
+
+    @staticmethod
+    def _search_params(query: Dict) -> Dict:
+        """Полные параметры users.search для одной страницы"""
+        params = {
+            'has_photo': 1,
+            'fields': 'city,photo_max_orig,sex,bdate,interests',
+            'status': 6,  # Не состоит в браке
+            **query
+        }
 
-            response = self.vk.users.search(**params)
+        # Удаляем None значения
+        return {k: v for k, v in params.items() if v is not None}
 
-            if not response or 'items' not in response:
-                return []
+    def execute_batch(self, calls: List[Tuple[str, Dict]]) -> List[Tuple[Any, Optional[Dict]]]:
+        """
+        Выполняет несколько методов API через метод execute
+        (до 25 вызовов за один HTTP-запрос)
 
-            return response['items']
+        Args:
+            calls: Список пар (метод, параметры)
 
-        except ApiError as e:
-            logger.error(f"API search error: {e}")
-            if e.code == 6:  # Слишком много запросов
-                time.sleep(0.5)
-                return self.search_users(search_params)
-            return []
-        except Exception as e:
-            logger.error(f"Search error: {e}")
+        Returns:
+            Список пар (результат, ошибка) в порядке вызовов. Ошибка - словарь
+            VK API с полями error_code/error_msg, либо None если вызов успешен
+        """
+        if not calls:
             return []
 
-    def get_photos(self, user_id: int) -> List[Dict]:
-        """Безопасное получение фото (работает даже без прав на tagged)"""
+        pool = VkRequestsPool(self.vk_session)
+        results = [pool.method(method, params) for method, params in calls]
         try:
+            pool.execute()
+        except ApiError as e:
+            record_packed(self.vk_session, [(method, e.error) for method, _ in calls])
+            raise
+        except Exception:
+            record_packed(self.vk_session, [(method, {'error_code': 'network'}) for method, _ in calls])
+            raise
+
+        results = [(r.result, None) if r.ok else (None, r.error or {}) for r in results]
+        record_packed(self.vk_session, [(method, error) for (method, _), (_, error) in zip(calls, results)])
+        return results
+
+    def get_photos(self, user_id: int) -> Optional[List[Dict]]:
+        """
+        Безопасное получение фото (работает даже без прав на tagged)
+
+        Returns:
+            Список фото (пустой - фото нет) или None, если VK не ответил
+        """
+        return self.get_photos_many([user_id]).get(user_id)
+
+    def get_photos_many(self, user_ids: Iterable[int]) -> Dict[int, List[Dict]]:
+        """
+        Получает топ-3 фото для нескольких пользователей. Сначала фото ищутся
+        в кэше (в памяти, затем в БД), остальные запрашиваются пакетно:
+        фото профиля и фото с отметками - в одном execute
+
+        Returns:
+            Словарь {ID пользователя: список фото}; пользователи, для которых
+            VK не дал окончательного ответа (временная ошибка), в словарь не попадают
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        photos, missing = self.photo_cache.get_many(user_ids)
+
+        if missing and self.persist_photos:
+            stored = self.db.get_cached_photos(missing)
+            if stored:
+                self.photo_cache.set_many(stored)
+                photos.update(stored)
+                missing = [user_id for user_id in missing if user_id not in stored]
+
+        if missing:
+            fetched = self._fetch_photos(missing)
+            if fetched:
+                self.photo_cache.set_many(fetched)
+                if self.persist_photos:
+                    self.db.cache_photos(fetched, ttl_seconds=self.photo_ttl)
+                photos.update(fetched)
+
+        return {user_id: photos[user_id] for user_id in user_ids if user_id in photos}
+
+    def _fetch_photos(self, user_ids: List[int]) -> Dict[int, List[Dict]]:
+        """
+        Запрашивает топ-3 фото пользователей через execute
+
+        Returns:
+            Словарь {ID пользователя: список фото} только для тех пользователей,
+            для которых получен окончательный ответ (его можно кэшировать)
+        """
+        calls = []
+        for user_id in user_ids:
             # Основные фото профиля
-            profile_photos = self.vk.photos.get(
-                owner_id=user_id,
-                album_id='profile',
-                extended=1,
-                count=30
-            ).get('items', [])
-
-            # Пытаемся получить фото с отметками (если есть права)
-            tagged_photos = []
-            try:
-                tagged_photos = self.vk.photos.getUserPhotos(
-                    user_id=user_id,
-                    extended=1,
-                    count=30
-                ).get('items', [])
-            except ApiError as e:
-                logger.debug(f"No access to tagged photos: {e}")
+            calls.append(('photos.get', {
+                'owner_id': user_id,
+                'album_id': 'profile',
+                'extended': 1,
+                'count': 30
+            }))
+            # Фото с отметками (если есть права)
+            calls.append(('photos.getUserPhotos', {
+                'user_id': user_id,
+                'extended': 1,
+                'count': 30
+            }))
+
+        try:
+            results = self.execute_batch(calls)
+        except Exception as e:
+            logger.error(f"Error getting photos: {e}")
+            return {}
+
+        photos = {}
+        for i, user_id in enumerate(user_ids):
+            (profile, profile_error), (tagged, tagged_error) = results[2 * i], results[2 * i + 1]
+            if profile_error:
+                logger.error(f"Error getting photos of {user_id}: {profile_error.get('error_msg')}")
+                if profile_error.get('error_code') not in self.TRANSIENT_ERROR_CODES:
+                    photos[user_id] = []  # Закрытый или удаленный профиль
+                continue
+            if tagged_error:
+                logger.debug(f"No access to tagged photos: {tagged_error.get('error_msg')}")
 
             # Объединяем и сортируем
             all_photos = sorted(
-                profile_photos + tagged_photos,
+                (profile or {}).get('items', []) + (tagged or {}).get('items', []),
                 key=lambda x: x.get('likes', {}).get('count', 0),
                 reverse=True
             )
+            photos[user_id] = all_photos[:3]  # Топ-3 фото
 
-            return all_photos[:3]  # Топ-3 фото
+        return photos
 
-        except Exception as e:
-            logger.error(f"Error getting photos: {e}")
-            return []
+    def cache_stats(self) -> Dict[str, Dict[str, int]]:
+        """Статистика кэшей обработчика"""
+        return {
+            'photos': self.photo_cache.stats(),
+            'profiles': self.profile_cache.stats(),
+            'names': self.name_cache.stats(),
+            'groups': self.group_cache.stats()
+        }
+
+    def get_user_names(self, user_ids: Iterable[int]) -> Dict[int, Dict[str, str]]:
+        """
+        Получает имена пользователей (для сообщений бота). Имена берутся
+        из кэша профилей или кэша имен, недостающие запрашиваются через
+        users.get без дополнительных полей - полный профиль (с интересами
+        и группами) ради имени не разбирается
+
+        Returns:
+            Словарь {ID пользователя: {'first_name': ..., 'last_name': ...}};
+            пользователи, которых не удалось получить, в словарь не попадают
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        profiles, missing = self.profile_cache.get_many(user_ids)
+        names = {
+            user_id: {'first_name': profile['first_name'], 'last_name': profile['last_name']}
+            for user_id, profile in profiles.items()
+        }
+        found, missing = self.name_cache.get_many(missing)
+        names.update(found)
+
+        for i in range(0, len(missing), self.USERS_GET_LIMIT):
+            chunk = missing[i:i + self.USERS_GET_LIMIT]
+            try:
+                response = self.vk.users.get(user_ids=','.join(map(str, chunk)))
+            except Exception as e:
+                logger.error(f"Error getting user names: {e}")
+                continue
+
+            fetched = {
+                user_data['id']: {
+                    'first_name': user_data.get('first_name', ''),
+                    'last_name': user_data.get('last_name', '')
+                }
+                for user_data in response or []
+            }
+            self.name_cache.set_many(fetched)
+            names.update(fetched)
+
+        return {user_id: names[user_id] for user_id in user_ids if user_id in names}
 
     def like_photo(self, photo_id: int, owner_id: int, user_id: int) -> bool:
         """
-        Ставит лайк на фото и сохраняет информацию в БД
+        Ставит лайк на фото и сохраняет информацию в БД. Повторный лайк
+        проверяется вызывающим кодом (Bot._handle_like), запись в БД
+        идемпотентна
 
         Args:
             photo_id: ID фотографии
@@ -148,11 +470,6 @@ class VKHandler:
             True если лайк успешно поставлен, иначе False
         """
         try:
-            # Проверяем, не ставили ли уже лайк
-            if self.db and self.db.has_liked_photo(user_id, photo_id):
-                logger.info(f"User {user_id} already liked photo {photo_id}")
-                return False
-
             # Ставим лайк через API
             self.vk.likes.add(
                 type='photo',
@@ -160,9 +477,13 @@ class VKHandler:
                 item_id=photo_id
             )
 
-            # Сохраняем информацию о лайке в БД
+            # Сохраняем информацию о лайке в БД: лайк в VK уже поставлен,
+            # поэтому ошибка записи только логируется
             if self.db:
-                self.db.add_like(user_id, owner_id, photo_id)
+                try:
+                    self.db.add_like(user_id, owner_id, photo_id)
+                except Exception as e:
+                    logger.error(f"Like {photo_id} of {owner_id} was not saved: {e}")
 
             return True
         except ApiError as e:
@@ -172,12 +493,19 @@ class VKHandler:
             logger.error(f"Like error: {e}")
             return False
 
-    def create_keyboard(self, user_id: int, photo_id: int) -> str:
-        """Создает интерактивную клавиатуру"""
+    def create_keyboard(self, user_id: int, photo_id: int, callback: bool = False) -> str:
+        """
+        Создает интерактивную клавиатуру
+
+        Args:
+            callback: Callback-кнопки (нажатие приходит событием message_event
+                Bots Long Poll, а не сообщением в диалоге)
+        """
         keyboard = VkKeyboard(inline=True)
+        add_button = keyboard.add_callback_button if callback else keyboard.add_button
 
         # Кнопка добавления в избранное
-        keyboard.add_button(
+        add_button(
             label="❤️ В избранное",
             color=VkKeyboardColor.POSITIVE,
             payload={
@@ -187,7 +515,7 @@ class VKHandler:
         )
 
         # Кнопка лайка фото
-        keyboard.add_button(
+        add_button(
             label="👍 Лайк",
             color=VkKeyboardColor.SECONDARY,
             payload={
@@ -200,14 +528,14 @@ class VKHandler:
         keyboard.add_line()  # Новая строка
 
         # Кнопка следующего пользователя
-        keyboard.add_button(
+        add_button(
             label="➡️ Дальше",
             color=VkKeyboardColor.PRIMARY,
             payload={"type": "next"}
         )
 
         # Кнопка добавления в ЧС
-        keyboard.add_button(
+        add_button(
             label="🚫 ЧС",
             color=VkKeyboardColor.NEGATIVE,
             payload={
@@ -219,6 +547,19 @@ class VKHandler:
         return keyboard.get_keyboard()
 
     # Вспомогательные методы
+    def _parse_profile(self, user_data: Dict, group_names: Dict[int, str]) -> Dict:
+        """Преобразует ответ users.get в профиль пользователя (group_names - названия его групп по ID)"""
+        return {
+            'id': user_data['id'],
+            'first_name': user_data.get('first_name', ''),
+            'last_name': user_data.get('last_name', ''),
+            'sex': user_data.get('sex', 0),
+            'city': self._parse_city(user_data.get('city')),
+            'age': self._calculate_age(user_data.get('bdate')),
+            'interests': self._get_interests(user_data, group_names),
+            'bdate': user_data.get('bdate', '')
+        }
+
     def _parse_city(self, city_data: Any) -> Dict:
         """Парсит данные города"""
         if not city_data:
@@ -243,22 +584,37 @@ class VKHandler:
         except (ValueError, IndexError):
             return 25
 
-    def _get_interests(self, user_data: Dict) -> Dict[str, List[str]]:
-        """Формирует словарь интересов"""
+    def _get_interests(self, user_data: Dict, group_names: Dict[int, str]) -> Dict[str, List[str]]:
+        """Формирует словарь интересов (нормализованные уникальные токены)"""
+        groups = [group_names[group_id] for group_id in user_data.get('groups') or () if group_id in group_names]
         return {
-            'music': user_data.get('music', '').lower().split(','),
-            'books': user_data.get('books', '').lower().split(','),
-            'interests': user_data.get('interests', '').lower().split(','),
-            'groups': self._get_group_names(user_data.get('groups', []))
+            'music': normalize_tokens(user_data.get('music', '')),
+            'books': normalize_tokens(user_data.get('books', '')),
+            'interests': normalize_tokens(user_data.get('interests', '')),
+            'groups': normalize_tokens(groups)
         }
 
-    def _get_group_names(self, group_ids: List[int]) -> List[str]:
-        """Получает названия групп по их ID"""
-        if not group_ids:
-            return []
+    def _get_group_names(self, group_ids: Iterable[int]) -> Dict[int, str]:
+        """
+        Получает названия групп по их ID: из кэша, недостающие - через
+        groups.getById пачками до 500 ID за запрос
 
-        try:
-            groups = self.vk.groups.getById(group_ids=group_ids)
-            return [g['name'].lower() for g in groups]
-        except ApiError:
-            return []
+        Returns:
+            Словарь {ID группы: название в нижнем регистре}; группы, которые
+            не удалось получить, в словарь не попадают
+        """
+        names, missing = self.group_cache.get_many(list(dict.fromkeys(group_ids)))
+
+        for i in range(0, len(missing), self.GROUPS_GET_LIMIT):
+            chunk = missing[i:i + self.GROUPS_GET_LIMIT]
+            try:
+                groups = self.vk.groups.getById(group_ids=','.join(map(str, chunk)))
+            except Exception as e:
+                logger.error(f"Error getting group names: {e}")
+                continue
+
+            fetched = {g['id']: g['name'].lower() for g in groups or () if 'name' in g}
+            self.group_cache.set_many(fetched)
+            names.update(fetched)
+
+        return names
@@ -0,0 +1,206 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+Row = Tuple[Any, ...]
+
+
+class WriteBehindBuffer:
+    """Буфер отложенной записи с групповой фиксацией
+
+    Записи (строки таблиц users/likes/favorites/blacklist) копятся
+    в памяти и сбрасываются одной транзакцией через writer - когда
+    набирается batch_size строк или раз в interval секунд. Если
+    несброшенных строк становится больше max_pending, add() сбрасывает
+    буфер сам (backpressure). Пока строки не зафиксированы в БД, они
+    доступны через pending() - так чтение видит собственные записи.
+
+    Если пачка не записалась из-за временной ошибки (transient_errors,
+    например обрыв соединения), строки возвращаются в буфер. При любой
+    другой ошибке пачка делится пополам, пока не останутся строки,
+    которые не записываются и по одной: они пишутся в лог (dead letter)
+    и отбрасываются, остальные строки пачки записываются.
+    """
+
+    def __init__(self, writer: Callable[[Dict[str, List[Row]]], None], batch_size: int = 100,
+                 interval: float = 1.0, max_pending: int = 10000,
+                 transient_errors: Tuple[Type[BaseException], ...] = ()) -> None:
+        """
+        Args:
+            writer: Записывает пачку строк {таблица: [строки]} одной транзакцией
+            batch_size: Сколько строк накопить перед сбросом
+            interval: Максимальная задержка записи, секунд
+            max_pending: Максимальное количество несброшенных строк
+            transient_errors: Ошибки writer, после которых пачку нужно
+                повторить целиком (остальные ошибки считаются ошибками строк)
+        """
+        self.writer = writer
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self.transient_errors = transient_errors
+
+        # {таблица: [(ID пользователя, строка)]} - ожидают сброса и сбрасываются сейчас
+        self._pending: Dict[str, List[Tuple[int, Row]]] = {}
+        self._inflight: Dict[str, List[Tuple[int, Row]]] = {}
+        self._count = 0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stop = False
+        self._thread: Optional[threading.Thread] = None
+
+        # Статистика
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.flush_time = 0.0
+        self.errors = 0
+        self.dead_rows = 0
+
+    def start(self) -> None:
+        """Запускает поток периодического сброса"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Останавливает поток и сбрасывает оставшиеся записи"""
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def add(self, table: str, user_id: int, row: Row) -> None:
+        """Добавляет строку в буфер"""
+        with self._cond:
+            self._pending.setdefault(table, []).append((user_id, row))
+            self._count += 1
+            count = self._count
+            if count >= self.batch_size:
+                self._cond.notify()
+
+        if count >= self.max_pending:
+            try:
+                self.flush()
+            except Exception:
+                # Ошибка уже записана в лог, строки остались в буфере
+                pass
+
+    def pending(self, table: str, user_id: int) -> List[Row]:
+        """Еще не зафиксированные строки пользователя (в порядке добавления)"""
+        with self._cond:
+            return [
+                row
+                for rows in (self._inflight.get(table, ()), self._pending.get(table, ()))
+                for owner, row in rows
+                if owner == user_id
+            ]
+
+    def flush(self) -> int:
+        """
+        Сбрасывает накопленные строки одной транзакцией
+
+        Returns:
+            Количество записанных строк
+        """
+        with self._flush_lock:
+            with self._cond:
+                if not self._count:
+                    return 0
+                self._inflight, self._pending = self._pending, {}
+                self._count = 0
+
+            started = time.perf_counter()
+            entries = [(table, entry) for table, rows in self._inflight.items() for entry in rows]
+            items = [(index, table, entry) for index, (table, entry) in enumerate(entries)]
+            # {номер строки: True - записана, False - отброшена}
+            done: Dict[int, bool] = {}
+            try:
+                self._write(items, done)
+            except Exception as e:
+                # Временная ошибка: незаписанные строки возвращаются в буфер
+                # и будут записаны при следующем сбросе
+                self.errors += 1
+                logger.error(f"Ошибка отложенной записи ({len(items) - len(done)} строк): {e}")
+                with self._cond:
+                    unwritten: Dict[str, List[Tuple[int, Row]]] = {}
+                    for index, table, entry in items:
+                        if index not in done:
+                            unwritten.setdefault(table, []).append(entry)
+                    for table, rows in unwritten.items():
+                        self._pending[table] = rows + self._pending.get(table, [])
+                        self._count += len(rows)
+                    self._inflight = {}
+                raise
+            finally:
+                self.flushed_rows += sum(done.values())
+
+            with self._cond:
+                self._inflight = {}
+            self.flushes += 1
+            self.flush_time += time.perf_counter() - started
+            return sum(done.values())
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика буфера"""
+        return {
+            'pending': self._count,
+            'flushes': self.flushes,
+            'flushed_rows': self.flushed_rows,
+            'flush_time': self.flush_time,
+            'errors': self.errors,
+            'dead_rows': self.dead_rows
+        }
+
+    def _write(self, items: List[Tuple[int, str, Tuple[int, Row]]], done: Dict[int, bool]) -> None:
+        """
+        Записывает строки (номер, таблица, (ID пользователя, строка)). Если
+        пачка не записалась не из-за временной ошибки, записывает ее половины
+        по отдельности; строка, которая не записывается и одна, отбрасывается
+        """
+        batch: Dict[str, List[Row]] = {}
+        for _, table, (_, row) in items:
+            batch.setdefault(table, []).append(row)
+
+        try:
+            self.writer(batch)
+        except self.transient_errors:
+            raise
+        except Exception as e:
+            if len(items) == 1:
+                # Повтор эту строку не запишет - она уходит в лог
+                index, table, (_, row) = items[0]
+                done[index] = False
+                self.dead_rows += 1
+                logger.error(f"❌ Строка {table} отброшена (всего: {self.dead_rows}): {row!r}: {e}")
+                return
+            self.errors += 1
+            logger.warning(f"Ошибка записи пачки ({len(items)} строк), запись по частям: {e}")
+            middle = len(items) // 2
+            self._write(items[:middle], done)
+            self._write(items[middle:], done)
+            return
+
+        for index, _, _ in items:
+            done[index] = True
+
+    def _loop(self) -> None:
+        """Сбрасывает буфер по таймеру или при наборе batch_size строк"""
+        while True:
+            with self._cond:
+                if not self._stop and self._count < self.batch_size:
+                    self._cond.wait(self.interval)
+                if self._stop:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                # Ошибка уже записана в лог, повтор - на следующем шаге
+                time.sleep(self.interval)